@@ -2,6 +2,13 @@
 This script allows creating the database schema from scratch.
 Using the SQLalchemy declarative schema classes
 """
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import Sequence, inspect
+from sqlalchemy.dialects.postgresql import ENUM
+from sqlalchemy.schema import AddConstraint, CreateIndex, CreateTable, DropTable
+
 from dbal.database import Database
 from dbal.schemas.common import Base
 from os import chdir
@@ -21,18 +28,168 @@ class VersionedDatabaseException(Exception):
             "schema to its last version.")
 
 
-def drop_table(engine, *args, All=None):
+def _run_in_parallel(engine, ddl_elements, jobs):
+    """
+    Execute each DDL element in its own connection and transaction
+    :param engine: <sqlalchemy.engine.Engine>
+    :param ddl_elements: <list>. DDL elements or statements
+    :param jobs: <int>. Number of concurrent connections
+    :return:
+    """
+    def run(element):
+        with engine.begin() as conn:
+            conn.execute(element)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Consume the results so the first error is raised
+        list(executor.map(run, ddl_elements))
+
+
+def _disjoint_waves(foreign_keys):
+    """
+    Group the foreign keys so that no two of them in a group touch the same table.
+    Adding (or dropping) a foreign key locks both tables against each other, so
+    the keys of a group can run concurrently without blocking (or deadlocking).
+    :param foreign_keys: <list>.<tuple>. (foreign key, (table, referred table))
+    :return: <list>.<list>. The foreign keys of each group
+    """
+    waves = []
+    for fk, tables in foreign_keys:
+        tables = set(tables)
+        for wave, locked in waves:
+            if not locked & tables:
+                wave.append(fk)
+                locked |= tables
+                break
+        else:
+            waves.append(([fk], tables))
+    return [wave for wave, _ in waves]
+
+
+def _enum_types(engine, tables):
+    # The postgres ENUM types are shared between tables, so they are created (and
+    # dropped) once, out of the parallel phases
+    types = dict()
+    for table in tables:
+        for column in table.columns:
+            impl = column.type.dialect_impl(engine.dialect)
+            if isinstance(impl, ENUM) and impl.name:
+                types.setdefault(impl.name, impl)
+    return list(types.values())
+
+
+def _sequences(tables, metadata=None):
+    # CreateTable does not emit the explicit sequences (create_all creates them
+    # before the tables), so they are created (and dropped) out of the parallel
+    # phases as well
+    sequences = dict()
+    if metadata is not None:
+        for sequence in metadata._sequences.values():
+            sequences[(sequence.schema, sequence.name)] = sequence
+    for table in tables:
+        for column in table.columns:
+            if isinstance(column.default, Sequence):
+                sequence = column.default
+                sequences.setdefault((sequence.schema, sequence.name), sequence)
+    return list(sequences.values())
+
+
+def parallel_create(engine, tables, jobs, metadata=None):
+    """
+    Create the tables over several connections. All the tables are created first,
+    without foreign keys nor indexes, since without foreign keys they do not depend
+    on each other. Then the indexes and, finally, the foreign keys are built
+    concurrently as well.
+    :param engine: <sqlalchemy.engine.Engine>
+    :param tables: <list>.<sqlalchemy.Table>
+    :param jobs: <int>. Number of concurrent connections
+    :param metadata: <sqlalchemy.MetaData>. If set, its standalone sequences are
+        created as well
+    :return: <dict>. The timings (in seconds) of every phase
+    """
+    timings = dict()
+    start = time.time()
+    for enum in _enum_types(engine, tables):
+        enum.create(engine, checkfirst=True)
+    for sequence in _sequences(tables, metadata):
+        sequence.create(engine, checkfirst=True)
+    _run_in_parallel(engine, [CreateTable(table, include_foreign_key_constraints=[])
+                              for table in tables], jobs)
+    timings['tables'] = time.time() - start
+
+    start = time.time()
+    _run_in_parallel(engine, [CreateIndex(index) for table in tables
+                              for index in table.indexes], jobs)
+    timings['indexes'] = time.time() - start
+
+    start = time.time()
+    foreign_keys = [(fk, (table, fk.referred_table)) for table in tables
+                    for fk in table.foreign_key_constraints]
+    for wave in _disjoint_waves(foreign_keys):
+        _run_in_parallel(engine, [AddConstraint(fk) for fk in wave], jobs)
+    timings['foreign_keys'] = time.time() - start
+    return timings
+
+
+def parallel_drop(engine, tables, jobs, metadata=None):
+    """
+    Drop the tables over several connections. The foreign keys between them are
+    dropped first, so the tables can be dropped concurrently
+    :param engine: <sqlalchemy.engine.Engine>
+    :param tables: <list>.<sqlalchemy.Table>
+    :param jobs: <int>. Number of concurrent connections
+    :param metadata: <sqlalchemy.MetaData>. If set, its standalone sequences are
+        dropped as well
+    :return: <dict>. The timings (in seconds) of every phase
+    """
+    timings = dict()
+    start = time.time()
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    existent = [table for table in tables
+                if engine.dialect.has_table(engine, table.name, schema=table.schema)]
+    foreign_keys = []
+    for table in existent:
+        # The constraints may be unnamed in the schema classes, so the names are
+        # taken from the database
+        for fk in inspector.get_foreign_keys(table.name, schema=table.schema):
+            statement = 'ALTER TABLE {} DROP CONSTRAINT {}'.format(
+                preparer.format_table(table), preparer.quote(fk['name']))
+            referred = (fk['referred_schema'], fk['referred_table'])
+            foreign_keys.append((statement, ((table.schema, table.name), referred)))
+    for wave in _disjoint_waves(foreign_keys):
+        _run_in_parallel(engine, wave, jobs)
+    timings['foreign_keys'] = time.time() - start
+
+    start = time.time()
+    _run_in_parallel(engine, [DropTable(table) for table in existent], jobs)
+    for sequence in _sequences(tables, metadata):
+        sequence.drop(engine, checkfirst=True)
+    for enum in _enum_types(engine, tables):
+        enum.drop(engine, checkfirst=True)
+    timings['tables'] = time.time() - start
+    return timings
+
+
+def drop_table(engine, *args, All=None, jobs=1):
     """
     Drop tables from the db
     :param All: set True if you want to delete all tables. Use with caution!!!
     :param args: Set the object table classes you want to drop.
-    :return:
+    :param jobs: <int>. If greater than 1, the tables are dropped over that number
+        of concurrent connections
+    :return: <dict>. The timings of every phase, if jobs is greater than 1
     """
     meta = Base.metadata
 
     if All is None:
         All = False
     try:
+        if jobs > 1:
+            tables = (meta.sorted_tables if All
+                      else [table.__table__ for table in args])
+            return parallel_drop(engine, tables, jobs,
+                                 metadata=meta if All else None)
         if All:
             meta.drop_all(engine)
         else:
@@ -44,17 +201,24 @@ def drop_table(engine, *args, All=None):
         raise e
 
 
-def create_table(engine, *args, All=None):
+def create_table(engine, *args, All=None, jobs=1):
     """
     Create tables in the db
     :param All: set True if you want to delete all tables. Use with caution!!!
     :param args: Set the object table classes you want to drop.
-    :return:
+    :param jobs: <int>. If greater than 1, the tables are created over that number
+        of concurrent connections
+    :return: <dict>. The timings of every phase, if jobs is greater than 1
     """
     meta = Base.metadata
     if All is None:
         All = False
     try:
+        if jobs > 1:
+            tables = (meta.sorted_tables if All
+                      else [table.__table__ for table in args])
+            return parallel_create(engine, tables, jobs,
+                                   metadata=meta if All else None)
         if All:
             meta.create_all(engine)
         else:
@@ -66,6 +230,21 @@ def create_table(engine, *args, All=None):
         raise e
 
 
+def create_partitions(database, policies=None):
+    """
+    Create the partitions of the partitioned tables according to their partition
+    policies. See Database.maintain_partitions
+    :param database: <Database>
+    :param policies: <dict>. The dbal.partitioning.PartitionPolicy by table name.
+        If None, the ones set in the declarative tables
+    :return: <dict>. The (created, expired) partitions by table name
+    """
+    if policies is None and not any('partition_policy' in table.info
+                                    for table in Base.metadata.sorted_tables):
+        return dict()
+    return database.maintain_partitions(policies=policies, commit=True)
+
+
 def stamp_alembic_head():
     module_path = package_path.split('/')[:-1]
     alembic_path = package_path.split('/')[:-1]
@@ -87,26 +266,32 @@ def check_if_versioned_db(database):
         raise VersionedDatabaseException
 
 
-def main(database_obj):
+def main(database_obj, jobs=1):
     """
     Create all schemas according to the declarative schema classes,
     only if there is no tables created yet
-    :return:
+    :param jobs: <int>. Number of concurrent connections used to create the schema
+    :return: <dict>. The timings of every phase, if jobs is greater than 1
     """
 
     # Create all tables if there is no one created yet
     # To implement with alembic
     # check_if_versioned_db(database_obj)
     engine = database_obj.engine
-    create_table(engine, All=True)
+    timings = create_table(engine, All=True, jobs=jobs)
+    # Create the first partitions of the partitioned tables with a policy
+    create_partitions(database_obj)
     # Stamp the last version of the database control version
     # To implement with alembic
     # stamp_alembic_head()
+    return timings
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of concurrent connections. Default=1')
     args = parser.parse_args()
 
-    db = Database()
-    main(db)
+    db = Database(pool_size=args.jobs)
+    main(db, jobs=args.jobs)
@@ -0,0 +1,140 @@
+"""
+This module contains the admission control of the Database class: the queries run
+in named lanes, each one with its own concurrency limit, priority, queue timeout and
+statement timeout, so heavy (batch) queries cannot take all the pool connections
+from the latency sensitive ones.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+
+class AdmissionTimeout(Exception):
+    def __init__(self, lane, timeout):
+        super().__init__('The query waited more than {} seconds to be admitted in '
+                         'the "{}" lane'.format(timeout, lane))
+
+
+class Lane(object):
+    """
+    The definition of a lane
+    """
+
+    def __init__(self, name, max_concurrency, priority=0, queue_timeout=None,
+                 statement_timeout=None):
+        """
+        :param name: <str>
+        :param max_concurrency: <int>. Max number of queries running at the same time
+        :param priority: <int>. When a connection is released, the waiting query of
+            the lane with the highest priority is admitted first
+        :param queue_timeout: <float>. Max seconds waiting to be admitted. If None,
+            wait forever
+        :param statement_timeout: <int>. The postgres statement_timeout (in
+            milliseconds) of the queries of the lane. If None, the server one
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.priority = priority
+        self.queue_timeout = queue_timeout
+        self.statement_timeout = statement_timeout
+
+
+class AdmissionController(object):
+    """
+    Admit the queries of every lane, respecting the lanes concurrency limits, the
+    total capacity and the priorities.
+    """
+
+    def __init__(self, lanes, capacity=None):
+        """
+        :param lanes: <list>.<Lane>
+        :param capacity: <int>. Max number of queries running at the same time in
+            all the lanes (e.g. the pool size). If None, just the lane limits apply
+        """
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.capacity = capacity
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._waiting = []
+        self._running_total = 0
+        self._running = {name: 0 for name in self.lanes}
+        self._stats = {name: {'admitted': 0, 'timeouts': 0, 'wait_seconds': 0.0,
+                              'max_wait_seconds': 0.0}
+                       for name in self.lanes}
+        self._local = threading.local()
+
+    def _has_room(self, name):
+        if self._running[name] >= self.lanes[name].max_concurrency:
+            return False
+        return self.capacity is None or self._running_total < self.capacity
+
+    def _may_run(self, ticket):
+        # No waiting query with a higher priority (or the same one, but older) that
+        # could run instead
+        for other in self._waiting:
+            if other < ticket and self._has_room(other[2]):
+                return False
+        return self._has_room(ticket[2])
+
+    def acquire(self, name):
+        """
+        Wait until the query is admitted in the lane
+        :param name: <str>. The lane name
+        :return: <bool>. False if the thread was already admitted (nested calls)
+        """
+        if getattr(self._local, 'lane', None) is not None:
+            return False
+        lane = self.lanes[name]
+        # heapq pops the lowest ticket first, so the priority is negated
+        ticket = (-lane.priority, next(self._sequence), name)
+        start = time.time()
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while not self._may_run(ticket):
+                    remaining = None
+                    if lane.queue_timeout is not None:
+                        remaining = lane.queue_timeout - (time.time() - start)
+                        if remaining <= 0:
+                            self._stats[name]['timeouts'] += 1
+                            raise AdmissionTimeout(name, lane.queue_timeout)
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                # Other waiting queries may run now that this one left the queue
+                self._condition.notify_all()
+            self._running[name] += 1
+            self._running_total += 1
+            waited = time.time() - start
+            stats = self._stats[name]
+            stats['admitted'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+        self._local.lane = name
+        return True
+
+    def release(self, name):
+        self._local.lane = None
+        with self._condition:
+            self._running[name] -= 1
+            self._running_total -= 1
+            self._condition.notify_all()
+
+    def metrics(self):
+        """
+        :return: <dict>. By lane: the queue depth, the running queries, and the
+            admitted queries, timeouts and wait times (in seconds)
+        """
+        with self._condition:
+            metrics = dict()
+            for name, stats in self._stats.items():
+                metrics[name] = dict(
+                    stats,
+                    queue_depth=sum(1 for ticket in self._waiting if ticket[2] == name),
+                    running=self._running[name],
+                    avg_wait_seconds=(stats['wait_seconds'] / stats['admitted']
+                                      if stats['admitted'] else None),
+                )
+            return metrics
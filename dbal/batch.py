@@ -0,0 +1,155 @@
+"""
+This module contains the Batch class, used by Database.batch, which queues many
+small statements and sends them to the database in as few round trips as possible.
+"""
+from concurrent.futures import Future
+
+
+class Batch(object):
+    """
+    Queue statements and ORM writes, and send them when the block ends. E.g:
+
+        with db.batch() as batch:
+            first = batch.execute('UPDATE runs SET status = %s WHERE run_id = %s',
+                                  ('done', 5))
+            second = batch.execute('SELECT count(*) FROM runs', fetch=True)
+            batch.write(PipeRun(name='new'))
+        second.result()  # [(10,)]
+
+    The queued statements are rendered (mogrified) and joined into multi-statement
+    pages, so a page costs just one round trip. Since the database only returns
+    the result of the last statement of a page, a page is always ended right after
+    a statement whose rows must be fetched. Consecutive ORM writes are flushed
+    together, in their queue position.
+    Every method returns a future, resolved once the whole batch was sent (and
+    committed), or failed if any part of it failed.
+    """
+
+    def __init__(self, db, commit=True, page_size=100):
+        """
+        :param db: <Database>
+        :param commit: <bool>. Commit when the block ends
+        :param page_size: <int>. Max number of statements by round trip
+        """
+        self._db = db
+        self._commit = commit
+        self._page_size = page_size
+        self._queue = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            for _, _, future in self._queue:
+                future.cancel()
+            self._queue = []
+            return False
+        self.send(commit=self._commit)
+        return False
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _enqueue(self, kind, item):
+        future = Future()
+        self._queue.append((kind, item, future))
+        return future
+
+    def execute(self, query, params=None, fetch=False):
+        """
+        :param query: <str>. A psycopg2 parameterized query. E.g:
+            'UPDATE runs SET status = %s WHERE run_id = %s'
+        :param params: <tuple> or <dict>
+        :param fetch: <bool>. Set True if you want the rows returned by the
+            statement (e.g. a SELECT or a RETURNING clause)
+        :return: <Future>. Resolved to the fetched rows, or None
+        """
+        return self._enqueue('fetch' if fetch else 'statement', (query, params))
+
+    def execute_many(self, query, params_list):
+        """
+        Queue the same statement once for every params item (like execute_batch)
+        :param query: <str>
+        :param params_list: <iterable>.<tuple>
+        :return: <list>.<Future>
+        """
+        return [self.execute(query, params) for params in params_list]
+
+    def write(self, obj):
+        """
+        Queue the write of a declarative object
+        :param obj: <sqlalchemy.ext.declarative.api.DeclarativeMeta> instance
+        :return: <Future>. Resolved to the (flushed) object
+        """
+        return self._enqueue('write', obj)
+
+    def update(self, obj=None):
+        """
+        Queue the flush of the changed (dirty) objects of the session, e.g. after
+        setting the attributes of already loaded objects. It is flushed along with
+        the consecutive writes
+        :param obj: <sqlalchemy.ext.declarative.api.DeclarativeMeta> instance.
+            Optional, it is added to the session if it was detached
+        :return: <Future>. Resolved to the object
+        """
+        return self._enqueue('write', obj)
+
+    def send(self, commit=False):
+        """
+        Send all the queued statements and writes. Called when the block ends.
+        The futures are resolved once every page was sent (and committed, if
+        commit is set). If any page fails the transaction is rolled back, so all
+        the futures fail
+        :param commit: <bool>. Commit after sending
+        :return:
+        """
+        queue, self._queue = self._queue, []
+        try:
+            results = self._send(queue)
+            if commit:
+                self._db.commit()
+        except Exception as e:
+            self._db.rollback()
+            # The transaction was rolled back, so none of the statements persisted
+            for _, _, future in queue:
+                future.set_exception(e)
+            raise e
+        for future, result in results:
+            future.set_result(result)
+
+    def _send(self, queue):
+        """
+        :return: <list>.<tuple>. (future, result) of every queued item
+        """
+        results = []
+        cursor = None
+        position = 0
+        while position < len(queue):
+            kind, item, future = queue[position]
+            if kind == 'write':
+                # Flush the run of consecutive writes at once
+                writes = []
+                while position < len(queue) and queue[position][0] == 'write':
+                    writes.append(queue[position])
+                    position += 1
+                self._db.session.add_all([w[1] for w in writes if w[1] is not None])
+                self._db.session.flush()
+                results.extend((write_future, obj) for _, obj, write_future in writes)
+                continue
+            if cursor is None:
+                cursor = self._db.cursor
+            page = []
+            while (position < len(queue) and queue[position][0] != 'write' and
+                   len(page) < self._page_size):
+                page.append(queue[position])
+                position += 1
+                if page[-1][0] == 'fetch':
+                    break
+            cursor.execute(b';'.join(cursor.mogrify(query, params)
+                                     for _, (query, params), _ in page))
+            rows = cursor.fetchall() if page[-1][0] == 'fetch' else None
+            results.extend((statement_future, None)
+                           for _, _, statement_future in page[:-1])
+            results.append((page[-1][2], rows))
+        return results
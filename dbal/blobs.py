@@ -0,0 +1,212 @@
+"""
+This module contains the blob streaming used by Database.write_blob and
+Database.read_blob. The blobs are transferred in fixed size chunks, either as
+postgres large objects or as rows of a bytea chunks table, so a transfer never
+holds more than a chunk in memory (instead of the whole value plus its escaped
+copy built by mogrify).
+"""
+import io
+
+from psycopg2 import Binary
+
+CHUNKS_TABLE = 'dbal_blob_chunks'
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def _chunks(source, chunk_size):
+    """
+    :param source: A file-like object (with read or readinto), or a bytes-like one
+        (bytes, bytearray, memoryview)
+    :param chunk_size: <int>
+    :return: <iterator>. The chunks: the bytes read by read(), or memoryviews. A
+        memoryview of a file chunk is valid until the next one is read
+    """
+    if not hasattr(source, 'read'):
+        view = memoryview(source).cast('B')
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+        return
+    if hasattr(source, 'readinto'):
+        # The same buffer is reused for every chunk
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            size = source.readinto(view)
+            if not size:
+                return
+            yield view[:size]
+    else:
+        while True:
+            data = source.read(chunk_size)
+            if not data:
+                return
+            yield data
+
+
+def write_large_object(conn, source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write a new large object. It is part of the connection transaction
+    :param conn: <psycopg2.connection>
+    :param source: A file-like or bytes-like object
+    :param chunk_size: <int>
+    :return: <tuple>. (oid, bytes written)
+    """
+    lobject = conn.lobject(0, 'wb')
+    written = 0
+    try:
+        for chunk in _chunks(source, chunk_size):
+            # lobject.write takes just bytes (or str), so only the views are copied
+            written += lobject.write(chunk if isinstance(chunk, bytes)
+                                     else chunk.tobytes())
+    finally:
+        lobject.close()
+    return lobject.oid, written
+
+
+def _ensure_chunks_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS {} (
+            blob_key TEXT NOT NULL,
+            chunk INTEGER NOT NULL,
+            data BYTEA NOT NULL,
+            PRIMARY KEY (blob_key, chunk)
+        )""".format(CHUNKS_TABLE))
+
+
+def write_chunks(conn, key, source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write (or overwrite) a blob as rows of the bytea chunks table, one by chunk.
+    It is part of the connection transaction
+    :param conn: <psycopg2.connection>
+    :param key: <str>
+    :param source: A file-like or bytes-like object
+    :param chunk_size: <int>
+    :return: <int>. The bytes written
+    """
+    cursor = conn.cursor()
+    _ensure_chunks_table(cursor)
+    cursor.execute('DELETE FROM {} WHERE blob_key = %s'.format(CHUNKS_TABLE), (key,))
+    written = 0
+    for position, chunk in enumerate(_chunks(source, chunk_size)):
+        cursor.execute('INSERT INTO {} (blob_key, chunk, data) VALUES (%s, %s, %s)'
+                       .format(CHUNKS_TABLE), (key, position, Binary(chunk)))
+        written += len(chunk)
+    return written
+
+
+class _ChunksReader(io.RawIOBase):
+    """
+    A readable stream that fetches the blob one chunk at a time
+    """
+
+    def __init__(self, fetch, release=None):
+        """
+        :param fetch: <callable>. It takes the chunk position and returns the chunk
+            (bytes-like), or None after the last one
+        :param release: <callable>. Called once, at the end of the blob or when the
+            stream is closed (e.g. to close its connection)
+        """
+        super().__init__()
+        self._fetch = fetch
+        self._release = release
+        self._position = 0
+        self._chunk = memoryview(b'')
+        self._finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._chunk and not self._finished:
+            chunk = self._fetch(self._position)
+            self._position += 1
+            if chunk is None:
+                self._finished = True
+                self._release_once()
+            else:
+                # The bytea memoryviews have their own format ('c'), which cannot
+                # be assigned to the caller buffer ('B')
+                self._chunk = memoryview(chunk).cast('B')
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        self._release_once()
+        super().close()
+
+    def _release_once(self):
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+def read_large_object(conn, oid, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Open a large object as a readable stream. It must be read before the
+    connection transaction ends
+    :param conn: <psycopg2.connection>
+    :param oid: <int>
+    :param chunk_size: <int>
+    :return: <io.BufferedReader>
+    """
+    lobject = conn.lobject(oid, 'rb')
+
+    def fetch(_):
+        data = lobject.read(chunk_size)
+        return data if data else None
+
+    return io.BufferedReader(_ChunksReader(fetch, lobject.close),
+                             buffer_size=chunk_size)
+
+
+def read_chunks(engine, key):
+    """
+    Open a blob of the bytea chunks table as a readable stream. The stream has its
+    own connection, closed at the end of the blob or when the stream is closed, so
+    it is still readable after the session transaction ends
+    :param engine: <sqlalchemy.engine.Engine>
+    :param key: <str>
+    :return: <io.BufferedReader>
+    """
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        # All the chunks are read from the same snapshot, even if the blob is
+        # overwritten meanwhile
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        cursor.execute('SELECT max(length(data)) FROM {} WHERE blob_key = %s'
+                       .format(CHUNKS_TABLE), (key,))
+        chunk_size = cursor.fetchone()[0]
+        if chunk_size is None:
+            raise KeyError('There is no blob with the key {}'.format(key))
+    except Exception:
+        conn.close()
+        raise
+
+    def fetch(position):
+        cursor.execute('SELECT data FROM {} WHERE blob_key = %s AND chunk = %s'
+                       .format(CHUNKS_TABLE), (key, position))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def release():
+        conn.rollback()
+        conn.close()
+
+    return io.BufferedReader(_ChunksReader(fetch, release), buffer_size=chunk_size)
+
+
+def delete_blob(conn, oid_or_key):
+    """
+    :param conn: <psycopg2.connection>
+    :param oid_or_key: <int> (a large object) or <str> (a bytea chunks blob)
+    :return:
+    """
+    if isinstance(oid_or_key, int):
+        conn.lobject(oid_or_key, 'n').unlink()
+    else:
+        conn.cursor().execute('DELETE FROM {} WHERE blob_key = %s'
+                              .format(CHUNKS_TABLE), (oid_or_key,))
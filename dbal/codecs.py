@@ -0,0 +1,224 @@
+"""
+This module contains the codecs that cast python values to postgres data types.
+A codec is looked up by the postgres type name once, and the row converters are
+built once per column types tuple, so the bulk operations do not have to
+compare type names for every value.
+"""
+import json
+import uuid as _uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from functools import lru_cache
+
+from psycopg2.extras import Json
+
+
+class NonCasteableType(Exception):
+    def __init__(self, _type):
+        super().__init__('data type non casteable: {}'.format(_type))
+
+
+_json_dumps = json.dumps
+
+
+def set_json_encoder(dumps):
+    """
+    Plug a faster json encoder in (e.g. orjson.dumps or ujson.dumps). The encoders
+    returning bytes are supported as well
+    :param dumps: <callable>. It must take the object to encode
+    :return:
+    """
+    global _json_dumps
+    if isinstance(dumps({}), bytes):
+        _json_dumps = lambda value: dumps(value).decode('utf-8')
+    else:
+        _json_dumps = dumps
+    # The built converters hold the previous encoder
+    row_converter.cache_clear()
+
+
+def _to_json(value):
+    return _json_dumps(value)
+
+
+class _JsonElement(Json):
+    """
+    A json array element. It is cast to its type, so the array is a json[] or
+    jsonb[] one instead of a text[] one
+    """
+
+    def __init__(self, adapted, _type):
+        super().__init__(adapted, dumps=_to_json)
+        self._type = _type
+
+    def getquoted(self):
+        return super().getquoted() + '::{}'.format(self._type).encode('ascii')
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ('t', 'true', 'y', 'yes', 'on', '1'):
+            return True
+        if lowered in ('f', 'false', 'n', 'no', 'off', '0'):
+            return False
+        raise ValueError('{} is not a boolean'.format(value))
+    return bool(value)
+
+
+def _to_numeric(value):
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, float):
+        # Use the shortest representation, not the binary expansion
+        return Decimal(repr(value))
+    return Decimal(value)
+
+
+def _to_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    return datetime.fromisoformat(value)
+
+
+def _to_timestamptz(value):
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    return _to_timestamptz(datetime.fromisoformat(value))
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def _to_uuid(value):
+    return value if isinstance(value, _uuid.UUID) else _uuid.UUID(value)
+
+
+def _to_bytea(value):
+    # bytes, bytearray and memoryview are adapted by psycopg2 without copying
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+_CODECS = {
+    'int': int,
+    'integer': int,
+    'smallint': int,
+    'bigint': int,
+    'serial': int,
+    'bigserial': int,
+    'float': float,
+    'real': float,
+    'double precision': float,
+    'numeric': _to_numeric,
+    'decimal': _to_numeric,
+    'varchar': str,
+    'text': str,
+    'bool': _to_bool,
+    'boolean': _to_bool,
+    'timestamp': _to_timestamp,
+    'timestamptz': _to_timestamptz,
+    'date': _to_date,
+    'json': _to_json,
+    'jsonb': _to_json,
+    'uuid': _to_uuid,
+    'bytea': _to_bytea,
+}
+
+
+def register_codec(_type, codec):
+    """
+    Register (or replace) the codec of a postgres type
+    :param _type: <str>. The postgres type name. E.g: 'inet'
+    :param codec: <callable>. It takes a non null python value and returns the value
+        to be adapted by psycopg2
+    :return:
+    """
+    _CODECS[_type.lower()] = codec
+    get_codec.cache_clear()
+    row_converter.cache_clear()
+
+
+def _array_codec(element_codec):
+    def to_array(value):
+        return [None if item is None
+                else to_array(item) if isinstance(item, (list, tuple))
+                else element_codec(item)
+                for item in value]
+    return to_array
+
+
+@lru_cache(maxsize=None)
+def get_codec(_type):
+    """
+    :param _type: <str>. The postgres type name. Arrays are written as 'int[]'.
+        The type modifiers are ignored, e.g. 'varchar(20)' or 'numeric(10, 2)'
+    :return: <callable>. The codec for non null values
+    """
+    name = _type.strip().lower()
+    if name.endswith('[]'):
+        element = name[:-2].strip()
+        if element in ('json', 'jsonb'):
+            return _array_codec(lambda value: _JsonElement(value, element))
+        return _array_codec(get_codec(element))
+    name = name.split('(')[0].strip()
+    if name in ('timestamp with time zone', 'timestamp without time zone'):
+        name = 'timestamptz' if 'with time' in name else 'timestamp'
+    if name not in _CODECS:
+        raise NonCasteableType(_type)
+    if name in ('json', 'jsonb'):
+        # Resolved on every call, so set_json_encoder applies to this codec too
+        return _to_json
+    return _CODECS[name]
+
+
+def serialize(_value, _type):
+    """
+    Serialize an object to a postgres data type, according to the specified type
+    :param _value: the value to cast
+    :param _type: the final object cast type
+    :return:
+    """
+    if _value is None:
+        return None
+    return get_codec(_type)(_value)
+
+
+@lru_cache(maxsize=256)
+def row_converter(types):
+    """
+    Build a function converting a whole row (a tuple of values in the types
+    order). The codecs are looked up once for each types tuple
+    :param types: <tuple>.<str>. The postgres type of each column. None means the
+        value is passed as it is
+    :return: <callable>. It takes a row and returns a tuple
+    """
+    codecs = tuple(None if _type is None else get_codec(_type) for _type in types)
+
+    def convert(row):
+        if len(row) != len(codecs):
+            raise ValueError('The row has {} values, {} expected'.format(
+                len(row), len(codecs)))
+        return tuple(value if codec is None or value is None else codec(value)
+                     for codec, value in zip(codecs, row))
+    return convert
+
+
+def convert_rows(types, rows):
+    """
+    Lazily convert the rows to the postgres types
+    :param types: <tuple>.<str>
+    :param rows: <iterable>.<tuple>
+    :return: <iterator>.<tuple>
+    """
+    return map(row_converter(tuple(types)), rows)
@@ -1,28 +1,7 @@
-import json
-import uuid as _uuid
 from abc import ABCMeta, abstractmethod
 
-
-def serialize(_value, _type):
-    """
-    Serialize an object to a postgres data type, according to the specified type
-    :param _value: the value to cast
-    :param _type: the final object cast type
-    :return:
-    """
-    if _value is None:
-        return None
-    elif _type == 'int':
-        return int(_value)
-    elif _type == 'varchar':
-        return str(_value)
-    elif _type == 'jsonb':
-        return json.dumps(_value)
-    elif _type == 'uuid':
-        val = _value if isinstance(_value, _uuid.UUID) else _uuid.UUID(_value)
-        return val
-    else:
-        raise Exception('data type non casteable')
+# The serialization lives in the codecs module. It is kept importable from here
+from dbal.codecs import serialize
 
 
 class NoObjectError(Exception):
@@ -59,7 +38,11 @@ class BaseController(metaclass=ABCMeta):
     an object into the database use the "new" classmethod, if you want to retrieve it,
     use the "from_id" classmethod. Each subclass may contain some other human
     friendly retrieving classmethods, like "from_name", "from_date" and so on.
+    Set "base_model_cls" to the declarative class of the controller if you want
+    the default "new_many" implementation.
     """
+    base_model_cls = None
+
     def __init__(self, db, _base_model=None):
         """
         :param db: <Database>
@@ -80,6 +63,33 @@ class BaseController(metaclass=ABCMeta):
         """
         pass
 
+    @classmethod
+    def new_many(cls, db, rows, commit=True):
+        """
+        Create many new objects and save them in the database with a single bulk
+        insert (by page), instead of one flush and commit by object.
+        :param db: <Database>
+        :param rows: <list>.<dict>. The attributes of each object
+        :param commit: <bool>
+        :return: <list>.cls
+        """
+        if cls.base_model_cls is None:
+            raise NotImplementedError('Set the base_model_cls class attribute or '
+                                      'override new_many')
+        models = db.write_many(cls.base_model_cls, rows, commit=commit)
+        return [cls.from_base_model(db, model) for model in models]
+
+    @classmethod
+    def from_base_model(cls, db, base_model):
+        """
+        Build the controller from its (already persisted) database schema object.
+        Override it if the subclass constructor takes other arguments.
+        :param db: <Database>
+        :param base_model: <Base Model>
+        :return: cls
+        """
+        return cls(db, _base_model=base_model)
+
     @classmethod
     @abstractmethod
     def from_id(cls, db, base_cls_id):
@@ -121,6 +131,37 @@ class WriteableObject(metaclass=ABCMeta):
         """
         pass
 
+    def to_model(self):
+        """
+        Build the database schema object (AKA declarative base) to be written.
+        Needed by the default "write_many" implementation.
+        :return: <Base Model>
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def write_many(cls, db, objects, commit=True):
+        """
+        Writes many objects in the database with a single bulk insert (by page),
+        instead of one flush and commit by object. The ids (and the models) of the
+        objects are set from the returned rows.
+        :param db: <Database>
+        :param objects: <list>.cls. All of them must be models of the same table
+        :param commit: <bool>
+        :return: <list>.cls. The same objects
+        """
+        if not objects:
+            return objects
+        models = [obj.to_model() for obj in objects]
+        written = db.write_many(type(models[0]), models, commit=commit)
+        primary_key = db.get_primary_key(type(models[0]))
+        # write_many returns the models in the same order, with the returned
+        # columns already loaded (reading them does not query the database)
+        for obj, model in zip(objects, written):
+            obj._model = model
+            obj._id = model.__dict__[primary_key]
+        return objects
+
     @classmethod
     @abstractmethod
     def from_model(cls, *args, **kwargs):
@@ -2,11 +2,22 @@
 This module aims to contain all the classes and functions needed
  to manipulate the databases.
 """
+import os
+import threading
+import time
+import warnings
+from contextlib import contextmanager
 from functools import lru_cache
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import sessionmaker, scoped_session, make_transient_to_detached
 
 from dbal.Config import Config_db
+from dbal.admission import AdmissionController
+from dbal.batch import Batch
+from dbal.scan import parallel_scan
+from dbal import blobs, notify, partitioning, reflection, transfer
+from dbal.resumable import resumable_bulk
+from dbal.codecs import convert_rows
 
 from dbal.schemas.common import Base
 
@@ -76,6 +87,74 @@ class Singleton(type):
     #     return cls._instance
 
 
+class LongTransactionWarning(UserWarning):
+    pass
+
+
+def _memory_usage():
+    """
+    The resident memory of the process, in bytes. None if it cannot be known
+    (it is read from /proc, so just in linux)
+    :return: <int>
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class SessionPolicy(object):
+    """
+    Define when a long-lived session must be recycled, i.e. when all the objects in
+    its identity map are expunged (or the session is closed), so its memory does
+    not grow with every object ever read.
+    The session is only recycled when it has no pending changes, right after a
+    commit or a rollback, or before a read.
+    """
+
+    def __init__(self, max_objects=None, max_age=None, max_memory=None,
+                 warn_transaction_age=None, close=False):
+        """
+        :param max_objects: <int>. Recycle when the identity map holds more objects
+        :param max_age: <float>. Recycle when the session is older (in seconds)
+        :param max_memory: <int>. Recycle when the process resident memory is
+            greater (in bytes)
+        :param warn_transaction_age: <float>. Warn (LongTransactionWarning) when a
+            transaction has been open for longer (in seconds). Useful in dev_mode,
+            where the transaction is never committed and blocks the vacuum
+        :param close: <bool>. Close the session (returning its connection to the
+            pool) after a commit, instead of just expunging the objects
+        """
+        self.max_objects = max_objects
+        self.max_age = max_age
+        self.max_memory = max_memory
+        self.warn_transaction_age = warn_transaction_age
+        self.close = close
+
+    def must_recycle(self, session):
+        if self.max_objects and len(session.identity_map) > self.max_objects:
+            return True
+        started = session.info.setdefault('dbal_session_start', time.time())
+        if self.max_age and time.time() - started > self.max_age:
+            return True
+        if self.max_memory:
+            memory = _memory_usage()
+            if memory is not None and memory > self.max_memory:
+                return True
+        return False
+
+
+def _track_transaction_start(session, transaction, connection):
+    session.info.setdefault('dbal_transaction_start', time.time())
+
+
+def _track_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('dbal_transaction_start', None)
+        session.info.pop('dbal_transaction_warned', None)
+
+
 class Database(metaclass=Singleton):
     """
     This class is meant to abstract the developer to manage the connections and
@@ -90,7 +169,8 @@ class Database(metaclass=Singleton):
     """
 
     def __init__(self, autocommit=False, echo=False, multithreading=False,
-                 db_config=None, dev_mode=False, pool_size=5):
+                 db_config=None, dev_mode=False, pool_size=5, session_policy=None,
+                 lanes=None):
         """
         Initialize the Database object.
         View Singleton design pattern.
@@ -112,7 +192,17 @@ class Database(metaclass=Singleton):
         :param pool_size: <int>. Set the limit to the connections that can be opened
             in the multithreading mode. This could be useful for setting a safety
             upper limit.
+        :param session_policy: <SessionPolicy>. When to recycle the long-lived
+            sessions. If None, they are never recycled
+        :param lanes: <list>.<dbal.admission.Lane>. The admission control lanes.
+            See the "lane" method. The total of queries admitted at the same time
+            is limited to the pool size. They need the multithreading mode, since
+            otherwise all the threads share one session (and one connection)
         """
+        if lanes and not multithreading:
+            raise ValueError('The admission control lanes need the multithreading '
+                             'mode, since otherwise all the threads share one '
+                             'connection')
         self.db_config = db_config
         self.autocommit = autocommit
         if autocommit:
@@ -131,12 +221,25 @@ class Database(metaclass=Singleton):
             self.Session = scoped_session(self.session_factory)
         else:
             self.Session = sessionmaker(bind=self.engine, autocommit=autocommit)
+        # Track the transactions age, for the metrics and the session policy
+        factory = self.session_factory if self.multithreading else self.Session
+        event.listen(factory, 'after_begin', _track_transaction_start)
+        event.listen(factory, 'after_transaction_end', _track_transaction_end)
+        self.session_policy = session_policy
+        self._admission = (AdmissionController(lanes, capacity=pool_size)
+                           if lanes else None)
+        # The session pinned to one connection inside a lane, by thread
+        self._lane_local = threading.local()
         self._session = self.Session()
         self.__conn = None
         self.__cursor = None
         self._bulkops = BulkOps()
         self._dev_mode = dev_mode
         self._echo = echo
+        # The (schema fingerprint, reflected MetaData) by schema
+        self._reflected = dict()
+        self._partitioned = None
+        self._partitioned_at = None
 
     @property
     def session(self):
@@ -146,10 +249,130 @@ class Database(metaclass=Singleton):
         are independent and isolated from each other.
         :return:
         """
+        pinned = getattr(self._lane_local, 'session', None)
+        if pinned is not None:
+            return pinned
         if self.multithreading:
             return self.Session()
         return self._session
 
+    def session_metrics(self):
+        """
+        :return: <dict>. The number of objects in the session identity map, the
+            session age and the age of the open transaction (None if there is no
+            open transaction), in seconds
+        """
+        session = self.session
+        now = time.time()
+        transaction_start = session.info.get('dbal_transaction_start')
+        return {
+            'identity_map_size': len(session.identity_map),
+            'session_age': now - session.info.setdefault('dbal_session_start', now),
+            'transaction_age': (now - transaction_start
+                                if transaction_start else None),
+        }
+
+    def recycle_session(self, close=False):
+        """
+        Expunge all the objects of the session. Pending changes are flushed first.
+        :param close: <bool>. Close the session instead. Careful! The open
+            transaction is rolled back
+        :return:
+        """
+        session = self.session
+        if close:
+            session.close()
+        else:
+            session.flush()
+            session.expunge_all()
+        session.info['dbal_session_start'] = time.time()
+
+    def _apply_session_policy(self, after_commit=False):
+        policy = self.session_policy
+        if policy is None:
+            return
+        session = self.session
+        transaction_start = session.info.get('dbal_transaction_start')
+        if (policy.warn_transaction_age and transaction_start and
+                not session.info.get('dbal_transaction_warned') and
+                time.time() - transaction_start > policy.warn_transaction_age):
+            session.info['dbal_transaction_warned'] = True
+            warnings.warn('The transaction has been open for {:.0f} seconds'
+                          .format(time.time() - transaction_start),
+                          LongTransactionWarning)
+        if session.new or session.dirty or session.deleted:
+            return
+        if policy.must_recycle(session):
+            self.recycle_session(
+                close=policy.close and after_commit and not self._dev_mode
+            )
+
+    @contextmanager
+    def lane(self, name):
+        """
+        Run the block in an admission control lane. The block waits until the lane
+        (and the pool) has room, and the lane statement_timeout is set for it. E.g:
+            with db.lane('batch'):
+                db.execute(heavy_query)
+        When not in autocommit mode the statement_timeout applies to the current
+        transaction (so it is lost if the block commits), and the previous one is
+        restored when the block ends. In autocommit mode the block runs in a session
+        pinned to one connection, whose statement_timeout is reset when it ends.
+        :param name: <str>. The lane name
+        :return:
+        """
+        if self._admission is None:
+            raise ValueError('There are no lanes defined for this database')
+        admitted = self._admission.acquire(name)
+        timeout = self._admission.lanes[name].statement_timeout
+        try:
+            if not admitted or timeout is None:
+                yield self
+            elif self.autocommit:
+                with self._pinned_timeout(timeout):
+                    yield self
+            else:
+                with self._local_timeout(timeout):
+                    yield self
+        finally:
+            if admitted:
+                self._admission.release(name)
+
+    @contextmanager
+    def _local_timeout(self, timeout):
+        session = self.session
+        transaction = session.transaction
+        previous = session.execute('SHOW statement_timeout').scalar()
+        session.execute('SET LOCAL statement_timeout = {:d}'.format(timeout))
+        try:
+            yield
+        finally:
+            # If the transaction ended, the SET LOCAL ended with it
+            if session.transaction is transaction and session.is_active:
+                session.execute('SET LOCAL statement_timeout = :previous',
+                                {'previous': previous})
+
+    @contextmanager
+    def _pinned_timeout(self, timeout):
+        # Every execute of an autocommit session may check out another connection,
+        # so the SET, the queries and the RESET must share a pinned one
+        with self.engine.connect() as conn:
+            conn.execute('SET statement_timeout = {:d}'.format(timeout))
+            session = self.session_factory(bind=conn)
+            self._lane_local.session = session
+            try:
+                yield
+            finally:
+                self._lane_local.session = None
+                session.close()
+                conn.execute('RESET statement_timeout')
+
+    def lane_metrics(self):
+        """
+        :return: <dict>. The queue depth, running queries and wait times by lane
+        """
+        return self._admission.metrics() if self._admission else dict()
+
     def write(self, obj, commit=True):
         try:
             self.session.add(obj)
@@ -160,15 +383,169 @@ class Database(metaclass=Singleton):
             self.rollback()
             raise e
 
-    def read(self, table, *args, limit=100, last=False):
+    def write_many(self, table, objects, commit=True, types=None, page_size=5000):
+        """
+        Write many objects of the same table with one bulk INSERT ... RETURNING by
+        page (and by set of attributes), instead of flushing them one by one.
+        :param table: <sqlalchemy.ext.declarative.api.DeclarativeMeta>
+        :param objects: <list>. Instances of the table class or <dict> (attribute
+            name -> value). The attributes that are not set take the python column
+            defaults (the scalar, callable and Sequence ones) as in a flush, and
+            then the server defaults. The SQL expression defaults are not supported
+        :param commit: <bool>
+        :param types: <dict>. Optional postgres type by attribute name. See
+            BulkOps.insert_many
+        :param page_size: <int>. Rows inserted by statement
+        :return: <list>. The persistent instances, in the same order as the objects
+            (the given instances themselves, and new ones for the dicts, built
+            without calling the class constructor), with all their columns (e.g.
+            the generated ids) loaded from the returned rows, so reading them costs
+            no query (not even after the commit)
+        """
+        columns = table.__table__.columns
+        rows = []
+        for obj in objects:
+            if isinstance(obj, dict):
+                unknown = set(obj) - set(columns.keys())
+                if unknown:
+                    raise ValueError('{} are not columns of {}'.format(
+                        ', '.join(sorted(unknown)), table.__table__.fullname))
+                rows.append(dict(obj))
+                continue
+            if inspect(obj).key is not None:
+                raise ValueError('The object {} is already persisted'.format(obj))
+            if inspect(obj).pending:
+                # Otherwise the session would flush it again
+                self.session.expunge(obj)
+            rows.append({c.key: obj.__dict__[c.key] for c in columns
+                         if c.key in obj.__dict__})
+        if not rows:
+            return []
+        returning_keys = [c.key for c in columns]
+        primary_key = [c.key for c in table.__table__.primary_key.columns]
+        values = [None] * len(rows)
+        try:
+            cursor = self.cursor
+            self._insert_defaults(cursor, columns, rows)
+            # The rows setting the same attributes go in the same statements, so the
+            # server defaults apply to the rest
+            groups = dict()
+            for position, row in enumerate(rows):
+                keys = tuple(c.key for c in columns if c.key in row)
+                groups.setdefault(keys, []).append(position)
+            for keys, positions in groups.items():
+                for first in range(0, len(positions), page_size):
+                    page = positions[first:first + page_size]
+                    returned = self._bulkops.insert_many(
+                        cursor, table.__table__.fullname,
+                        [columns[key].name for key in keys],
+                        [tuple(rows[position][key] for key in keys)
+                         for position in page],
+                        to_return=[c.name for c in columns], echo=self._echo,
+                        types=(tuple(types.get(key) for key in keys)
+                               if types else None)
+                    )
+                    matched = self._match_returned(
+                        [rows[position] for position in page],
+                        [dict(zip(returning_keys, r)) for r in returned],
+                        primary_key
+                    )
+                    for position, returned_values in zip(page, matched):
+                        values[position] = returned_values
+            if commit:
+                self.commit()
+        except Exception as e:
+            self.rollback()
+            raise e
+        instances = []
+        for obj, returned_values in zip(objects, values):
+            # The constructor is not called, since it may take other arguments
+            instance = (table.__mapper__.class_manager.new_instance()
+                        if isinstance(obj, dict) else obj)
+            for key, value in returned_values.items():
+                setattr(instance, key, value)
+            # Attach the instance to the session as if it had been loaded from a
+            # query, so no INSERT is flushed for it again. It is attached after the
+            # commit, so it is not expired by it
+            make_transient_to_detached(instance)
+            self.session.add(instance)
+            instances.append(instance)
+        return instances
+
+    @staticmethod
+    def _insert_defaults(cursor, columns, rows):
+        """
+        Set the python column defaults of the attributes the rows do not set, as a
+        flush does. The values of a Sequence are fetched at once
+        :param cursor: <psycopg2.cursor>
+        :param columns: <sqlalchemy.sql.base.ImmutableColumnCollection>
+        :param rows: <list>.<dict>. Updated in place
+        :return:
+        """
+        for column in columns:
+            default = column.default
+            if default is None:
+                continue
+            missing = [row for row in rows if column.key not in row]
+            if not missing:
+                continue
+            if default.is_sequence:
+                name = ('{}.{}'.format(default.schema, default.name)
+                        if default.schema else default.name)
+                cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)',
+                               (name, len(missing)))
+                for row, (value,) in zip(missing, cursor.fetchall()):
+                    row[column.key] = value
+            elif default.is_clause_element:
+                raise ValueError('The SQL expression default of {} is not supported. '
+                                 'Use a server_default'.format(column.key))
+            else:
+                for row in missing:
+                    # The callables are wrapped by sqlalchemy to take the execution
+                    # context, which a bulk insert has not
+                    row[column.key] = (default.arg(None) if default.is_callable
+                                       else default.arg)
+
+    @staticmethod
+    def _match_returned(rows, returned, primary_key):
+        """
+        Sort the RETURNING rows of an insert as the inserted rows
+        :param rows: <list>.<dict>. The inserted values
+        :param returned: <list>.<dict>. The returned values
+        :param primary_key: <list>.<str>. The primary key attributes
+        :return: <list>.<dict>. The returned values, in the order of the rows
+        """
+        if len(returned) != len(rows):
+            raise ValueError('The insert returned {} rows instead of {}'
+                             .format(len(returned), len(rows)))
+        if not all(key in rows[0] for key in primary_key):
+            # The keys are generated by the database, so the rows cannot be matched.
+            # Postgres returns the rows of a single INSERT ... VALUES in the VALUES
+            # order, although it is not documented as guaranteed
+            return returned
+        # The keys are compared as text, since the database may return other types
+        # (e.g. UUID objects for str ids)
+        positions = {tuple(str(row[key]) for key in primary_key): position
+                     for position, row in enumerate(rows)}
+        ordered = [None] * len(rows)
+        for values in returned:
+            ordered[positions[tuple(str(values[key]) for key in primary_key)]] = values
+        return ordered
+
+    def read(self, table, *args, limit=100, last=False, lane=None):
         """
         :param table: <sqlalchemy.ext.declarative.api.DeclarativeMeta>
         :param args: <sqlalchemy.orm.attributes.InstrumentedAttribute>.
             E.g: PipeRun.run_id == 5
         :param last: <boolean> Set true if you want to get the last inserted records
         :param limit: <int>
+        :param lane: <str>. Run the query in an admission control lane
         :return:
         """
+        if lane is not None:
+            with self.lane(lane):
+                return self.read(table, *args, limit=limit, last=last)
+        self._apply_session_policy()
         if last:
             pkey = self.get_primary_key(table)
             query = self.session.query(table).filter(*args). \
@@ -180,6 +557,7 @@ class Database(metaclass=Singleton):
         return query.all()
 
     def read_one(self, table, *args):
+        self._apply_session_policy()
         query = self.session.query(table).filter(*args)
         return query.one()
 
@@ -200,23 +578,91 @@ class Database(metaclass=Singleton):
                 except Exception as e:
                     self.session.rollback()
                     raise e
+        self._apply_session_policy(after_commit=True)
 
     def rollback(self):
         if self.session:
             self.session.rollback()
+            self._apply_session_policy()
 
-    def execute(self, query):
+    def execute(self, query, lane=None):
         """
         Execute a custom query and return an iterable sqlalchemy ResultProxy
         :param query: <str>
+        :param lane: <str>. Run the query in an admission control lane
         :return: <sqlalchemy.engine.result.ResultProxy>
         """
+        if lane is not None:
+            with self.lane(lane):
+                return self.execute(query)
         try:
             return self.session.execute(query)
         except Exception as e:
             self.session.rollback()
             raise e
 
+    def batch(self, commit=True, page_size=100):
+        """
+        Queue many small statements and writes, and send them in as few round trips
+        as possible when the block ends. See the Batch class. E.g:
+            with db.batch() as batch:
+                result = batch.execute('SELECT ...', params, fetch=True)
+            rows = result.result()
+        :param commit: <bool>. Commit when the block ends
+        :param page_size: <int>. Max number of statements by round trip
+        :return: <Batch>
+        """
+        return Batch(self, commit=commit, page_size=page_size)
+
+    def subscribe(self, channel_or_table, callback, key=None, trigger=False,
+                  batch_window=0.05, max_batch=1000, on_error=None):
+        """
+        Subscribe to a LISTEN/NOTIFY channel, or to the changes of a table, instead
+        of polling it. A dedicated connection (out of the pool) listens in a
+        background thread, and the notifications of a burst are passed together to
+        the callback. If the connection is lost it is reconnected, and the rows
+        inserted meanwhile are re-read by key. See dbal.notify. E.g:
+            subscription = db.subscribe('pipe_runs', on_runs, key='run_id',
+                                        trigger=True)
+            ...
+            subscription.stop()
+        :param channel_or_table: <str>. The channel, or the table if key is set
+        :param callback: <callable>. It takes a list of dbal.notify.Notification.
+            It is called from the subscription thread
+        :param key: <str>. The table primary key (an increasing one, for the catch
+            up after a reconnection)
+        :param trigger: <bool>. Install a trigger on the table that notifies the
+            key of every inserted, updated and deleted row
+        :param batch_window: <float>. Seconds waited for the rest of a burst
+        :param max_batch: <int>. Max notifications by callback call
+        :param on_error: <callable>. It takes the exception raised by the callback
+            and the batch. The subscription keeps listening anyway, and the last
+            errors are kept in subscription.errors
+        :return: <dbal.notify.Subscription>. Already started
+        """
+        return notify.subscribe(self.engine, channel_or_table, callback, key=key,
+                                trigger=trigger, batch_window=batch_window,
+                                max_batch=max_batch, on_error=on_error).start()
+
+    async def subscribe_async(self, channel_or_table, callback, key=None,
+                              trigger=False, batch_window=0.05, max_batch=1000,
+                              on_error=None):
+        """
+        The asyncio version of subscribe. The listener connection is watched by the
+        running event loop, and the callback may be a coroutine function. E.g:
+            subscription = await db.subscribe_async('pipe_runs', on_runs,
+                                                    key='run_id')
+            ...
+            await subscription.stop()
+        :return: <dbal.notify.AsyncSubscription>. Already started
+        """
+        subscription = notify.subscribe(
+            self.engine, channel_or_table, callback, key=key, trigger=trigger,
+            use_asyncio=True, batch_window=batch_window, max_batch=max_batch,
+            on_error=on_error
+        )
+        return await subscription.start()
+
     @staticmethod
     def get_primary_key(base_obj):
         """
@@ -246,14 +692,291 @@ class Database(metaclass=Singleton):
         __conn = self.session.connection().connection
         return __conn.cursor()
 
-    def insert_many(self, *args, **kwargs):
+    def insert_many(self, table, columns, values, *args, **kwargs):
+        """
+        Insert many values in bulk. See BulkOps.insert_many.
+        If the table is range or list partitioned, the rows are grouped by partition
+        and inserted in every partition directly. The returned rows (if to_return is
+        set) are put back in the order of the values, relying on postgres returning
+        the rows of an INSERT ... VALUES in the VALUES order. If the known partitions
+        are stale (one was dropped, or a row went to the default partition while
+        its own one exists) the partitions are discovered again and the rows are
+        inserted through the parent table
+        :return:
+        """
+        try:
+            groups = None
+            if values and not args and not kwargs.get('sub_query'):
+                values = list(values)
+                partitioned = self.partitioned_tables().get(table)
+                groups = partitioned.route(columns, values) if partitioned else None
+            if not groups:
+                return self._bulkops.insert_many(
+                    self.cursor, table, columns, values, *args, echo=self._echo,
+                    **kwargs
+                )
+            cursor = self.cursor
+            cursor.execute('SAVEPOINT dbal_partitions')
+            try:
+                returned = [None] * len(values)
+                for partition, positions in groups.items():
+                    # The rows that fit no known partition go through the parent
+                    rows = self._bulkops.insert_many(
+                        cursor, partition or table, columns,
+                        [values[position] for position in positions],
+                        echo=self._echo, **kwargs
+                    )
+                    for position, row in zip(positions, rows or []):
+                        returned[position] = row
+            except Exception as e:
+                if getattr(e, 'pgcode', None) not in partitioning.STALE_SQLSTATES:
+                    raise e
+                cursor.execute('ROLLBACK TO SAVEPOINT dbal_partitions')
+                self.partitioned_tables(refresh=True)
+                return self._bulkops.insert_many(
+                    cursor, table, columns, values, echo=self._echo, **kwargs
+                )
+            cursor.execute('RELEASE SAVEPOINT dbal_partitions')
+            return returned if kwargs.get('to_return') else None
+        except Exception as e:
+            self.rollback()
+            raise e
+
+    def partitioned_tables(self, refresh=False, max_age=60):
+        """
+        The range and list partitioned tables, discovered from the catalog and
+        discovered again when they are older than max_age (or when refresh is set).
+        See dbal.partitioning.discover
+        :param refresh: <bool>. Read the catalog again (e.g. after other processes
+            created or dropped partitions)
+        :param max_age: <float>. Seconds the discovered partitions are used
+        :return: <dict>. The dbal.partitioning.PartitionedTable objects by name
+        """
+        if (self._partitioned is None or refresh or
+                time.time() - self._partitioned_at > max_age):
+            # Discovered over its own connection, out of the session transaction
+            conn = self.engine.raw_connection()
+            try:
+                self._partitioned = partitioning.discover(conn.cursor())
+                conn.rollback()
+            finally:
+                conn.close()
+            self._partitioned_at = time.time()
+        return self._partitioned
+
+    def maintain_partitions(self, policies=None, commit=True):
+        """
+        Create the partitions ahead of time and detach (or drop) the expired ones,
+        according to the partition policies. Meant to be run periodically
+        :param policies: <dict>. The dbal.partitioning.PartitionPolicy by table name.
+            If None, the ones set in the "info" of the declarative tables (see
+            PartitionPolicy)
+        :param commit: <bool>
+        :return: <dict>. The (created, expired) partitions by table name
+        """
+        if policies is None:
+            policies = {table.fullname: table.info['partition_policy']
+                        for table in self.meta.sorted_tables
+                        if 'partition_policy' in table.info}
         try:
-            return self._bulkops.insert_many(
-                self.cursor, *args, echo=self._echo, **kwargs
+            results = partitioning.maintain(
+                self.cursor, self.partitioned_tables(refresh=True), policies
             )
         except Exception as e:
             self.rollback()
             raise e
+        if commit:
+            self.commit()
+        return results
+
+    def write_blob(self, source, key=None, chunk_size=blobs.DEFAULT_CHUNK_SIZE,
+                   commit=True):
+        """
+        Stream a blob into the database in fixed size chunks, so just one chunk is
+        held in memory. As a large object, or as rows of the bytea chunks table if a
+        key is given. See dbal.blobs
+        :param source: A file-like object (with read or readinto), or a bytes-like
+            one (bytes, bytearray, memoryview)
+        :param key: <str>. Store the blob in the bytea chunks table under this key
+            (overwriting it). If None, a new large object is created
+        :param chunk_size: <int>. Bytes by chunk
+        :param commit: <bool>
+        :return: <int> (the large object oid) or <str> (the key)
+        """
+        conn = self.session.connection().connection
+        try:
+            if key is None:
+                key, _ = blobs.write_large_object(conn, source, chunk_size=chunk_size)
+            else:
+                blobs.write_chunks(conn, key, source, chunk_size=chunk_size)
+        except Exception as e:
+            self.rollback()
+            raise e
+        if commit:
+            self.commit()
+        return key
+
+    def read_blob(self, oid_or_key, chunk_size=blobs.DEFAULT_CHUNK_SIZE):
+        """
+        Open a blob as a readable stream, fetched one chunk at a time. Attention, a
+        large object must be read before the session transaction ends. A bytea
+        chunks blob is read over its own connection, released at the end of the
+        blob or when the stream is closed. See dbal.blobs
+        :param oid_or_key: <int> (a large object oid) or <str> (a bytea chunks key)
+        :param chunk_size: <int>. Bytes by large object read
+        :return: <io.BufferedReader>
+        """
+        if isinstance(oid_or_key, int):
+            conn = self.session.connection().connection
+            return blobs.read_large_object(conn, oid_or_key, chunk_size=chunk_size)
+        return blobs.read_chunks(self.engine, oid_or_key)
+
+    def delete_blob(self, oid_or_key, commit=True):
+        """
+        :param oid_or_key: <int> (a large object oid) or <str> (a bytea chunks key)
+        :param commit: <bool>
+        :return:
+        """
+        try:
+            blobs.delete_blob(self.session.connection().connection, oid_or_key)
+        except Exception as e:
+            self.rollback()
+            raise e
+        if commit:
+            self.commit()
+
+    def reflect(self, tables=None, schema=None, fingerprint=None, refresh=False):
+        """
+        Reflect the tables of the database (e.g. the ones used by name in the bulk
+        methods). The reflected MetaData is cached in memory and on disk, under the
+        config directory, and it is reflected again only when the schema fingerprint
+        changes. See dbal.reflection.reflect
+        :param tables: <list>.<str>. The tables to reflect. If None, all of them
+        :param schema: <str>. If None, the default one
+        :param fingerprint: <str>. The schema version (e.g. the migration version).
+            If None, it is computed from the catalog
+        :param refresh: <bool>. Ignore the caches
+        :return: <sqlalchemy.MetaData>
+        """
+        if fingerprint is None:
+            # It is cheap, and a long-lived process may outlive a migration
+            fingerprint = reflection.schema_fingerprint(self.engine)
+        reflected_fingerprint, metadata = self._reflected.get(schema, (None, None))
+        if (metadata is not None and tables is not None and not refresh and
+                reflected_fingerprint == fingerprint):
+            prefix = schema + '.' if schema else ''
+            if all(prefix + table in metadata.tables for table in tables):
+                return metadata
+        metadata = reflection.reflect(self.engine, self.db_config, tables=tables,
+                                      schema=schema, fingerprint=fingerprint,
+                                      refresh=refresh)
+        self._reflected[schema] = (fingerprint, metadata)
+        return metadata
+
+    def parallel_scan(self, table, columns=None, workers=4, batch_size=10000,
+                      key=None, callback=None, batches=False):
+        """
+        Read a whole table over several connections, all of them importing the same
+        exported snapshot, so the scan is consistent. The table is split in primary
+        key (or physical page) ranges. See dbal.scan.parallel_scan
+        :param table: <str> or <sqlalchemy.ext.declarative.api.DeclarativeMeta>
+        :param columns: <tuple>.<str>. The columns to read. If None, all of them
+        :param workers: <int>. Number of connections
+        :param batch_size: <int>. Rows fetched by round trip
+        :param key: <str>. Integer column used to split the table
+        :param callback: <callable>. If set, it is called (from the worker threads)
+            with every batch of rows, and nothing is returned
+        :param batches: <bool>. Yield lists of rows instead of rows
+        :return: <iterator>. The rows (or the batches), in no particular order
+        """
+        if not isinstance(table, str):
+            table = table.__table__.fullname
+        return parallel_scan(self.engine, table, columns=columns, workers=workers,
+                             batch_size=batch_size, key=key, callback=callback,
+                             batches=batches)
+
+    def export(self, query, path, format='csv', compression=None, split_size=None,
+               header=True):
+        """
+        Stream the result of a query into files with COPY (query) TO STDOUT, without
+        building python rows. It runs in its own connection (i.e. it does not see
+        the uncommitted changes of the session). See dbal.transfer.export
+        :param query: <str>. A SELECT query
+        :param path: <str>. The file path
+        :param format: <str>. 'csv', 'binary' or 'jsonl'
+        :param compression: <str>. None, 'gzip', 'bz2' or 'xz'
+        :param split_size: <int>. Split the output in files of this size (in bytes)
+        :param header: <bool>. Write the csv header
+        :return: <dict>. The files, rows, bytes, seconds and throughput
+        """
+        return transfer.export(self.engine, query, path, file_format=format,
+                               compression=compression, split_size=split_size,
+                               header=header)
+
+    def load_file(self, table, path, columns=None, format='csv', header=True,
+                  workers=4, commit='all', max_rejects=0, reject_path=None,
+                  progress=None):
+        """
+        Load a csv/text file into a table. The file is memory-mapped, split at line
+        boundaries and every chunk is streamed over its own pooled connection with
+        COPY FROM STDIN. See dbal.transfer.load_file
+        :param table: <str> or <sqlalchemy.ext.declarative.api.DeclarativeMeta>
+        :param path: <str>
+        :param columns: <tuple>.<str>. The file columns. If None, all the table ones
+        :param format: <str>. 'csv' or 'text'
+        :param header: <bool>. The first line of a csv file is a header
+        :param workers: <int>. Number of connections
+        :param commit: <str>. 'all' (all the chunks or none, with a two-phase
+            commit, which needs max_prepared_transactions >= workers) or 'chunk'
+        :param max_rejects: <int>. Max number of bad rows written into the reject
+            file instead of failing. None for no limit
+        :param reject_path: <str>. By default <path>.rejects
+        :param progress: <callable>. Called with the loaded and the total bytes
+        :return: <dict>. The rows, rejected rows, bytes, seconds and throughput
+        """
+        if not isinstance(table, str):
+            table = table.__table__.fullname
+        return transfer.load_file(
+            self.engine, table, path, columns=columns, file_format=format,
+            header=header, workers=workers, commit=commit, max_rejects=max_rejects,
+            reject_path=reject_path, progress=progress
+        )
+
+    def insert_many_resumable(self, job_id, table, columns, values, chunk_size=10000,
+                              max_retries=5, backoff=0.5, restart=False, **kwargs):
+        """
+        Insert many values in chunks, each one committed (in its own connection)
+        along with a checkpoint. The transient errors (serialization failures,
+        deadlocks, connection losses) are retried with backoff, and re-running a
+        failed job with the same job_id resumes it from the last committed chunk.
+        See dbal.resumable.resumable_bulk and BulkOps.insert_many
+        :param job_id: <str>
+        :param table: <str> table name
+        :param columns: <tuple>. columns to insert
+        :param values: <iterable>.<tuple>. Values to insert, in the same order on
+            every run
+        :param chunk_size: <int>. Rows committed by transaction
+        :param max_retries: <int>. Retries of every chunk
+        :param backoff: <float>. The first retry delay, in seconds
+        :param restart: <bool>. Ignore the checkpoint and start from the beginning
+        :return: <dict>. The committed and skipped chunks, rows and retries
+        """
+        return resumable_bulk(self.engine, job_id, self._bulkops.insert_many, table,
+                              columns, values, chunk_size=chunk_size,
+                              max_retries=max_retries, backoff=backoff,
+                              restart=restart, echo=self._echo, **kwargs)
+
+    def update_many_resumable(self, job_id, table, prim_key_columns, values,
+                              chunk_size=10000, max_retries=5, backoff=0.5,
+                              restart=False, **kwargs):
+        """
+        The resumable version of update_many. See insert_many_resumable
+        :return: <dict>. The committed and skipped chunks, rows and retries
+        """
+        return resumable_bulk(self.engine, job_id, self._bulkops.update_many, table,
+                              prim_key_columns, values, chunk_size=chunk_size,
+                              max_retries=max_retries, backoff=backoff,
+                              restart=restart, echo=self._echo, **kwargs)
 
     def persist_changes(self):
         """
@@ -301,7 +1024,7 @@ class BulkOps(object):
         return _query
 
     def insert_many(self, cursor, table, columns, values,
-                    sub_query=None, to_return=None, echo=False):
+                    sub_query=None, to_return=None, echo=False, types=None):
         """
         This function allows for inserting many values in bulk.
         This function was created because the sqlalchemy bulk inserts were not
@@ -315,6 +1038,9 @@ class BulkOps(object):
         :param to_return: <tuple>. values to return. Usually it is useful to return
             primary or foreign keys
         :param echo: <bool>. If true, print the commands that are being executed
+        :param types: <tuple>.<str>. Optional postgres type of each column (e.g.
+            ('int', 'jsonb', 'timestamptz')). If set, the values are cast with the
+            codecs of the dbal.codecs module
         :return:
         """
         # TODO It would be great to used the sqlachemy declarative objects directly
@@ -324,6 +1050,8 @@ class BulkOps(object):
 
         # this is for transforming values into string.
         gen_tuple = '(' + ', '.join(['%s' for _ in iter(columns)]) + ')'
+        if types and values:
+            values = convert_rows(types, values)
 
         args_str = ','.join(cursor.mogrify(gen_tuple, x).decode('utf-8')
                             for x in values) if values else None
@@ -364,7 +1092,8 @@ class BulkOps(object):
         cursor.execute(query)
         return temp_table_name
 
-    def update_many(self, cursor, table, prim_key_columns, values, echo=False):
+    def update_many(self, cursor, table, prim_key_columns, values, echo=False,
+                    types=None):
         """
         Update many values for an existing table. AKA bulk update.
         :param cursor: <psycopg2.cursor>
@@ -374,6 +1103,8 @@ class BulkOps(object):
             The positions must be consistent with the positions of each column name
             in the prim_key_columns array
         :param echo: <bool>. Set True if you want to be more verbose
+        :param types: <tuple>.<str>. Optional postgres type of each column. See
+            insert_many
         :return:
         """
         # First we create a temporal table using the schema from the original one
@@ -385,7 +1116,7 @@ class BulkOps(object):
         # Then, we populate the temporal table with the values to update
         if echo:
             print('Inserting the values to update in the temporal table')
-        self.insert_many(cursor, temp_table, prim_key_columns, values)
+        self.insert_many(cursor, temp_table, prim_key_columns, values, types=types)
         # Finally, we update the table with the new values, using a join with the
         #  temporal one, for being more efficient
         temp_alias = 'temp'
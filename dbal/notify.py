@@ -0,0 +1,370 @@
+"""
+This module contains the change feed subscriptions used by Database.subscribe: a
+dedicated connection LISTENs to a channel, and the notifications that arrive in a
+burst are passed together to a callback, instead of polling the tables.
+The notifications of a table may be sent by a trigger (see install_trigger) with
+the primary key of every changed row. If the listener connection is lost, it is
+reconnected and the rows inserted meanwhile are re-read by key (the notifications
+sent while nobody was listening are lost), so the subscriber catches up.
+"""
+import asyncio
+import json
+import re
+import select
+import threading
+import time
+from collections import deque, namedtuple
+
+from psycopg2 import InterfaceError, OperationalError
+
+Notification = namedtuple('Notification', ['channel', 'payload', 'pid'])
+
+TRIGGER_FUNCTION = 'dbal_notify_change'
+
+
+def channel_for(table):
+    """
+    :param table: <str>
+    :return: <str>. The channel of the table changes
+    """
+    return 'dbal_{}'.format(re.sub(r'\W', '_', table))
+
+
+def install_trigger(cursor, table, key, channel=None):
+    """
+    Install a trigger that notifies the inserted, updated and deleted rows of a
+    table, with payloads like {"table": "runs", "op": "INSERT", "key": 5}
+    :param cursor: <psycopg2.cursor>
+    :param table: <str>
+    :param key: <str>. The primary key column sent in the payload
+    :param channel: <str>. If None, the one given by channel_for
+    :return: <str>. The channel
+    """
+    channel = channel or channel_for(table)
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION {}() RETURNS trigger AS $$
+        DECLARE
+            row_data jsonb;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                row_data := to_jsonb(OLD);
+            ELSE
+                row_data := to_jsonb(NEW);
+            END IF;
+            PERFORM pg_notify(TG_ARGV[0], json_build_object(
+                'table', TG_TABLE_NAME, 'op', TG_OP, 'key', row_data -> TG_ARGV[1]
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """.format(TRIGGER_FUNCTION))
+    trigger = '{}_{}'.format(TRIGGER_FUNCTION, re.sub(r'\W', '_', table))
+    cursor.execute('DROP TRIGGER IF EXISTS {} ON {}'.format(trigger, table))
+    cursor.execute("""
+        CREATE TRIGGER {} AFTER INSERT OR UPDATE OR DELETE ON {}
+        FOR EACH ROW EXECUTE PROCEDURE {}(%s, %s)
+        """.format(trigger, table, TRIGGER_FUNCTION), (channel, key))
+    return channel
+
+
+def _decode(notify):
+    try:
+        payload = json.loads(notify.payload)
+    except ValueError:
+        payload = notify.payload
+    return Notification(notify.channel, payload, notify.pid)
+
+
+class _Listener(object):
+    """
+    The listener connection and the catch up logic shared by both subscription
+    types
+    """
+
+    def __init__(self, engine, channel, callback, table=None, key=None,
+                 batch_window=0.05, max_batch=1000, reconnect_delay=1.0,
+                 on_error=None):
+        """
+        :param engine: <sqlalchemy.engine.Engine>
+        :param channel: <str>
+        :param callback: <callable>. It takes a list of Notification objects
+        :param table: <str>. The table whose rows are re-read after a reconnection
+        :param key: <str>. An increasing column of the table (e.g. a serial primary
+            key). The rows whose key is greater than the last notified one are
+            passed as 'CATCH_UP' notifications after a reconnection
+        :param batch_window: <float>. Seconds waited after a notification for more
+            ones, so a burst is passed to the callback at once
+        :param max_batch: <int>. Max notifications by callback call
+        :param reconnect_delay: <float>. The first delay between reconnection
+            attempts, in seconds. It is doubled up to a minute
+        :param on_error: <callable>. It takes the exception raised by the callback
+            and the batch. The subscription keeps listening anyway. The last
+            errors are kept in the errors attribute as well
+        """
+        self._engine = engine
+        self.channel = channel
+        self.callback = callback
+        self.table = table
+        self.key = key
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.reconnect_delay = reconnect_delay
+        self.last_key = None
+        self.reconnections = 0
+        self.on_error = on_error
+        # The last (exception, batch) raised by the callback
+        self.errors = deque(maxlen=100)
+        self._conn = None
+
+    def _connect(self):
+        conn = self._engine.raw_connection()
+        # The listener is not returned to the pool, it lives as long as the
+        # subscription
+        conn.detach()
+        conn.connection.autocommit = True
+        cursor = conn.connection.cursor()
+        cursor.execute('LISTEN {}'.format(self.channel))
+        if self.key is not None and self.last_key is None:
+            cursor.execute('SELECT max({}) FROM {}'.format(self.key, self.table))
+            self.last_key = cursor.fetchone()[0]
+        self._conn = conn
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except (InterfaceError, OperationalError):
+                pass
+            self._conn = None
+
+    @property
+    def _pg_conn(self):
+        return self._conn.connection
+
+    def _drain(self):
+        """
+        :return: <list>.<Notification>. The received notifications
+        """
+        pg_conn = self._pg_conn
+        pg_conn.poll()
+        notifications = [_decode(notify) for notify in pg_conn.notifies]
+        del pg_conn.notifies[:]
+        return notifications
+
+    def _catch_up(self):
+        """
+        :return: <list>.<Notification>. The rows inserted while disconnected
+        """
+        if self.key is None or self.last_key is None:
+            return []
+        cursor = self._pg_conn.cursor()
+        cursor.execute('SELECT {0} FROM {1} WHERE {0} > %s ORDER BY {0}'.format(
+            self.key, self.table), (self.last_key,))
+        return [Notification(self.channel,
+                             {'table': self.table, 'op': 'CATCH_UP', 'key': row[0]},
+                             None)
+                for row in cursor.fetchall()]
+
+    def _track(self, notifications):
+        for notification in notifications:
+            payload = notification.payload
+            if isinstance(payload, dict) and payload.get('op') in ('INSERT',
+                                                                   'CATCH_UP'):
+                key = payload.get('key')
+                if key is not None and (self.last_key is None or key > self.last_key):
+                    self.last_key = key
+
+    def _callback_failed(self, error, batch):
+        self.errors.append((error, batch))
+        if self.on_error is not None:
+            try:
+                self.on_error(error, batch)
+            except Exception:
+                pass
+
+    def _batches(self, notifications):
+        self._track(notifications)
+        for start in range(0, len(notifications), self.max_batch):
+            yield notifications[start:start + self.max_batch]
+
+
+class Subscription(_Listener):
+    """
+    A subscription whose callback is called from its own thread
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._connect()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def _receive(self):
+        # Wait for the first notification, then for the rest of the burst
+        pending = []
+        deadline = None
+        while not self._stop.is_set():
+            timeout = 0.5 if deadline is None else max(deadline - time.time(), 0)
+            if select.select([self._pg_conn], [], [], timeout) != ([], [], []):
+                pending.extend(self._drain())
+            if pending and deadline is None:
+                deadline = time.time() + self.batch_window
+            if pending and (len(pending) >= self.max_batch or
+                            time.time() >= deadline):
+                return pending
+        return pending
+
+    def _reconnect(self):
+        self._close()
+        delay = self.reconnect_delay
+        while not self._stop.is_set():
+            try:
+                self._connect()
+                self.reconnections += 1
+                return self._catch_up()
+            except (InterfaceError, OperationalError):
+                self._close()
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60)
+        return []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                notifications = self._receive()
+            except (InterfaceError, OperationalError, ValueError):
+                # ValueError: select on a closed connection
+                notifications = self._reconnect()
+            for batch in self._batches(notifications):
+                # A failing callback must not end the listener thread
+                try:
+                    self.callback(batch)
+                except Exception as e:
+                    self._callback_failed(e, batch)
+
+
+class AsyncSubscription(_Listener):
+    """
+    A subscription run by an asyncio event loop, with the listener connection
+    registered as a loop reader. The callback may be a coroutine function
+    """
+
+    def __init__(self, *args, loop=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending = []
+        self._flush_handle = None
+        self._closed = False
+
+    async def start(self):
+        await self._loop.run_in_executor(None, self._connect)
+        self._loop.add_reader(self._pg_conn, self._on_readable)
+        return self
+
+    async def stop(self):
+        self._closed = True
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        if self._conn is not None:
+            self._loop.remove_reader(self._pg_conn)
+        self._close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+        return False
+
+    def _on_readable(self):
+        try:
+            self._pending.extend(self._drain())
+        except (InterfaceError, OperationalError):
+            self._loop.remove_reader(self._pg_conn)
+            self._loop.create_task(self._reconnect())
+            return
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._pending and self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.batch_window, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        notifications, self._pending = self._pending, []
+        for batch in self._batches(notifications):
+            try:
+                result = self.callback(batch)
+            except Exception as e:
+                self._callback_failed(e, batch)
+                continue
+            if asyncio.iscoroutine(result):
+                task = self._loop.create_task(result)
+                task.add_done_callback(
+                    lambda done, batch=batch: self._task_done(done, batch))
+
+    def _task_done(self, task, batch):
+        if not task.cancelled() and task.exception() is not None:
+            self._callback_failed(task.exception(), batch)
+
+    async def _reconnect(self):
+        self._close()
+        delay = self.reconnect_delay
+        while not self._closed:
+            try:
+                await self._loop.run_in_executor(None, self._connect)
+                catch_up = await self._loop.run_in_executor(None, self._catch_up)
+            except (InterfaceError, OperationalError):
+                self._close()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+                continue
+            self.reconnections += 1
+            self._loop.add_reader(self._pg_conn, self._on_readable)
+            self._pending.extend(catch_up)
+            if self._pending:
+                self._flush()
+            return
+
+
+def subscribe(engine, channel_or_table, callback, key=None, trigger=False,
+              use_asyncio=False, **kwargs):
+    """
+    Build a subscription (not started yet). See Database.subscribe
+    :return: <Subscription> or <AsyncSubscription>
+    """
+    table = None
+    channel = channel_or_table
+    if key is not None or trigger:
+        table = channel_or_table
+        channel = channel_for(table)
+    if trigger:
+        if key is None:
+            raise ValueError('The key column is needed to install the trigger')
+        conn = engine.raw_connection()
+        try:
+            install_trigger(conn.cursor(), table, key, channel=channel)
+            conn.commit()
+        finally:
+            conn.close()
+    cls = AsyncSubscription if use_asyncio else Subscription
+    return cls(engine, channel, callback, table=table, key=key, **kwargs)
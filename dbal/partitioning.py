@@ -0,0 +1,286 @@
+"""
+This module contains the partitioned tables support of the Database class: the
+range and list partitions are discovered from the catalog, so the bulk inserts can
+be split by partition and written to each one directly (instead of having postgres
+route every row through the parent), and the time partitions can be created ahead
+of time and detached (or dropped) once they expire.
+Just the partitioned tables with a single column key (not an expression) are
+routed. The rows of the other ones, and the rows that fit no known partition, are
+inserted through the parent table.
+"""
+import re
+from bisect import bisect_right
+
+PERIODS = ('hour', 'day', 'week', 'month', 'quarter', 'year')
+
+# The postgres interval of every period ('1 quarter' is not a valid interval)
+_PERIOD_INTERVALS = {'quarter': '3 months'}
+
+# undefined_table (a dropped partition) and check_violation (e.g. a row inserted
+# into the default partition when its own partition exists)
+STALE_SQLSTATES = ('42P01', '23514')
+
+TIME_TYPES = ('date', 'timestamp without time zone', 'timestamp with time zone')
+
+_RANGE_BOUND = re.compile(r'^FOR VALUES FROM \((.*)\) TO \((.*)\)$', re.DOTALL)
+_LIST_BOUND = re.compile(r'^FOR VALUES IN \((.*)\)$', re.DOTALL)
+
+
+def _bound_literal(literal):
+    # MINVALUE and MAXVALUE mean unbounded
+    return 'NULL' if literal in ('MINVALUE', 'MAXVALUE') else literal
+
+
+class PartitionedTable(object):
+    """
+    The partitions of a range or list partitioned table, and the routing of the
+    rows to them
+    """
+
+    def __init__(self, name, strategy, key, key_type):
+        """
+        :param name: <str>. The parent table
+        :param strategy: <str>. 'range' or 'list'
+        :param key: <str>. The partition key column
+        :param key_type: <str>. The key column postgres type
+        """
+        self.name = name
+        self.strategy = strategy
+        self.key = key
+        self.key_type = key_type
+        self.default = None
+        # range: sorted (lower, upper, partition). list: {value: partition}
+        self.ranges = []
+        self._lowers = []
+        self.values = dict()
+
+    def add_range(self, partition, lower, upper):
+        self.ranges.append((lower, upper, partition))
+        self._sort_ranges()
+
+    def remove_ranges(self, partitions):
+        self.ranges = [r for r in self.ranges if r[2] not in partitions]
+        self._sort_ranges()
+
+    def _sort_ranges(self):
+        # The unbounded lower range goes first
+        self.ranges.sort(key=lambda r: (r[0] is not None, r[0]))
+        self._lowers = [lower for lower, _, _ in self.ranges]
+
+    def add_list(self, partition, values):
+        for value in values:
+            self.values[value] = partition
+
+    def partition_for(self, value):
+        """
+        :param value: The partition key value
+        :return: <str>. The partition of the value, the default one if it fits no
+            other, or None if it fits none
+        """
+        if self.strategy == 'list':
+            return self.values.get(value, self.default)
+        if value is None:
+            return self.default
+        # The unbounded (None) lower bound is lower than any value
+        unbounded = 1 if self._lowers and self._lowers[0] is None else 0
+        position = bisect_right(self._lowers, value, lo=unbounded)
+        if position:
+            lower, upper, partition = self.ranges[position - 1]
+            if upper is None or value < upper:
+                return partition
+        return self.default
+
+    def route(self, columns, values):
+        """
+        Group the rows by partition
+        :param columns: <tuple>.<str>
+        :param values: <list>.<tuple>
+        :return: <dict>. The positions of the rows (in values) by partition, with the
+            parent table (None) for the rows that fit no partition. None if the rows
+            cannot be routed (the key is not in the columns, or the values are not
+            comparable with the bounds)
+        """
+        if self.key not in columns:
+            return None
+        position = list(columns).index(self.key)
+        groups = dict()
+        try:
+            for row_position, row in enumerate(values):
+                groups.setdefault(self.partition_for(row[position]),
+                                  []).append(row_position)
+        except TypeError:
+            # E.g. a naive datetime against timestamptz bounds, or a str date
+            return None
+        return groups
+
+
+def discover(cursor):
+    """
+    Read the range and list partitioned tables, and their partitions, from the
+    catalog (postgres 10 or later)
+    :param cursor: <psycopg2.cursor>
+    :return: <dict>. The PartitionedTable objects by name (both as the given by
+        regclass and the schema qualified one)
+    """
+    if cursor.connection.server_version < 100000:
+        # There is no declarative partitioning before postgres 10
+        return dict()
+    cursor.execute("""
+        SELECT p.partrelid::regclass::text, n.nspname || '.' || pc.relname,
+               p.partstrat, a.attname, format_type(a.atttypid, a.atttypmod),
+               c.oid::regclass::text, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_partitioned_table p
+        JOIN pg_class pc ON pc.oid = p.partrelid
+        JOIN pg_namespace n ON n.oid = pc.relnamespace
+        JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+        LEFT JOIN pg_inherits i ON i.inhparent = p.partrelid
+        LEFT JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE p.partstrat IN ('r', 'l') AND p.partnatts = 1
+        """)
+    tables, bounds = dict(), []
+    for (name, qualified, strategy, key, key_type, partition,
+         bound) in cursor.fetchall():
+        if name not in tables:
+            tables[name] = PartitionedTable(
+                name, 'range' if strategy == 'r' else 'list', key, key_type
+            )
+            tables[qualified] = tables[name]
+        if partition is None:
+            continue
+        if bound == 'DEFAULT':
+            tables[name].default = partition
+            continue
+        match = _RANGE_BOUND.match(bound) or _LIST_BOUND.match(bound)
+        if match:
+            bounds.append((tables[name], partition, match.groups()))
+    if not bounds:
+        return tables
+
+    # The bounds are SQL literals, so the server converts them to python values
+    arrays = ['ARRAY[{}]::{}[]'.format(', '.join(map(_bound_literal, literals)),
+                                       table.key_type)
+              for table, _, literals in bounds]
+    cursor.execute('SELECT {}'.format(', '.join(arrays)))
+    for (table, partition, _), converted in zip(bounds, cursor.fetchone()):
+        if table.strategy == 'range':
+            table.add_range(partition, *converted)
+        else:
+            table.add_list(partition, converted)
+    return tables
+
+
+def partition_name(table, lower, period):
+    """
+    :return: <str>. E.g. events_p2020_01 for a monthly partition
+    """
+    formats = {'hour': '%Y%m%d_%H', 'day': '%Y%m%d', 'week': '%Y%m%d',
+               'month': '%Y_%m', 'quarter': '%Y_%m', 'year': '%Y'}
+    return '{}_p{}'.format(table, lower.strftime(formats[period]))
+
+
+class PartitionPolicy(object):
+    """
+    The lifecycle of a time range partitioned table. It may be set in the table
+    class, so the Set_db script applies it when creating the schema:
+        __table_args__ = {
+            'postgresql_partition_by': 'RANGE (created_at)',
+            'info': {'partition_policy': PartitionPolicy('month', ahead=3)}
+        }
+    """
+
+    def __init__(self, period, ahead=2, retention=None, detach_only=False):
+        """
+        :param period: <str>. The partition size. One of PERIODS
+        :param ahead: <int>. Number of future partitions kept created (besides the
+            current one)
+        :param retention: <str>. A postgres interval (e.g. '90 days'). The partitions
+            whose upper bound is older are detached and dropped. If None, they are
+            kept forever
+        :param detach_only: <bool>. Detach the expired partitions without dropping
+            them (e.g. to archive them)
+        """
+        if period not in PERIODS:
+            raise ValueError('The period must be one of {}'.format(PERIODS))
+        self.period = period
+        self.ahead = ahead
+        self.retention = retention
+        self.detach_only = detach_only
+
+
+def create_partitions(cursor, table, policy):
+    """
+    Create the current partition and the next policy.ahead ones of a time range
+    partitioned table. The periods already covered by a partition are skipped
+    :param cursor: <psycopg2.cursor>
+    :param table: <PartitionedTable>
+    :param policy: <PartitionPolicy>
+    :return: <list>.<str>. The created partitions
+    """
+    if table.strategy != 'range' or table.key_type not in TIME_TYPES:
+        raise ValueError('The table {} is not partitioned by a time range'
+                         .format(table.name))
+    cursor.execute("""
+        SELECT (start + step * interval '{1}')::{2},
+               (start + (step + 1) * interval '{1}')::{2}
+        FROM date_trunc('{0}', now()) start, generate_series(0, %s) step
+        """.format(policy.period,
+                   _PERIOD_INTERVALS.get(policy.period, '1 ' + policy.period),
+                   table.key_type), (policy.ahead,))
+    created = []
+    for lower, upper in cursor.fetchall():
+        if table.partition_for(lower) not in (None, table.default):
+            continue
+        # The partitions are created in the schema of the parent table
+        name = partition_name(table.name.rpartition('.')[2].strip('"'), lower,
+                              policy.period)
+        schema = table.name.rpartition('.')[0]
+        qualified = '{}.{}'.format(schema, name) if schema else name
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS {} PARTITION OF {}
+            FOR VALUES FROM (%s) TO (%s)
+            """.format(qualified, table.name), (lower, upper))
+        table.add_range(qualified, lower, upper)
+        created.append(qualified)
+    return created
+
+
+def expire_partitions(cursor, table, policy):
+    """
+    Detach, and drop unless policy.detach_only, the partitions of a time range
+    partitioned table whose upper bound is older than the policy retention
+    :param cursor: <psycopg2.cursor>
+    :param table: <PartitionedTable>
+    :param policy: <PartitionPolicy>
+    :return: <list>.<str>. The expired partitions
+    """
+    if policy.retention is None:
+        return []
+    cursor.execute('SELECT (now() - %s::interval)::{}'.format(table.key_type),
+                   (policy.retention,))
+    cutoff = cursor.fetchone()[0]
+    expired = [partition for _, upper, partition in table.ranges
+               if upper is not None and upper <= cutoff]
+    for partition in expired:
+        cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(table.name,
+                                                                   partition))
+        if not policy.detach_only:
+            cursor.execute('DROP TABLE {}'.format(partition))
+    table.remove_ranges(expired)
+    return expired
+
+
+def maintain(cursor, tables, policies):
+    """
+    Apply the policies: create the partitions ahead and expire the old ones
+    :param cursor: <psycopg2.cursor>
+    :param tables: <dict>. The discovered PartitionedTable objects by name
+    :param policies: <dict>. The PartitionPolicy by table name
+    :return: <dict>. The (created, expired) partitions by table name
+    """
+    results = dict()
+    for name, policy in policies.items():
+        if name not in tables:
+            raise ValueError('The table {} is not partitioned'.format(name))
+        results[name] = (create_partitions(cursor, tables[name], policy),
+                         expire_partitions(cursor, tables[name], policy))
+    return results
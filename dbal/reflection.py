@@ -0,0 +1,153 @@
+"""
+This module contains the reflection cache used by Database.reflect. The reflected
+MetaData is pickled under the config directory, keyed by database, along with a
+fingerprint of the schema. It is reflected again only when the fingerprint changes,
+so the processes starting with a big schema do not query the catalog table by table.
+"""
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import threading
+
+import sqlalchemy
+from sqlalchemy import MetaData
+
+from dbal.Config import Config_db
+
+CACHE_DIRECTORY = 'reflection'
+
+# Any DDL on the user relations changes some of these catalog rows
+FINGERPRINT_QUERY = """
+    SELECT
+        (SELECT md5(coalesce(string_agg(concat_ws(':', c.oid, n.nspname, c.relname,
+                                                  c.relkind, a.attnum, a.attname,
+                                                  a.atttypid, a.atttypmod,
+                                                  a.attnotnull, a.atthasdef,
+                                                  a.attisdropped),
+                                        ',' ORDER BY c.oid, a.attnum), ''))
+         FROM pg_class c
+         JOIN pg_namespace n ON n.oid = c.relnamespace
+         JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0
+         WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+           AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+           AND n.nspname NOT LIKE 'pg_toast%'),
+        (SELECT md5(coalesce(string_agg(concat_ws(':', co.oid, co.conname,
+                                                  co.contype, co.conrelid,
+                                                  co.conkey, co.confrelid,
+                                                  co.confkey),
+                                        ',' ORDER BY co.oid), ''))
+         FROM pg_constraint co
+         JOIN pg_namespace n ON n.oid = co.connamespace
+         WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')),
+        (SELECT md5(coalesce(string_agg(concat_ws(':', i.indexrelid, i.indrelid,
+                                                  i.indkey, i.indisunique),
+                                        ',' ORDER BY i.indexrelid), ''))
+         FROM pg_index i
+         JOIN pg_class c ON c.oid = i.indrelid
+         JOIN pg_namespace n ON n.oid = c.relnamespace
+         WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+           AND n.nspname NOT LIKE 'pg_toast%')
+"""
+
+_lock = threading.Lock()
+
+
+def schema_fingerprint(engine):
+    """
+    A hash of the user relations, columns, constraints and indexes definitions,
+    taken from pg_catalog. It is a single query, much cheaper than the reflection
+    :param engine: <sqlalchemy.engine.Engine>
+    :return: <str>
+    """
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(FINGERPRINT_QUERY)
+        parts = cursor.fetchone()
+        conn.rollback()
+    finally:
+        conn.close()
+    return hashlib.md5(':'.join(parts).encode('utf-8')).hexdigest()
+
+
+def cache_path(db_config, schema=None):
+    """
+    :param db_config: <DatabaseConfig>
+    :param schema: <str>
+    :return: <str>. The cache file of the database (and schema)
+    """
+    directory = os.path.join(Config_db.config_dir(), CACHE_DIRECTORY)
+    if not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    key = '_'.join(str(part) for part in
+                   (db_config.DB_HOST, db_config.DB_NAME, schema or 'default'))
+    return os.path.join(directory, re.sub(r'[^\w.-]', '_', key) + '.pickle')
+
+
+def _load(path):
+    try:
+        with open(path, 'rb') as cache_file:
+            cache = pickle.load(cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+            ImportError, TypeError):
+        return None
+    # A cache pickled by another sqlalchemy version may not be loaded correctly
+    if not isinstance(cache, dict) or \
+            cache.get('sqlalchemy') != sqlalchemy.__version__:
+        return None
+    return cache
+
+
+def _save(path, cache):
+    # Write and rename, so a concurrent process never reads a half written cache
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                             suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as cache_file:
+            pickle.dump(cache, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def reflect(engine, db_config, tables=None, schema=None, fingerprint=None,
+            refresh=False):
+    """
+    Get the reflected MetaData of the database, from the disk cache if the schema
+    fingerprint did not change.
+    :param engine: <sqlalchemy.engine.Engine>
+    :param db_config: <DatabaseConfig>. The cache key
+    :param tables: <list>.<str>. The tables to reflect. If None, all of them
+    :param schema: <str>. If None, the default one
+    :param fingerprint: <str>. The schema version (e.g. the migration version). If
+        None, it is computed from the catalog (see schema_fingerprint)
+    :param refresh: <bool>. Ignore the cache
+    :return: <sqlalchemy.MetaData>
+    """
+    if fingerprint is None:
+        fingerprint = schema_fingerprint(engine)
+    path = cache_path(db_config, schema)
+    with _lock:
+        cache = None if refresh else _load(path)
+        if cache is None or cache['fingerprint'] != fingerprint:
+            cache = {'sqlalchemy': sqlalchemy.__version__,
+                     'fingerprint': fingerprint, 'complete': False,
+                     'metadata': MetaData(schema=schema)}
+        metadata = cache['metadata']
+        if tables is None:
+            missing = None if not cache['complete'] else []
+        else:
+            prefix = schema + '.' if schema else ''
+            missing = [table for table in tables
+                       if prefix + table not in metadata.tables]
+        if missing is None or missing:
+            # The referred tables (foreign keys) are reflected too
+            metadata.reflect(bind=engine, schema=schema, only=missing,
+                             extend_existing=True)
+            cache['complete'] = cache['complete'] or missing is None
+            _save(path, cache)
+    return metadata
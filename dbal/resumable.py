@@ -0,0 +1,194 @@
+"""
+This module contains the resumable bulk loads used by the Database class. The values
+are written in chunks, each one committed in its own transaction along with a
+checkpoint (the last committed chunk) in a bookkeeping table, so a failed job can be
+re-run and resume from the checkpoint. The transient errors (serialization
+failures, deadlocks and connection losses) are retried with backoff.
+"""
+import random
+import time
+from itertools import islice
+
+from psycopg2 import InterfaceError, OperationalError
+
+CHECKPOINTS_TABLE = 'dbal_checkpoints'
+
+# serialization_failure and deadlock_detected
+TRANSIENT_SQLSTATES = ('40001', '40P01')
+
+
+def is_transient(error):
+    """
+    :param error: <Exception>
+    :return: <bool>. True if retrying the transaction may succeed
+    """
+    if getattr(error, 'pgcode', None) in TRANSIENT_SQLSTATES:
+        return True
+    # The connection was lost (OperationalError without sqlstate) or closed
+    return (isinstance(error, InterfaceError) or
+            (isinstance(error, OperationalError) and
+             getattr(error, 'pgcode', None) is None))
+
+
+def _chunked(values, chunk_size):
+    iterator = iter(values)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _ensure_checkpoints_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS {} (
+            job_id TEXT PRIMARY KEY,
+            chunk INTEGER NOT NULL,
+            finished BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )""".format(CHECKPOINTS_TABLE))
+
+
+def _save_checkpoint(cursor, job_id, chunk, finished=False):
+    cursor.execute("""
+        INSERT INTO {} (job_id, chunk, finished) VALUES (%s, %s, %s)
+        ON CONFLICT (job_id) DO UPDATE
+        SET chunk = EXCLUDED.chunk, finished = EXCLUDED.finished, updated_at = now()
+        """.format(CHECKPOINTS_TABLE), (job_id, chunk, finished))
+
+
+def _locked_checkpoint(cursor, job_id):
+    """
+    :return: <int>. The last committed chunk of the job, or -1. The checkpoint row
+        (created by read_checkpoint before the first chunk) is locked until the
+        transaction ends
+    """
+    cursor.execute('SELECT chunk FROM {} WHERE job_id = %s FOR UPDATE'
+                   .format(CHECKPOINTS_TABLE), (job_id,))
+    row = cursor.fetchone()
+    return row[0] if row else -1
+
+
+class _Connection(object):
+    """
+    A raw connection that is replaced when it is lost
+    """
+
+    def __init__(self, engine):
+        self._engine = engine
+        self.conn = engine.raw_connection()
+
+    def reset(self):
+        try:
+            if self.conn.connection.closed:
+                raise InterfaceError()
+            self.conn.rollback()
+        except (InterfaceError, OperationalError):
+            # Discard it from the pool and get a new one
+            self.conn.invalidate()
+            self.conn.close()
+            self.conn = self._engine.raw_connection()
+
+    def close(self):
+        self.conn.close()
+
+
+def _run_transaction(connection, function, max_retries, backoff, stats):
+    for attempt in range(max_retries + 1):
+        try:
+            cursor = connection.conn.cursor()
+            result = function(cursor)
+            connection.conn.commit()
+            return result
+        except Exception as e:
+            connection.reset()
+            if not is_transient(e) or attempt == max_retries:
+                raise e
+            stats['retries'] += 1
+            # Exponential backoff with jitter
+            time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+
+def resumable_bulk(engine, job_id, operation, table, columns, values,
+                   chunk_size=10000, max_retries=5, backoff=0.5, restart=False,
+                   echo=False, **kwargs):
+    """
+    Run a bulk operation in checkpointed chunks.
+    Attention, the chunks are identified by their position, so a re-run must pass
+    the same values in the same order.
+    :param engine: <sqlalchemy.engine.Engine>
+    :param job_id: <str>. Identifies the job checkpoint. Use the same one to resume
+    :param operation: <callable>. BulkOps.insert_many or BulkOps.update_many
+    :param table: <str>
+    :param columns: <tuple>.<str>
+    :param values: <iterable>.<tuple>
+    :param chunk_size: <int>. Rows committed by transaction
+    :param max_retries: <int>. Retries of every chunk on transient errors
+    :param backoff: <float>. The first retry delay, in seconds. It is doubled on
+        every retry
+    :param restart: <bool>. Ignore the checkpoint and start from the beginning
+    :param echo: <bool>
+    :param kwargs: Extra arguments of the operation
+    :return: <dict>. The committed and skipped chunks, the rows written and the
+        retries
+    """
+    stats = {'chunks': 0, 'skipped_chunks': 0, 'rows': 0, 'retries': 0}
+    connection = _Connection(engine)
+    try:
+        def read_checkpoint(cursor):
+            _ensure_checkpoints_table(cursor)
+            if restart:
+                _save_checkpoint(cursor, job_id, -1)
+            else:
+                # The row exists before the first chunk, so the chunks of two runs
+                # of a new job are serialized by its lock as well
+                cursor.execute("""
+                    INSERT INTO {} (job_id, chunk) VALUES (%s, -1)
+                    ON CONFLICT (job_id) DO NOTHING
+                    """.format(CHECKPOINTS_TABLE), (job_id,))
+            cursor.execute('SELECT chunk, finished FROM {} WHERE job_id = %s'
+                           .format(CHECKPOINTS_TABLE), (job_id,))
+            return cursor.fetchone()
+
+        checkpoint = _run_transaction(connection, read_checkpoint, max_retries,
+                                      backoff, stats)
+        if checkpoint and checkpoint[1]:
+            if echo:
+                print('The job {} is already finished'.format(job_id))
+            return stats
+        last_chunk = checkpoint[0] if checkpoint else -1
+        if echo and last_chunk >= 0:
+            print('Resuming the job {} after the chunk {}'.format(job_id, last_chunk))
+
+        for position, chunk in enumerate(_chunked(values, chunk_size)):
+            if position <= last_chunk:
+                stats['skipped_chunks'] += 1
+                continue
+
+            def write_chunk(cursor):
+                # A commit may fail (e.g. the connection is lost) after the server
+                # committed it, so the retry checks the checkpoint first. The lock
+                # also keeps two runs of the same job from writing the chunk
+                if _locked_checkpoint(cursor, job_id) >= position:
+                    return False
+                operation(cursor, table, columns, chunk, echo=echo, **kwargs)
+                _save_checkpoint(cursor, job_id, position)
+                return True
+
+            if _run_transaction(connection, write_chunk, max_retries, backoff, stats):
+                stats['chunks'] += 1
+                stats['rows'] += len(chunk)
+            else:
+                stats['skipped_chunks'] += 1
+
+        _run_transaction(
+            connection,
+            lambda cursor: _save_checkpoint(
+                cursor, job_id, stats['skipped_chunks'] + stats['chunks'] - 1,
+                finished=True
+            ),
+            max_retries, backoff, stats
+        )
+        return stats
+    finally:
+        connection.close()
@@ -0,0 +1,200 @@
+"""
+This module contains the snapshot helpers and the parallel table scans used by
+Database.parallel_scan: several connections read disjoint ranges of a table, all
+of them importing the same exported snapshot, so the scan is consistent.
+"""
+import queue
+import threading
+import uuid
+
+INTEGER_TYPES = ('smallint', 'integer', 'bigint')
+
+
+def import_snapshot(raw_conn, snapshot=None):
+    """
+    Open a read only repeatable read transaction. If a snapshot is given the
+    transaction will see exactly the same data as the one that exported it
+    :param raw_conn: <psycopg2.connection>
+    :param snapshot: <str>. The id returned by pg_export_snapshot()
+    :return: <psycopg2.cursor>
+    """
+    cursor = raw_conn.cursor()
+    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+    if snapshot:
+        cursor.execute("SET TRANSACTION SNAPSHOT '{}'".format(snapshot))
+    return cursor
+
+
+def export_snapshot(raw_conn):
+    """
+    Open a repeatable read transaction and export its snapshot. The snapshot can
+    be imported while this transaction is open
+    :param raw_conn: <psycopg2.connection>
+    :return: <tuple>. (snapshot id, cursor)
+    """
+    cursor = import_snapshot(raw_conn)
+    cursor.execute('SELECT pg_export_snapshot()')
+    return cursor.fetchone()[0], cursor
+
+
+def integer_primary_key(cursor, table):
+    """
+    :param cursor: <psycopg2.cursor>
+    :param table: <str>
+    :return: <str>. The primary key column, if it is a single integer one. Else None
+    """
+    cursor.execute("""
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        """, (table,))
+    columns = cursor.fetchall()
+    if len(columns) == 1 and columns[0][1] in INTEGER_TYPES:
+        return columns[0][0]
+    return None
+
+
+def scan_ranges(cursor, table, key, chunks):
+    """
+    Split the table into ranges. By key ranges if the key is an integer column,
+    else by physical (ctid) page ranges. The ctid ranges are read with a TID range
+    scan just since postgres 14. In older servers every range would scan the whole
+    table, so the table is read as a single range
+    :param cursor: <psycopg2.cursor>. In the exported snapshot
+    :param table: <str>
+    :param key: <str>. An integer column (e.g. the primary key) or None
+    :param chunks: <int>. Number of ranges
+    :return: <list>.<str>. The filter of each range
+    """
+    if key:
+        cursor.execute('SELECT min({0}), max({0}) FROM {1}'.format(key, table))
+        low, high = cursor.fetchone()
+        if low is None:
+            return []
+        step = max(-(-(high - low + 1) // chunks), 1)
+        return ['{0} >= {1} AND {0} < {2}'.format(key, start, start + step)
+                for start in range(low, high + 1, step)]
+    if cursor.connection.server_version < 140000:
+        return ['TRUE']
+    cursor.execute("SELECT pg_relation_size(%s::regclass) / "
+                   "current_setting('block_size')::int", (table,))
+    pages = cursor.fetchone()[0]
+    step = max(-(-pages // chunks), 1)
+    starts = list(range(0, pages, step)) or [0]
+    conditions = ["ctid >= '({},0)'::tid AND ctid < '({},0)'::tid"
+                  .format(start, start + step) for start in starts[:-1]]
+    # The last range is open, in case the table grew
+    conditions.append("ctid >= '({},0)'::tid".format(starts[-1]))
+    return conditions
+
+
+_DONE = object()
+
+
+def parallel_scan(engine, table, columns=None, workers=4, batch_size=10000,
+                  key=None, callback=None, batches=False, chunks_per_worker=4):
+    """
+    Read a whole table with several connections sharing one snapshot.
+    :param engine: <sqlalchemy.engine.Engine>
+    :param table: <str>. The table name
+    :param columns: <tuple>.<str>. The columns to read. If None, all of them
+    :param workers: <int>. Number of connections
+    :param batch_size: <int>. Rows fetched by round trip
+    :param key: <str>. Integer column used to split the table. If None, the primary
+        key (if it is a single integer column) or else the physical page ranges
+        (postgres 14 or later; in older servers the table is not split, so set
+        the key for those)
+    :param callback: <callable>. If set, it is called (from the worker threads)
+        with every batch of rows, and nothing is returned
+    :param batches: <bool>. Yield lists of rows instead of rows
+    :param chunks_per_worker: <int>. The table is split in workers * chunks_per_worker
+        ranges, taken by the workers as they finish, to balance the load
+    :return: <iterator>. The rows (or the batches), in no particular order
+    """
+    scan = _parallel_scan(engine, table, columns, workers, batch_size, key, callback,
+                          batches, chunks_per_worker)
+    if callback is None:
+        return scan
+    for _ in scan:
+        pass
+
+
+def _parallel_scan(engine, table, columns, workers, batch_size, key, callback,
+                   batches, chunks_per_worker):
+    fields = ', '.join(columns) if columns else '*'
+    coordinator = engine.raw_connection()
+    try:
+        snapshot, cursor = export_snapshot(coordinator)
+        if key is None:
+            key = integer_primary_key(cursor, table)
+        ranges = queue.Queue()
+        for condition in scan_ranges(cursor, table, key, workers * chunks_per_worker):
+            ranges.put(condition)
+        output = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+
+        def emit(item):
+            if callback is not None and item is not _DONE and \
+                    not isinstance(item, Exception):
+                callback(item)
+                return
+            # Do not block forever if the consumer is gone
+            while not stop.is_set():
+                try:
+                    output.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def work():
+            conn = engine.raw_connection()
+            try:
+                import_snapshot(conn, snapshot)
+                while not stop.is_set():
+                    try:
+                        condition = ranges.get_nowait()
+                    except queue.Empty:
+                        break
+                    named = conn.cursor(name='dbal_scan_{}'.format(uuid.uuid4().hex))
+                    named.itersize = batch_size
+                    named.execute('SELECT {} FROM {} WHERE {}'.format(
+                        fields, table, condition))
+                    while not stop.is_set():
+                        rows = named.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        emit(rows)
+                    named.close()
+            except Exception as e:
+                emit(e)
+            finally:
+                conn.rollback()
+                conn.close()
+                emit(_DONE)
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            # With a callback, just the errors and the ends are queued
+            pending = workers
+            while pending:
+                item = output.get()
+                if item is _DONE:
+                    pending -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                elif batches:
+                    yield item
+                else:
+                    for row in item:
+                        yield row
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+    finally:
+        # The snapshot must be kept alive until all the workers imported it
+        coordinator.rollback()
+        coordinator.close()
@@ -33,9 +33,38 @@ class Sentences(object):
         :return:
         """
         permissions_str = ', '.join(permissions)
-        return ("GRANT {} ON ALL TABLES IN SCHEMA public TO '{}'"
+        return ("GRANT {} ON ALL TABLES IN SCHEMA public TO \"{}\""
                 .format(permissions_str, role_name))
 
+    @staticmethod
+    def alter_def_permissions_on_all_tables(role_name, permissions):
+        """
+
+        :param role_name: <str>
+        :param permissions: <tuple> or <list>. Eg. ('SELECT', 'UPDATE', 'INSERT')
+        :return:
+        """
+        permissions_str = ', '.join(permissions)
+        return ('ALTER DEFAULT PRIVILEGES IN SCHEMA public GRANT {} ON TABLES TO "{}"'
+                .format(permissions_str, role_name))
+
+    @staticmethod
+    def create_role_if_not_exists(role_name, password):
+        """
+        Idempotent role creation. The role may be created at the same time from
+        another database of the cluster, so the duplicate errors are ignored as well
+        :param role_name: <str>
+        :param password: <str>
+        :return:
+        """
+        return ("DO $do$ BEGIN "
+                "IF NOT EXISTS (SELECT 1 FROM pg_roles WHERE rolname = '{0}') THEN "
+                "CREATE USER \"{1}\" PASSWORD '{2}'; "
+                "END IF; "
+                "EXCEPTION WHEN duplicate_object OR unique_violation THEN NULL; "
+                "END $do$".format(role_name.replace("'", "''"), role_name,
+                                  password.replace("'", "''")))
+
     @staticmethod
     def grant_permissions_on_all_sequences(role_name):
         return ("GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA public TO \"{}\""
@@ -0,0 +1,138 @@
+"""This script is meant to create the default roles and assign their privileges in
+ many databases at once. The whole plan is sent to every database as a single
+ transaction (one round trip), and the databases are provisioned concurrently.
+ Attention, the roles are global for each database cluster"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.database import Database, parse_db
+from .default_roles import Defaults
+from .helpers import Sentences
+
+
+def compile_plan(developer_user, developer_pass, viewer_user, viewer_pass,
+                 update_passwords=False):
+    """
+    Compile the statements creating the roles (if they do not exist) and granting
+    their privileges into a single script
+    :param update_passwords: <bool>. Set True if you want to set the passwords of
+        the roles that already exist as well
+    :return: <str>
+    """
+    sentences = [
+        Sentences.create_role_if_not_exists(developer_user, developer_pass),
+        Sentences.create_role_if_not_exists(viewer_user, viewer_pass),
+    ]
+    if update_passwords:
+        sentences += [Sentences.change_password(developer_user, developer_pass),
+                      Sentences.change_password(viewer_user, viewer_pass)]
+    sentences += [
+        Sentences.grant_permissions_on_all_tables(
+            developer_user, ('SELECT', 'UPDATE', 'INSERT', 'DELETE')),
+        Sentences.alter_def_permissions_on_all_tables(
+            developer_user, ('SELECT', 'UPDATE', 'INSERT', 'DELETE')),
+        Sentences.grant_permissions_on_all_sequences(developer_user),
+        Sentences.alter_def_permissions_on_all_sequences(developer_user),
+        Sentences.grant_permissions_on_all_tables(viewer_user, ('SELECT',)),
+        Sentences.alter_def_permissions_on_all_tables(viewer_user, ('SELECT',)),
+    ]
+    return ';\n'.join(sentences) + ';'
+
+
+def discover_databases(db):
+    """
+    :param db: <Database>
+    :return: <list>.<str>. The databases of the server accepting connections
+    """
+    return [row[0] for row in db.execute(
+        "SELECT datname FROM pg_database WHERE datallowconn AND NOT datistemplate"
+    )]
+
+
+def config_for(db_config, db_name):
+    config = {k: v for k, v in db_config.config.items() if k != 'DB_NAME'}
+    config['DB_NAME'] = db_name
+    return DatabaseConfig(config)
+
+
+def provision_database(db_config, plan):
+    """
+    Run the whole plan in a single transaction. It is run on a raw cursor, so the
+    passwords and comments are sent as they are (not parsed for bind parameters)
+    :param db_config: <DatabaseConfig>
+    :param plan: <str>
+    :return: <tuple>. (error or None, elapsed seconds)
+    """
+    start = time.time()
+    # Not a Database object, since the Singleton registry would keep one (and its
+    # pool) by database. The connection is closed once provisioned
+    engine = create_engine(parse_db(db_config), poolclass=NullPool)
+    try:
+        conn = engine.raw_connection()
+        try:
+            conn.cursor().execute(plan)
+            conn.commit()
+        finally:
+            conn.close()
+        return None, time.time() - start
+    except Exception as e:
+        return str(e).strip(), time.time() - start
+    finally:
+        engine.dispose()
+
+
+def provision(db_configs, plan, jobs=8):
+    """
+    Provision the databases concurrently
+    :param db_configs: <list>.<DatabaseConfig>
+    :param plan: <str>. See compile_plan
+    :param jobs: <int>. Number of databases provisioned at the same time
+    :return: <dict>. The (error or None, elapsed seconds) by database name
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(lambda config: provision_database(config, plan),
+                               db_configs)
+        return {config.DB_NAME: result
+                for config, result in zip(db_configs, results)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('databases', type=str, nargs='*',
+                        help='The databases to provision. If none, all the databases '
+                             'of the server defined in the config file are provisioned')
+    parser.add_argument('--Viewer_user', type=str, default=Defaults.Viewer_user,
+                        help='Set the viewer user name, Default="{}"'
+                        .format(Defaults.Viewer_user))
+    parser.add_argument('--Viewer_pass', type=str, default=Defaults.Viewer_Pass,
+                        help='Set the viewer user password, Default="{}"'
+                        .format(Defaults.Viewer_Pass))
+    parser.add_argument('--Developer_user', type=str, default=Defaults.Developer_user,
+                        help='Set the developer user name, Default="{}"'
+                        .format(Defaults.Developer_user))
+    parser.add_argument('--Developer_Pass', type=str, default=Defaults.Developer_Pass,
+                        help='Set the developer user password, Default="{}"'
+                        .format(Defaults.Developer_Pass))
+    parser.add_argument('--update_passwords', action='store_true',
+                        help='Set the passwords of the already existent roles too')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='Number of databases provisioned at the same time. '
+                             'Default=8')
+    args = parser.parse_args()
+
+    DB = Database()
+    databases = args.databases or discover_databases(DB)
+    plan = compile_plan(args.Developer_user, args.Developer_Pass, args.Viewer_user,
+                        args.Viewer_pass, update_passwords=args.update_passwords)
+    results = provision([config_for(DB.db_config, name) for name in databases], plan,
+                        jobs=args.jobs)
+    for name, (error, elapsed) in sorted(results.items()):
+        print('{}: {} ({:.2f} seconds)'.format(name, error or 'OK', elapsed))
+    failed = [name for name, (error, _) in results.items() if error]
+    print('{} databases provisioned, {} failed'.format(len(results) - len(failed),
+                                                        len(failed)))
@@ -0,0 +1,481 @@
+"""
+This script is meant to make a copy of a postgresql Database from one server to
+another one, without dumping it into a temporal file.
+First, the schema (tables, types, sequences, functions...) is copied. Then every
+table is streamed from the source to the destination (COPY TO STDOUT -> COPY FROM
+STDIN), several tables at a time. All the source connections share the same
+exported snapshot, so the copy is consistent. Finally, the indexes, the constraints
+and the triggers are built, in parallel as well, and the materialized views are
+refreshed.
+The destination database will be assigned with a name like
+copy_postgres_2019_03_01_17_15
+"""
+import argparse
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from getpass import getpass
+
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.database import Database
+from dbal.scan import export_snapshot, import_snapshot
+from dbal.scripts.create_and_set_up_db import create_db
+from dbal.scripts.Roles.assign_roles_privileges import assign_roles
+from dbal.scripts.Roles.create_roles import create_roles
+from dbal.scripts.Roles.default_roles import Defaults
+
+# We assume the "postgres" database always exists. We need an existent database for
+# creating the copy
+DESTINATION_EXISTENT_DB = 'postgres'
+# We can set an avoided destination host. For example for assuring not
+# to write to a production server
+AVOIDED_DESTINATION_HOST = 'your_production_host'
+
+SYSTEM_SCHEMAS = "('pg_catalog', 'information_schema', 'pg_toast')"
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def quote_ident(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def qualified_name(schema, table):
+    return '{}.{}'.format(quote_ident(schema), quote_ident(table))
+
+
+def libpq_args(db_config):
+    """
+    Translate a DatabaseConfig object into the pg_dump/psql/pg_restore
+     connection arguments
+    :param db_config: <DatabaseConfig>
+    :return: <list>
+    """
+    host, _, port = db_config.DB_HOST.partition(':')
+    args = ['-h', host, '-U', db_config.User, '-d', db_config.DB_NAME]
+    if port:
+        args += ['-p', port]
+    return args
+
+
+def libpq_env(db_config):
+    env = dict(os.environ)
+    env['PGPASSWORD'] = db_config.Pass
+    return env
+
+
+def pipe_copy(src_cursor, dst_cursor, copy_to, copy_from, buffer_size=2 ** 18):
+    """
+    Stream the output of a COPY ... TO STDOUT into a COPY ... FROM STDIN, through
+    an os pipe. Nothing is written to disk and just one buffer is held in memory
+    :param src_cursor: <psycopg2.cursor>
+    :param dst_cursor: <psycopg2.cursor>
+    :param copy_to: <str>. E.g: COPY "public"."users" TO STDOUT
+    :param copy_from: <str>. E.g: COPY "public"."users" FROM STDIN
+    :param buffer_size: <int>. The size of the chunks read from the pipe
+    :return: <int>. The number of bytes transferred
+    """
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, 'rb', buffer_size)
+    writer = os.fdopen(write_fd, 'wb', buffer_size)
+    errors = []
+
+    def produce():
+        try:
+            src_cursor.copy_expert(copy_to, writer, buffer_size)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                writer.close()
+            except OSError as e:
+                # The consumer is gone (broken pipe), its error will be raised
+                errors.append(e)
+
+    counter = _CountingReader(reader)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        dst_cursor.copy_expert(copy_from, counter, buffer_size)
+    finally:
+        # If the consumer failed, closing the pipe unblocks the producer
+        reader.close()
+        producer.join()
+    if errors:
+        raise errors[0]
+    return counter.bytes
+
+
+class _CountingReader(object):
+
+    def __init__(self, file_obj):
+        self._file = file_obj
+        self.bytes = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.bytes += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self._file.readline(size)
+        self.bytes += len(data)
+        return data
+
+
+def list_tables(cursor):
+    """
+    List the user tables holding data, the biggest ones first, so the long copies
+    start as soon as possible
+    :param cursor: <psycopg2.cursor>
+    :return: <list>.<tuple>. (schema, table)
+    """
+    cursor.execute("""
+        SELECT n.nspname, c.relname
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r' AND n.nspname NOT IN {}
+          AND n.nspname NOT LIKE 'pg_temp%'
+        ORDER BY pg_total_relation_size(c.oid) DESC
+        """.format(SYSTEM_SCHEMAS))
+    return cursor.fetchall()
+
+
+def sequences_values(cursor):
+    cursor.execute("""
+        SELECT schemaname, sequencename, last_value FROM pg_sequences
+        WHERE last_value IS NOT NULL AND schemaname NOT IN {}
+        """.format(SYSTEM_SCHEMAS))
+    return cursor.fetchall()
+
+
+def post_data_statements(cursor):
+    """
+    Retrieve the statements that build the post-data section of the schema, grouped
+    in phases that must run one after the other.
+    :param cursor: <psycopg2.cursor>
+    :return: <list>.<tuple>. (statements, concurrent). If concurrent is False the
+        statements of the phase must run one at a time
+    """
+    # Primary keys, unique and exclusion constraints (with their indexes), and
+    # the rest of the indexes
+    cursor.execute("""
+        SELECT format('ALTER TABLE %I.%I ADD CONSTRAINT %I %s', n.nspname,
+                      c.relname, con.conname, pg_get_constraintdef(con.oid))
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE con.contype IN ('p', 'u', 'x') AND con.conislocal
+          AND n.nspname NOT IN {0}
+        UNION ALL
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname NOT IN {0}
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint con
+                          WHERE con.conindid = i.indexrelid
+                          AND con.contype IN ('p', 'u', 'x'))
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits inh
+                          WHERE inh.inhrelid = i.indexrelid)
+        """.format(SYSTEM_SCHEMAS))
+    indexes = [row[0] for row in cursor.fetchall()]
+    # Foreign keys lock both tables, so they are added one at a time as NOT VALID
+    # (no table scan, it is fast) and validated concurrently afterwards
+    cursor.execute("""
+        SELECT format('ALTER TABLE %I.%I ADD CONSTRAINT %I %s NOT VALID',
+                      n.nspname, c.relname, con.conname,
+                      pg_get_constraintdef(con.oid)),
+               format('ALTER TABLE %I.%I VALIDATE CONSTRAINT %I',
+                      n.nspname, c.relname, con.conname)
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE con.contype = 'f' AND con.conislocal AND n.nspname NOT IN {}
+        """.format(SYSTEM_SCHEMAS))
+    foreign_keys = cursor.fetchall()
+    cursor.execute("""
+        SELECT pg_get_triggerdef(t.oid)
+        FROM pg_trigger t
+        JOIN pg_class c ON c.oid = t.tgrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE NOT t.tgisinternal AND n.nspname NOT IN {0}
+        UNION ALL
+        SELECT pg_get_ruledef(r.oid)
+        FROM pg_rewrite r
+        JOIN pg_class c ON c.oid = r.ev_class
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE r.rulename <> '_RETURN' AND n.nspname NOT IN {0}
+        """.format(SYSTEM_SCHEMAS))
+    triggers = [row[0] for row in cursor.fetchall()]
+    return [(indexes, True),
+            ([fk[0] for fk in foreign_keys], False),
+            ([fk[1] for fk in foreign_keys], True),
+            (triggers, False)] + \
+        [(level, True) for level in materialized_views_refreshes(cursor)]
+
+
+def materialized_views_refreshes(cursor):
+    """
+    The pre-data section creates the materialized views WITH NO DATA (the REFRESH
+    belongs to the post-data one), so the views populated in the source must be
+    refreshed once the data and the indexes are copied.
+    :param cursor: <psycopg2.cursor>
+    :return: <list>.<list>.<str>. The REFRESH statements in dependency levels: the
+        views of a level only depend on the ones of the previous levels
+    """
+    cursor.execute("""
+        SELECT c.oid, format('REFRESH MATERIALIZED VIEW %I.%I', n.nspname, c.relname)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'm' AND c.relispopulated AND n.nspname NOT IN {}
+        """.format(SYSTEM_SCHEMAS))
+    statements = dict(cursor.fetchall())
+    # The materialized views read by every materialized view
+    cursor.execute("""
+        SELECT DISTINCT r.ev_class, d.refobjid
+        FROM pg_rewrite r
+        JOIN pg_depend d ON d.classid = 'pg_rewrite'::regclass AND d.objid = r.oid
+        JOIN pg_class c ON c.oid = d.refobjid
+        WHERE c.relkind = 'm' AND d.refobjid <> r.ev_class
+        """)
+    depends = {view: set() for view in statements}
+    for view, referred in cursor.fetchall():
+        if view in depends and referred in statements:
+            depends[view].add(referred)
+    levels, done = [], set()
+    while len(done) < len(statements):
+        level = [view for view in statements
+                 if view not in done and depends[view] <= done]
+        if not level:
+            # A dependency cycle cannot exist, but do not loop forever anyway
+            level = [view for view in statements if view not in done]
+        levels.append([statements[view] for view in level])
+        done.update(level)
+    return levels
+
+
+def copy_schema(src_config, dst_config, snapshot):
+    """
+    Copy the pre-data section of the schema (pg_dump | psql). The data, the indexes
+    and the constraints are copied later on
+    :param src_config: <DatabaseConfig>
+    :param dst_config: <DatabaseConfig>
+    :param snapshot: <str>. The exported snapshot id
+    :return:
+    """
+    dump = subprocess.Popen(
+        ['pg_dump', '--section=pre-data', '-O', '-x',
+         '--snapshot={}'.format(snapshot)] + libpq_args(src_config),
+        stdout=subprocess.PIPE, env=libpq_env(src_config)
+    )
+    restore = subprocess.Popen(
+        ['psql', '-q', '-v', 'ON_ERROR_STOP=1'] + libpq_args(dst_config),
+        stdin=dump.stdout, stdout=subprocess.DEVNULL, env=libpq_env(dst_config)
+    )
+    # Let psql be the only reader, so pg_dump gets a SIGPIPE if psql fails
+    dump.stdout.close()
+    if restore.wait() or dump.wait():
+        raise ReplicationError('The schema could not be copied')
+
+
+def copy_table(src_db, dst_db, snapshot, schema, table, binary=True):
+    """
+    Stream a whole table from the source to the destination database
+    :param src_db: <Database>
+    :param dst_db: <Database>
+    :param snapshot: <str>. The exported snapshot id
+    :param schema: <str>
+    :param table: <str>
+    :param binary: <bool>. Use the binary COPY format. Both servers must run the
+        same major version
+    :return: <int>. Bytes transferred
+    """
+    name = qualified_name(schema, table)
+    fmt = ' WITH (FORMAT binary)' if binary else ''
+    src_conn = src_db.engine.raw_connection()
+    dst_conn = dst_db.engine.raw_connection()
+    try:
+        src_cursor = import_snapshot(src_conn, snapshot)
+        dst_cursor = dst_conn.cursor()
+        dst_cursor.execute('SET LOCAL synchronous_commit TO off')
+        transferred = pipe_copy(src_cursor, dst_cursor,
+                                'COPY {} TO STDOUT{}'.format(name, fmt),
+                                'COPY {} FROM STDIN{}'.format(name, fmt))
+        dst_conn.commit()
+        src_conn.rollback()
+        return transferred
+    except Exception:
+        dst_conn.rollback()
+        src_conn.rollback()
+        raise
+    finally:
+        src_conn.close()
+        dst_conn.close()
+
+
+def run_statements(db, statements, jobs, maintenance_work_mem=None):
+    """
+    Run each statement in its own transaction, concurrently
+    :param db: <Database>
+    :param statements: <list>.<str>
+    :param jobs: <int>. Number of concurrent connections
+    :param maintenance_work_mem: <str>. E.g: '1GB'. Memory used per index build
+    :return:
+    """
+    def run(statement):
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            if maintenance_work_mem:
+                cursor.execute("SET LOCAL maintenance_work_mem TO '{}'"
+                               .format(maintenance_work_mem))
+            cursor.execute(statement)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # Consume the results so the first error is raised
+        list(executor.map(run, statements))
+
+
+def set_sequences(db, sequences):
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for schema, sequence, last_value in sequences:
+            cursor.execute('SELECT setval(%s, %s)',
+                           (qualified_name(schema, sequence), last_value))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def set_up_roles(dst_db, developer_user=Defaults.Developer_user,
+                 developer_pass=Defaults.Developer_Pass,
+                 viewer_user=Defaults.Viewer_user, viewer_pass=Defaults.Viewer_Pass):
+    # The roles are global for the cluster. If they already exist, they are kept
+    create_roles(dst_db, developer_user, developer_pass, viewer_user, viewer_pass)
+    assign_roles(dst_db, developer_user, viewer_user)
+
+
+def replicate(src_config, dst_config, jobs=4, binary=True, roles=False,
+              maintenance_work_mem=None):
+    """
+    Replicate the source database into the destination one. The destination
+    database must exist and must be empty
+    :param src_config: <DatabaseConfig>
+    :param dst_config: <DatabaseConfig>
+    :param jobs: <int>. Number of tables copied (and indexes built) concurrently
+    :param binary: <bool>. Use the binary COPY format
+    :param roles: <bool>. Set True if you want to create the default roles and
+        assign their privileges in the new database
+    :param maintenance_work_mem: <str>. Memory used per index build
+    :return: <dict>. The timings (in seconds) of every phase
+    """
+    # One connection per job, plus the one holding the snapshot
+    src_db = Database(db_config=src_config, pool_size=jobs + 1)
+    dst_db = Database(db_config=dst_config, pool_size=jobs)
+    timings = dict()
+    transferred = 0
+
+    coordinator = src_db.engine.raw_connection()
+    try:
+        snapshot, cursor = export_snapshot(coordinator)
+        tables = list_tables(cursor)
+        sequences = sequences_values(cursor)
+        post_data = post_data_statements(cursor)
+
+        start = time.time()
+        print('Copying the schema')
+        copy_schema(src_config, dst_config, snapshot)
+        timings['schema'] = time.time() - start
+
+        start = time.time()
+        print('Copying {} tables, {} at a time'.format(len(tables), jobs))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(copy_table, src_db, dst_db, snapshot, schema,
+                                table, binary): qualified_name(schema, table)
+                for schema, table in tables
+            }
+            for future, name in futures.items():
+                transferred += future.result()
+                print('Table {} copied'.format(name))
+        timings['data'] = time.time() - start
+    finally:
+        # The snapshot must be kept alive until all the tables are copied
+        coordinator.rollback()
+        coordinator.close()
+
+    start = time.time()
+    set_sequences(dst_db, sequences)
+    print('Building the indexes and constraints, and refreshing the materialized '
+          'views')
+    for statements, concurrent in post_data:
+        run_statements(dst_db, statements, jobs if concurrent else 1,
+                       maintenance_work_mem)
+    timings['post_data'] = time.time() - start
+
+    if roles:
+        set_up_roles(dst_db)
+    print('{} bytes transferred. Timings (seconds): {}'
+          .format(transferred, ', '.join('{}={:.1f}'.format(k, v)
+                                         for k, v in timings.items())))
+    return timings
+
+
+def request_config(host, port, db_name, description):
+    user = input('input the USER for the {} HOST:\n'.format(description))
+    password = getpass('input the PASSWORD for the {} HOST user:\n'
+                       .format(description))
+    return DatabaseConfig({'DB_HOST': '{}:{}'.format(host, port),
+                           'DB_NAME': db_name, 'User': user, 'Pass': password})
+
+
+def main(source_host, source_port, destination_host, destination_port, source_db,
+         jobs, binary=True, roles=False, maintenance_work_mem=None):
+    if destination_host == AVOIDED_DESTINATION_HOST:
+        raise ReplicationError('The {} destination host is not elegible as a '
+                               'destination host'.format(destination_host))
+    src_config = request_config(source_host, source_port, source_db, 'SOURCE')
+    admin_config = request_config(destination_host, destination_port,
+                                   DESTINATION_EXISTENT_DB, 'DESTINATION')
+    db_copy = 'copy_{}_{}'.format(source_db,
+                                  datetime.utcnow().strftime('%Y_%m_%d_%H_%M'))
+    create_db(Database(db_config=admin_config, autocommit=True), db_copy)
+    dst_config = DatabaseConfig(dict(admin_config.config, DB_NAME=db_copy))
+    print('replicating the database with the name {}'.format(db_copy))
+    replicate(src_config, dst_config, jobs=jobs, binary=binary, roles=roles,
+              maintenance_work_mem=maintenance_work_mem)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-sh', '--source_host', type=str, required=True)
+    parser.add_argument('-sp', '--source_port', type=int, default=5432)
+    parser.add_argument('-dh', '--destination_host', type=str, required=True)
+    parser.add_argument('-dp', '--destination_port', type=int, default=5432)
+    parser.add_argument('-db', '--source_db', type=str, required=True,
+                        help='The database you want to copy')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Number of tables copied concurrently. Default=4')
+    parser.add_argument('--text', action='store_true',
+                        help='Use the text COPY format instead of the binary one. '
+                             'Needed when the servers run different major versions')
+    parser.add_argument('--roles', action='store_true',
+                        help='Create the default roles (if they do not exist) and '
+                             'grant their privileges in the new database')
+    parser.add_argument('--maintenance_work_mem', type=str, default=None,
+                        help='Memory used by each index build. E.g: 1GB')
+    args = parser.parse_args()
+    main(args.source_host, args.source_port, args.destination_host,
+         args.destination_port, args.source_db, args.jobs, binary=not args.text,
+         roles=args.roles, maintenance_work_mem=args.maintenance_work_mem)
@@ -7,7 +7,12 @@ from dbal.database import Database
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of concurrent connections. Default=1')
     args = parser.parse_args()
-    db = Database()
-    main(db)
+    db = Database(pool_size=args.jobs)
+    timings = main(db, jobs=args.jobs)
+    if timings:
+        print('Timings (seconds): {}'.format(
+            ', '.join('{}={:.1f}'.format(k, v) for k, v in timings.items())))
     print('All schemas were correctly populated into the database')
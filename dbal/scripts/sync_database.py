@@ -0,0 +1,225 @@
+"""
+This script is meant to refresh a copy of a database (e.g. the one created with the
+replicate_database script) with the current contents of the source database,
+copying only what has changed.
+Every table is split into primary key ranges. An md5 aggregate of each range is
+compared between both databases, and just the ranges that differ are deleted and
+copied again into the destination (so inserted, updated and deleted rows are
+synchronized). Several tables are synchronized at a time, all of them using the
+same source snapshot. Both databases must have the same schema.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dbal.database import Database
+from dbal.scan import export_snapshot, import_snapshot
+from dbal.scripts.replicate_database import (
+    AVOIDED_DESTINATION_HOST, ReplicationError, list_tables,
+    pipe_copy, qualified_name, quote_ident, request_config, sequences_values,
+    set_sequences
+)
+
+
+def primary_key(cursor, schema, table):
+    """
+    :param cursor: <psycopg2.cursor>
+    :param schema: <str>
+    :param table: <str>
+    :return: <list>.<str>. The primary key columns, in the index order. Empty if the
+        table has no primary key
+    """
+    cursor.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey::int2[], a.attnum)
+        """, (qualified_name(schema, table),))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def range_boundaries(cursor, table, pk, chunk_size):
+    """
+    Take every chunk_size-th primary key of the table as a range boundary
+    :param cursor: <psycopg2.cursor>
+    :param table: <str>. The qualified table name
+    :param pk: <list>.<str>
+    :param chunk_size: <int>. Rows per range
+    :return: <list>.<tuple>
+    """
+    pk_str = ', '.join(map(quote_ident, pk))
+    cursor.execute("""
+        SELECT {0} FROM (
+            SELECT {0}, row_number() OVER (ORDER BY {0}) AS _sync_rn FROM {1}
+        ) s WHERE mod(_sync_rn, %s) = 0
+        """.format(pk_str, table), (chunk_size,))
+    return cursor.fetchall()
+
+
+def range_condition(pk, lower, upper):
+    """
+    Build the filter for the (lower, upper] primary key range. A None bound means
+    the range is open on that side
+    :return: <tuple>. (condition, parameters)
+    """
+    if not pk:
+        return 'TRUE', []
+    columns = '({})'.format(', '.join(map(quote_ident, pk)))
+    marks = '({})'.format(', '.join(['%s'] * len(pk)))
+    conditions, params = [], []
+    if lower is not None:
+        conditions.append('{} > {}'.format(columns, marks))
+        params.extend(lower)
+    if upper is not None:
+        conditions.append('{} <= {}'.format(columns, marks))
+        params.extend(upper)
+    return ' AND '.join(conditions) or 'TRUE', params
+
+
+def range_checksum(cursor, table, pk, condition, params):
+    order = ', '.join(map(quote_ident, pk)) if pk else '_sync_row::text'
+    cursor.execute("""
+        SELECT count(*), md5(string_agg(md5(_sync_row::text), '' ORDER BY {}))
+        FROM {} _sync_row WHERE {}
+        """.format(order, table, condition), params)
+    return cursor.fetchone()
+
+
+def sync_table(src_db, dst_db, snapshot, schema, table, chunk_size=10000,
+               binary=True):
+    """
+    Synchronize the differing primary key ranges of a table
+    :param src_db: <Database>
+    :param dst_db: <Database>
+    :param snapshot: <str>. The exported snapshot id
+    :param schema: <str>
+    :param table: <str>
+    :param chunk_size: <int>. Rows per range
+    :param binary: <bool>. Use the binary COPY format
+    :return: <tuple>. (differing ranges, total ranges, bytes transferred)
+    """
+    name = qualified_name(schema, table)
+    fmt = ' WITH (FORMAT binary)' if binary else ''
+    src_conn = src_db.engine.raw_connection()
+    dst_conn = dst_db.engine.raw_connection()
+    try:
+        src_cursor = import_snapshot(src_conn, snapshot)
+        dst_cursor = dst_conn.cursor()
+        for cursor in (src_cursor, dst_cursor):
+            # The row text representation must be the same in both servers
+            cursor.execute("SET LOCAL TimeZone TO 'UTC'")
+            cursor.execute('SET LOCAL extra_float_digits TO 3')
+        # The rows are deleted and copied again, so the foreign keys (and the
+        # user triggers) must not fire in the destination
+        dst_cursor.execute('SET LOCAL session_replication_role TO replica')
+
+        pk = primary_key(src_cursor, schema, table)
+        # Tables without primary key are compared (and copied) as a whole
+        boundaries = range_boundaries(src_cursor, name, pk, chunk_size) if pk else []
+        lowers = [None] + boundaries
+        uppers = boundaries + [None]
+        differing, transferred = 0, 0
+        for lower, upper in zip(lowers, uppers):
+            condition, params = range_condition(pk, lower, upper)
+            if (range_checksum(src_cursor, name, pk, condition, params) ==
+                    range_checksum(dst_cursor, name, pk, condition, params)):
+                continue
+            differing += 1
+            condition = src_cursor.mogrify(condition, params).decode('utf-8')
+            dst_cursor.execute('DELETE FROM {} WHERE {}'.format(name, condition))
+            transferred += pipe_copy(
+                src_cursor, dst_cursor,
+                'COPY (SELECT * FROM {} WHERE {}) TO STDOUT{}'.format(
+                    name, condition, fmt),
+                'COPY {} FROM STDIN{}'.format(name, fmt)
+            )
+        dst_conn.commit()
+        src_conn.rollback()
+        return differing, len(lowers), transferred
+    except Exception:
+        dst_conn.rollback()
+        src_conn.rollback()
+        raise
+    finally:
+        src_conn.close()
+        dst_conn.close()
+
+
+def sync(src_config, dst_config, jobs=4, chunk_size=10000, binary=True):
+    """
+    Synchronize the destination database with the source one
+    :param src_config: <DatabaseConfig>
+    :param dst_config: <DatabaseConfig>
+    :param jobs: <int>. Number of tables synchronized concurrently
+    :param chunk_size: <int>. Rows per compared range
+    :param binary: <bool>. Use the binary COPY format
+    :return: <dict>. The (differing ranges, total ranges, bytes) by table
+    """
+    src_db = Database(db_config=src_config, pool_size=jobs + 1)
+    dst_db = Database(db_config=dst_config, pool_size=jobs)
+    start = time.time()
+    results = dict()
+
+    coordinator = src_db.engine.raw_connection()
+    try:
+        snapshot, cursor = export_snapshot(coordinator)
+        tables = list_tables(cursor)
+        sequences = sequences_values(cursor)
+
+        print('Synchronizing {} tables, {} at a time'.format(len(tables), jobs))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(sync_table, src_db, dst_db, snapshot, schema,
+                                table, chunk_size, binary):
+                    qualified_name(schema, table)
+                for schema, table in tables
+            }
+            for future, name in futures.items():
+                results[name] = future.result()
+                if results[name][0]:
+                    print('Table {}: {} of {} ranges synchronized'
+                          .format(name, *results[name][:2]))
+    finally:
+        coordinator.rollback()
+        coordinator.close()
+    set_sequences(dst_db, sequences)
+
+    print('{} of {} ranges synchronized, {} bytes transferred in {:.1f} seconds'
+          .format(sum(r[0] for r in results.values()),
+                  sum(r[1] for r in results.values()),
+                  sum(r[2] for r in results.values()), time.time() - start))
+    return results
+
+
+def main(source_host, source_port, source_db, destination_host, destination_port,
+         destination_db, jobs, chunk_size, binary=True):
+    if destination_host == AVOIDED_DESTINATION_HOST:
+        raise ReplicationError('The {} destination host is not elegible as a '
+                               'destination host'.format(destination_host))
+    src_config = request_config(source_host, source_port, source_db, 'SOURCE')
+    dst_config = request_config(destination_host, destination_port,
+                                destination_db, 'DESTINATION')
+    sync(src_config, dst_config, jobs=jobs, chunk_size=chunk_size, binary=binary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-sh', '--source_host', type=str, required=True)
+    parser.add_argument('-sp', '--source_port', type=int, default=5432)
+    parser.add_argument('-db', '--source_db', type=str, required=True,
+                        help='The database you want to copy from')
+    parser.add_argument('-dh', '--destination_host', type=str, required=True)
+    parser.add_argument('-dp', '--destination_port', type=int, default=5432)
+    parser.add_argument('-ddb', '--destination_db', type=str, required=True,
+                        help='The database you want to refresh')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='Number of tables synchronized concurrently. Default=4')
+    parser.add_argument('--chunk_size', type=int, default=10000,
+                        help='Rows per compared range. Default=10000')
+    parser.add_argument('--text', action='store_true',
+                        help='Use the text COPY format instead of the binary one')
+    args = parser.parse_args()
+    main(args.source_host, args.source_port, args.source_db, args.destination_host,
+         args.destination_port, args.destination_db, args.jobs, args.chunk_size,
+         binary=not args.text)
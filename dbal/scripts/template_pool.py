@@ -0,0 +1,230 @@
+"""
+This script keeps a pool of databases pre-cloned from a template database, so new
+(e.g. testing) databases can be handed out instantly instead of waiting for a
+"CREATE DATABASE ... TEMPLATE" (which also needs every session on the template to be
+terminated).
+The pooled databases are named <template>_pool_<random suffix>. Handing one out
+just renames it (ALTER DATABASE ... RENAME TO), which is atomic, so several
+processes can take databases from the same pool. Running this script keeps the
+pool filled in the background; the TemplatePool class can be used directly as well.
+"""
+import argparse
+import threading
+import time
+import uuid
+
+from sqlalchemy.exc import DBAPIError
+
+from dbal.database import Database
+
+
+class PoolTimeout(Exception):
+    def __init__(self, template):
+        super().__init__('There is no database cloned from {} available'
+                         .format(template))
+
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class TemplatePool(object):
+    """
+    Pool of databases cloned from a template. Use "acquire" to get a new database
+    and "release" to drop (or recycle) it when you are done.
+    """
+
+    def __init__(self, db, template, size=5, refill_interval=1.0):
+        """
+        :param db: <Database>. An autocommit database object, connected to a
+            database other than the template (e.g. postgres)
+        :param template: <str>. The template database name
+        :param size: <int>. Number of databases kept ready
+        :param refill_interval: <float>. Seconds between pool checks, and between
+            retries when the template is being accessed by other sessions
+        """
+        if not db.autocommit:
+            raise ValueError('The database object must be in autocommit mode')
+        self._db = db
+        self.template = template
+        self.size = size
+        self.prefix = '{}_pool_'.format(template)
+        self._refill_interval = refill_interval
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stop = threading.Event()
+        self._filler = None
+        self._stats = {'acquired': 0, 'misses': 0, 'acquire_seconds': 0.0,
+                       'cloned': 0, 'clone_seconds': 0.0, 'clone_errors': 0}
+
+    def _execute(self, statement):
+        return self._db.engine.execute(statement)
+
+    def ready_databases(self):
+        """
+        :return: <list>.<str>. The pooled databases, ready to be handed out
+        """
+        return [row[0] for row in self._execute(
+            "SELECT datname FROM pg_database WHERE left(datname, {}) = '{}'"
+            .format(len(self.prefix), self.prefix.replace("'", "''"))
+        )]
+
+    def _clone(self, name):
+        start = time.time()
+        self._execute('CREATE DATABASE {} TEMPLATE {}'
+                      .format(_quote(name), _quote(self.template)))
+        with self._lock:
+            self._stats['cloned'] += 1
+            self._stats['clone_seconds'] += time.time() - start
+
+    def fill(self):
+        """
+        Clone databases until the pool is full
+        :return: <int>. Number of databases cloned
+        """
+        missing = self.size - len(self.ready_databases())
+        for _ in range(max(missing, 0)):
+            self._clone(self.prefix + uuid.uuid4().hex[:12])
+        return max(missing, 0)
+
+    def _fill_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.fill()
+            except DBAPIError:
+                # Most likely the template is being accessed by other sessions.
+                # We never terminate them, we just retry later
+                with self._lock:
+                    self._stats['clone_errors'] += 1
+            self._wake_up.wait(self._refill_interval)
+            self._wake_up.clear()
+
+    def start(self):
+        """
+        Start refilling the pool in a background thread
+        :return:
+        """
+        if self._filler is None or not self._filler.is_alive():
+            self._stop.clear()
+            self._filler = threading.Thread(target=self._fill_forever, daemon=True)
+            self._filler.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake_up.set()
+        if self._filler is not None:
+            self._filler.join()
+
+    def acquire(self, name=None, timeout=None):
+        """
+        Take a database from the pool and rename it
+        :param name: <str>. The name of the new database. If None a random one
+            is assigned
+        :param timeout: <float>. Seconds to wait for a database to be ready. If
+            None, the database is cloned right away when the pool is empty
+        :return: <str>. The new database name
+        """
+        start = time.time()
+        name = name or '{}_{}'.format(self.template, uuid.uuid4().hex[:12])
+        while True:
+            for pooled in self.ready_databases():
+                try:
+                    self._execute('ALTER DATABASE {} RENAME TO {}'
+                                  .format(_quote(pooled), _quote(name)))
+                except DBAPIError:
+                    # Another process took it first
+                    continue
+                self._wake_up.set()
+                self._record_acquire(start, miss=False)
+                return name
+            self._wake_up.set()
+            if timeout is None:
+                self._clone(name)
+                self._record_acquire(start, miss=True)
+                return name
+            if time.time() - start > timeout:
+                raise PoolTimeout(self.template)
+            time.sleep(min(self._refill_interval, timeout))
+
+    def _record_acquire(self, start, miss):
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['misses'] += int(miss)
+            self._stats['acquire_seconds'] += time.time() - start
+
+    def release(self, name, recycle=False):
+        """
+        Give back a database taken from the pool
+        :param name: <str>. The database name
+        :param recycle: <bool>. Set True if the database was not modified (e.g. all
+            the changes were rolled back) and it can go back to the pool. Otherwise
+            it is dropped
+        :return:
+        """
+        # The sessions are the ones of the user of the database, who is done with it
+        self._execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+                      'WHERE datname = \'{}\' AND pid <> pg_backend_pid()'
+                      .format(name.replace("'", "''")))
+        if recycle:
+            self._execute('ALTER DATABASE {} RENAME TO {}'.format(
+                _quote(name), _quote(self.prefix + uuid.uuid4().hex[:12])))
+        else:
+            self._execute('DROP DATABASE IF EXISTS {}'.format(_quote(name)))
+        self._wake_up.set()
+
+    def drain(self):
+        """
+        Drop all the pooled databases
+        :return:
+        """
+        for pooled in self.ready_databases():
+            self._execute('DROP DATABASE IF EXISTS {}'.format(_quote(pooled)))
+
+    def metrics(self):
+        """
+        :return: <dict>. The pool fill level and the provisioning latencies
+            (in seconds)
+        """
+        ready = len(self.ready_databases())
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            'size': self.size,
+            'ready': ready,
+            'fill_level': ready / self.size if self.size else 1.0,
+            'acquired': stats['acquired'],
+            'misses': stats['misses'],
+            'avg_acquire_seconds': (stats['acquire_seconds'] / stats['acquired']
+                                    if stats['acquired'] else None),
+            'cloned': stats['cloned'],
+            'clone_errors': stats['clone_errors'],
+            'avg_clone_seconds': (stats['clone_seconds'] / stats['cloned']
+                                  if stats['cloned'] else None),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('db_template', metavar="Database Name", type=str,
+                        help="The name of the template database")
+    parser.add_argument('--size', type=int, default=5,
+                        help='Number of databases kept ready. Default=5')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='Seconds between pool checks. Default=1')
+    parser.add_argument('--drain', action='store_true',
+                        help='Drop all the pooled databases and exit')
+    args = parser.parse_args()
+
+    pool = TemplatePool(Database(autocommit=True), args.db_template,
+                        size=args.size, refill_interval=args.interval)
+    if args.drain:
+        pool.drain()
+    else:
+        pool.start()
+        try:
+            while True:
+                time.sleep(60)
+                print(pool.metrics())
+        except KeyboardInterrupt:
+            pool.stop()
@@ -0,0 +1,259 @@
+"""
+This module contains the classes needed to spread the data over several database
+servers (shards). Each shard is a regular Database object (so there is still just
+one by DatabaseConfig), and a shard map decides which one holds each shard key.
+"""
+import heapq
+import uuid
+import zlib
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from dbal.database import Database
+
+
+class HashShardMap(object):
+    """
+    Map the shard keys to the configs with a stable hash (the same in every process)
+    """
+
+    def __init__(self, db_configs):
+        """
+        :param db_configs: <list>.<DatabaseConfig>. Careful! Changing the number (or
+            the order) of the configs changes the shard of most of the keys
+        """
+        self.db_configs = list(db_configs)
+
+    def config_for(self, key):
+        return self.db_configs[zlib.crc32(str(key).encode('utf-8')) %
+                               len(self.db_configs)]
+
+
+class RangeShardMap(object):
+    """
+    Map the shard keys to the configs by ranges
+    """
+
+    def __init__(self, ranges):
+        """
+        :param ranges: <list>.<tuple>. (upper bound, DatabaseConfig). Each config
+            holds the keys lower or equal than its upper bound (and greater than the
+            previous one). Use None as the upper bound of the last range to make it
+            unbounded
+        """
+        ranges = sorted(ranges, key=lambda r: (r[0] is None, r[0]))
+        self._bounds = [bound for bound, _ in ranges if bound is not None]
+        self.db_configs = [config for _, config in ranges]
+
+    def config_for(self, key):
+        position = bisect_left(self._bounds, key)
+        if position >= len(self.db_configs):
+            raise KeyError('The key {} is out of all the shard ranges'.format(key))
+        return self.db_configs[position]
+
+
+class TwoPhaseCommitError(Exception):
+    pass
+
+
+class ShardedDatabase(object):
+    """
+    Route the reads and writes to the shard holding each key, split the bulk inputs
+    by shard, and run the cross-shard queries concurrently.
+    """
+
+    def __init__(self, shard_map, max_workers=None, **database_kwargs):
+        """
+        :param shard_map: <HashShardMap> or <RangeShardMap>
+        :param max_workers: <int>. Threads used to query the shards concurrently.
+            If None, one by shard
+        :param database_kwargs: The arguments of every shard Database object
+        """
+        self.shard_map = shard_map
+        self.databases = [Database(db_config=config, **database_kwargs)
+                          for config in shard_map.db_configs]
+        self._by_config = dict(zip(shard_map.db_configs, self.databases))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or len(self.databases)
+        )
+
+    def close(self):
+        """
+        Shut the threads used to query the shards down
+        :return:
+        """
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def shard(self, key):
+        """
+        :param key: The shard key
+        :return: <Database>
+        """
+        return self._by_config[self.shard_map.config_for(key)]
+
+    def read(self, key, table, *args, **kwargs):
+        return self.shard(key).read(table, *args, **kwargs)
+
+    def read_one(self, key, table, *args):
+        return self.shard(key).read_one(table, *args)
+
+    def write(self, key, obj, commit=True):
+        return self.shard(key).write(obj, commit=commit)
+
+    def _group_by_shard(self, items, key):
+        groups = dict()
+        for item in items:
+            groups.setdefault(self.shard_map.config_for(key(item)), []).append(item)
+        return {self._by_config[config]: group for config, group in groups.items()}
+
+    def insert_many(self, table, columns, values, key_column=0, **kwargs):
+        """
+        Split the values by shard and insert them in every shard concurrently.
+        See Database.insert_many
+        :param key_column: <int>. The position of the shard key in the columns
+        :return: <list>. The returned rows of every shard, if to_return is set
+        """
+        groups = self._group_by_shard(values, lambda row: row[key_column])
+        results = self.fan_out(
+            lambda db: db.insert_many(table, columns, groups[db], **kwargs),
+            databases=list(groups)
+        )
+        returned = [row for rows in results.values() if rows for row in rows]
+        return returned if kwargs.get('to_return') else None
+
+    def fan_out(self, function, databases=None):
+        """
+        Run a function over every shard concurrently
+        :param function: <callable>. It takes a Database object
+        :param databases: <list>.<Database>. If None, all the shards
+        :return: <dict>. The result by Database
+        """
+        databases = self.databases if databases is None else databases
+        futures = {db: self._executor.submit(function, db) for db in databases}
+        return {db: future.result() for db, future in futures.items()}
+
+    def execute_all(self, query):
+        """
+        Execute a custom query in every shard concurrently
+        :param query: <str>
+        :return: <list>. All the rows, shard after shard
+        """
+        results = self.fan_out(lambda db: db.execute(query).fetchall())
+        return [row for rows in results.values() for row in rows]
+
+    def merge_sorted(self, query, key=None, reverse=False, params=None):
+        """
+        Run a sorted query in every shard concurrently and merge the results as a
+        stream (k-way merge). The rows are fetched with server side cursors, so the
+        whole results are never held in memory.
+        :param query: <str>. It must be sorted consistently with key. E.g:
+            'SELECT * FROM events ORDER BY created_at'
+        :param key: <callable>. It takes a row and returns the sort value. If None
+            the rows are compared as a whole
+        :param reverse: <bool>. Set True if the query is sorted descending
+        :param params: <dict>. The query bind parameters
+        :return: <iterator>
+        """
+        def open_stream(db):
+            conn = db.engine.connect().execution_options(stream_results=True)
+            return conn, conn.execute(text(query), **(params or {}))
+
+        streams = list(self.fan_out(open_stream).values())
+        try:
+            for row in heapq.merge(*(result for _, result in streams), key=key,
+                                   reverse=reverse):
+                yield row
+        finally:
+            for conn, result in streams:
+                result.close()
+                conn.close()
+
+    def commit(self):
+        """
+        Commit the open transaction of every shard (e.g. the ones left by
+        insert_many). Attention, the shards are committed one after the other, so
+        it is not atomic. Use write_many with two_phase for that
+        :return:
+        """
+        self.fan_out(lambda db: db.commit())
+
+    def rollback(self):
+        """
+        Roll back the open transaction of every shard
+        :return:
+        """
+        self.fan_out(lambda db: db.rollback())
+
+    def write_many(self, objects, key, two_phase=False):
+        """
+        Write declarative objects of several shards, committing all of them or none.
+        :param objects: <list>. Declarative objects
+        :param key: <callable>. It takes an object and returns its shard key
+        :param two_phase: <bool>. Use a two-phase commit (PREPARE TRANSACTION), so
+            the write is atomic across the shards. The servers must allow prepared
+            transactions (max_prepared_transactions > 0). The objects are detached
+            (with their flushed state) after the commit. If False, every shard is
+            committed one after the other
+        :return:
+        """
+        groups = self._group_by_shard(objects, key)
+        if not two_phase:
+            for db, group in groups.items():
+                db.session.add_all(group)
+            for db in groups:
+                db.update(commit=True)
+            return
+        gid = 'dbal_{}'.format(uuid.uuid4().hex)
+        branches = []
+        try:
+            for index, (db, group) in enumerate(groups.items()):
+                conn = db.engine.connect()
+                # The transaction ids must be unique by server, and several shards
+                # may be databases of the same one
+                branch_gid = '{}_{}'.format(gid, index)
+                transaction = conn.begin_twophase(xid=branch_gid)
+                session = Session(bind=conn, expire_on_commit=False)
+                branches.append((conn, transaction, session, branch_gid))
+                session.add_all(group)
+                session.flush()
+            for _, transaction, _, _ in branches:
+                transaction.prepare()
+        except Exception as e:
+            # The prepared branches are rolled back with ROLLBACK PREPARED
+            for conn, transaction, session, _ in branches:
+                self._end_branch(conn, transaction, session, commit=False)
+            raise e
+        failed = [branch_gid for conn, transaction, session, branch_gid in branches
+                  if self._end_branch(conn, transaction, session, commit=True)]
+        if failed:
+            raise TwoPhaseCommitError(
+                'The transactions {} were prepared but could not be committed. '
+                'Commit them with COMMIT PREPARED'.format(', '.join(failed))
+            )
+
+    @staticmethod
+    def _end_branch(conn, transaction, session, commit):
+        """
+        :return: <Exception>. The error, if the branch could not be ended
+        """
+        try:
+            if commit:
+                transaction.commit()
+            else:
+                transaction.rollback()
+        except Exception as e:
+            return e
+        finally:
+            session.close()
+            conn.close()
+        return None
@@ -0,0 +1,387 @@
+"""
+This module contains the COPY based file transfers used by the Database class
+(Database.export and Database.load_file).
+The data is streamed between the files and the server, without building python
+row objects.
+"""
+import bz2
+import gzip
+import lzma
+import mmap
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2 import DataError, IntegrityError
+
+COMPRESSIONS = {
+    None: open,
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
+
+class CopyFormatError(ValueError):
+    pass
+
+
+class TooManyRejectedRows(Exception):
+    def __init__(self, max_rejects):
+        super().__init__('More than {} rows were rejected'.format(max_rejects))
+
+
+class PreparedLoadError(Exception):
+    def __init__(self, gids):
+        super().__init__('The load was prepared but could not be committed. Commit '
+                         'the prepared transactions {} with COMMIT PREPARED'
+                         .format(', '.join(gids)))
+
+
+def _copy_options(file_format, header=True):
+    if file_format == 'csv':
+        return 'FORMAT csv, HEADER' if header else 'FORMAT csv'
+    if file_format == 'binary':
+        return 'FORMAT binary'
+    if file_format == 'jsonl':
+        # row_to_json never outputs these characters unescaped, so the csv format
+        # writes every json document as it is (no quotes, no escapes)
+        return "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'"
+    raise CopyFormatError('The format {} is not supported'.format(file_format))
+
+
+class _SplitWriter(object):
+    """
+    File-like object receiving the COPY output. psycopg2 writes the COPY data one row
+    at a time, so the files can be split at row boundaries.
+    """
+
+    def __init__(self, path, compression=None, split_size=None, header=False,
+                 chunk_size=2 ** 20):
+        if compression not in COMPRESSIONS:
+            raise CopyFormatError('The compression {} is not supported'
+                                  .format(compression))
+        self._path = path
+        self._opener = COMPRESSIONS[compression]
+        self._split_size = split_size
+        self._header = header
+        self._header_row = None
+        self._chunk_size = chunk_size
+        self._file = None
+        self._file_bytes = 0
+        self.rows = 0
+        self.bytes = 0
+        self.paths = []
+
+    def _part_path(self):
+        if not self._split_size:
+            return self._path
+        directory, name = os.path.split(self._path)
+        root, dot, ext = name.partition('.')
+        return os.path.join(directory, '{}_{:04d}{}{}'.format(
+            root, len(self.paths), dot, ext))
+
+    def _open(self):
+        path = self._part_path()
+        raw = open(path, 'wb', buffering=self._chunk_size)
+        self._file = raw if self._opener is open else self._opener(raw, 'wb')
+        self._raw = raw
+        self._file_bytes = 0
+        self.paths.append(path)
+        if self._header_row is not None:
+            self._file.write(self._header_row)
+            self._file_bytes += len(self._header_row)
+
+    def write(self, data):
+        if self._header and self._header_row is None:
+            self._header_row = bytes(data)
+            self._open()
+            self.bytes += len(data)
+            return
+        if self._file is None:
+            self._open()
+        elif self._split_size and self._file_bytes >= self._split_size:
+            self.close()
+            self._open()
+        self._file.write(data)
+        self._file_bytes += len(data)
+        self.bytes += len(data)
+        self.rows += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            if self._raw is not self._file:
+                self._raw.close()
+            self._file = None
+
+
+def export(engine, query, path, file_format='csv', compression=None,
+           split_size=None, header=True, chunk_size=2 ** 20):
+    """
+    Stream the result of a query into files, with COPY (query) TO STDOUT
+    :param engine: <sqlalchemy.engine.Engine>
+    :param query: <str>. A SELECT query
+    :param path: <str>. The file path. If split_size is set, a part number is added
+        to the file name. E.g: report.csv -> report_0000.csv, report_0001.csv...
+    :param file_format: <str>. 'csv', 'binary' or 'jsonl' (one json object by row)
+    :param compression: <str>. None, 'gzip', 'bz2' or 'xz'
+    :param split_size: <int>. Start a new file when the current one is bigger (in
+        uncompressed bytes). The csv header is repeated in every file. Not
+        supported in the binary format
+    :param header: <bool>. Write the csv header
+    :param chunk_size: <int>. The size of the writes to the disk
+    :return: <dict>. The files, rows, bytes, seconds and throughput
+    """
+    if split_size and file_format == 'binary':
+        raise CopyFormatError('The binary format cannot be split')
+    source = '({})'.format(query)
+    if file_format == 'jsonl':
+        source = '(SELECT row_to_json(_export_row) FROM {} _export_row)'.format(
+            source)
+    writer = _SplitWriter(path, compression=compression, split_size=split_size,
+                          header=file_format == 'csv' and header,
+                          chunk_size=chunk_size)
+    start = time.time()
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.copy_expert('COPY {} TO STDOUT WITH ({})'.format(
+            source, _copy_options(file_format, header)), writer)
+        conn.rollback()
+    finally:
+        writer.close()
+        conn.close()
+    seconds = time.time() - start
+    rows = cursor.rowcount if cursor.rowcount >= 0 else writer.rows
+    return {
+        'files': writer.paths,
+        'rows': rows,
+        'bytes': writer.bytes,
+        'seconds': seconds,
+        'rows_per_second': rows / seconds if seconds else None,
+        'bytes_per_second': writer.bytes / seconds if seconds else None,
+    }
+
+
+class _MmapReader(object):
+    """
+    File-like view of a region of a memory-mapped file. The file is never read as a
+    whole: every read copies at most one buffer out of the mapping (psycopg2 needs
+    bytes objects)
+    """
+
+    def __init__(self, mapped, start, end):
+        self._mapped = mapped
+        self._position = start
+        self._end = end
+
+    def read(self, size=-1):
+        end = self._end if size < 0 else min(self._position + size, self._end)
+        data = self._mapped[self._position:end]
+        self._position = end
+        return data
+
+    def readline(self, size=-1):
+        end = self._mapped.find(b'\n', self._position, self._end)
+        end = self._end if end < 0 else end + 1
+        if size >= 0:
+            end = min(end, self._position + size)
+        data = self._mapped[self._position:end]
+        self._position = end
+        return data
+
+
+def _next_line(mapped, position, end):
+    newline = mapped.find(b'\n', position, end)
+    return end if newline < 0 else newline + 1
+
+
+def _chunks(mapped, start, end, number):
+    """
+    Split the region in (about) the same size chunks, at line boundaries
+    :return: <list>.<tuple>. (start, end) of every chunk
+    """
+    bounds = [start]
+    step = max((end - start) // number, 1)
+    for _ in range(number - 1):
+        bound = _next_line(mapped, max(bounds[-1] + step, bounds[-1]), end)
+        if bound >= end:
+            break
+        bounds.append(bound)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class _Loader(object):
+
+    def __init__(self, mapped, copy_sql, max_rejects, progress, total):
+        self._mapped = mapped
+        self._copy_sql = copy_sql
+        self._max_rejects = max_rejects
+        self._progress = progress
+        self._total = total
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.loaded_bytes = 0
+        self.rejects = []
+
+    def _done(self, rows, size):
+        with self._lock:
+            self.rows += max(rows, 0)
+            self.loaded_bytes += size
+            if self._progress is not None:
+                self._progress(self.loaded_bytes, self._total)
+
+    def _reject(self, start, end):
+        with self._lock:
+            self.rejects.append(self._mapped[start:end])
+            if self._max_rejects is not None and len(self.rejects) > self._max_rejects:
+                raise TooManyRejectedRows(self._max_rejects)
+
+    def load(self, cursor, start, end):
+        """
+        Copy a region. If it has bad rows, it is bisected (with savepoints) until
+        the bad rows are isolated and rejected
+        """
+        if start >= end:
+            return
+        cursor.execute('SAVEPOINT dbal_load')
+        try:
+            cursor.copy_expert(self._copy_sql, _MmapReader(self._mapped, start, end))
+            # Taken before the RELEASE, which resets it
+            rows = cursor.rowcount
+        except (DataError, IntegrityError):
+            cursor.execute('ROLLBACK TO SAVEPOINT dbal_load')
+            if self._max_rejects == 0:
+                raise
+            middle = _next_line(self._mapped, start + (end - start) // 2, end)
+            if middle >= end:
+                middle = _next_line(self._mapped, start, end)
+            if middle >= end:
+                # Just one line left
+                self._reject(start, end)
+                self._done(0, end - start)
+                return
+            self.load(cursor, start, middle)
+            self.load(cursor, middle, end)
+            return
+        cursor.execute('RELEASE SAVEPOINT dbal_load')
+        self._done(rows, end - start)
+
+
+def _commit_prepared(branches):
+    """
+    Commit the prepared branches. Once all of them are prepared they must be
+    committed, so the ones that fail are reported, to be committed by hand
+    :param branches: <list>.<tuple>. (connection, transaction id)
+    """
+    failed = []
+    for conn, gid in branches:
+        try:
+            conn.tpc_commit()
+        except Exception:
+            failed.append(gid)
+    if failed:
+        raise PreparedLoadError(failed)
+
+
+def load_file(engine, table, path, columns=None, file_format='csv', header=True,
+              workers=4, commit='all', max_rejects=0, reject_path=None,
+              progress=None):
+    """
+    Load a csv/text file into a table. The file is memory-mapped, split at line
+    boundaries in one chunk by worker, and every chunk is streamed over its own
+    connection with COPY FROM STDIN.
+    Attention, the chunks are split at the newlines, so the csv quoted values must
+    not contain newlines.
+    :param engine: <sqlalchemy.engine.Engine>
+    :param table: <str>. The table name
+    :param path: <str>. The file path (uncompressed)
+    :param columns: <tuple>.<str>. The file columns. If None, all the table ones
+    :param file_format: <str>. 'csv' or 'text' (the postgres tab separated format)
+    :param header: <bool>. The first line of a csv file is a header
+    :param workers: <int>. Number of connections (and chunks)
+    :param commit: <str>. 'all': the chunks are committed with a two-phase commit,
+        so all of them or none are committed. The server must allow the prepared
+        transactions (max_prepared_transactions >= workers). 'chunk': every chunk
+        is committed as soon as it is loaded
+    :param max_rejects: <int>. Max number of bad rows (rows failing with a data or
+        integrity error) skipped and written into the reject file. None for no limit
+    :param reject_path: <str>. Where the bad rows are written. By default
+        <path>.rejects
+    :param progress: <callable>. Called with the loaded bytes and the total bytes
+        every time a chunk (or a piece of it) is loaded
+    :return: <dict>. The rows, rejected rows, bytes, seconds and throughput
+    """
+    if file_format not in ('csv', 'text'):
+        raise CopyFormatError('The format {} is not supported'.format(file_format))
+    if commit not in ('all', 'chunk'):
+        raise ValueError('The commit policy {} is not supported'.format(commit))
+    copy_sql = 'COPY {}{} FROM STDIN WITH (FORMAT {})'.format(
+        table, ' ({})'.format(', '.join(columns)) if columns else '', file_format)
+    start_time = time.time()
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return {'rows': 0, 'rejected': 0, 'bytes': 0, 'seconds': 0.0,
+                    'rows_per_second': None, 'bytes_per_second': None}
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start = _next_line(mapped, 0, size) if header and file_format == 'csv' else 0
+        loader = _Loader(mapped, copy_sql, max_rejects, progress, size - start)
+        connections = []
+        lock = threading.Lock()
+        load_id = uuid.uuid4().hex
+
+        def load_chunk(bounds):
+            conn = engine.raw_connection()
+            with lock:
+                gid = 'dbal_load_{}_{}'.format(load_id, len(connections))
+                connections.append((conn, gid))
+            if commit == 'all':
+                # Every chunk is a branch of the distributed transaction
+                conn.tpc_begin(gid)
+            loader.load(conn.cursor(), *bounds)
+            if commit == 'chunk':
+                conn.commit()
+
+        try:
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(executor.map(load_chunk,
+                                      _chunks(mapped, start, size, workers)))
+                if commit == 'all':
+                    for conn, _ in connections:
+                        conn.tpc_prepare()
+            except Exception:
+                for conn, _ in connections:
+                    if commit == 'all':
+                        # It rolls back the prepared branches as well
+                        conn.tpc_rollback()
+                    else:
+                        conn.rollback()
+                raise
+            if commit == 'all':
+                _commit_prepared(connections)
+        finally:
+            for conn, _ in connections:
+                conn.close()
+    finally:
+        mapped.close()
+
+    if loader.rejects:
+        with open(reject_path or path + '.rejects', 'wb') as rejects_file:
+            for line in loader.rejects:
+                rejects_file.write(line if line.endswith(b'\n') else line + b'\n')
+    seconds = time.time() - start_time
+    return {
+        'rows': loader.rows,
+        'rejected': len(loader.rejects),
+        'bytes': size,
+        'seconds': seconds,
+        'rows_per_second': loader.rows / seconds if seconds else None,
+        'bytes_per_second': size / seconds if seconds else None,
+    }
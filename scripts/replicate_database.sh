@@ -30,9 +30,17 @@ DEFAULT_PASSWORD="123456"
 SOURCE_PORT=5432
 DESTINATION_PORT=5432
 
+# By default the database is dumped in the directory format, using one job by
+# core, and restored in parallel as well. Use --plain for the single-threaded
+# plain-SQL dump
+DUMP_FORMAT="directory"
+JOBS=$(nproc)
+COMPRESSION_LEVEL=5
+
 usage() {
     echo "usage: replicate_database [[[-sh source_host ] [-sp source_port] " \
-     "[-dh destination_host] [-dp destination_port] [-db source_db] ] | [-h help]]"
+     "[-dh destination_host] [-dp destination_port] [-db source_db] " \
+     "[-j jobs] [-Z compression_level] [--plain] ] | [-h help]]"
     }
 
 while [ "$1" != "" ]; do
@@ -58,6 +66,14 @@ while [ "$1" != "" ]; do
         -db | --source_db )        shift
                                    SOURCE_DB=$1
                                    ;;
+        -j | --jobs )              shift
+                                   JOBS=$1
+                                   ;;
+        -Z | --compress )          shift
+                                   COMPRESSION_LEVEL=$1
+                                   ;;
+        --plain )                  DUMP_FORMAT="plain"
+                                   ;;
         -h | --help )              usage
                                    exit
                                    ;;
@@ -176,31 +192,85 @@ request_connection_credentials() {
     test_connection_credentials "$destination_command" "$destination_password" "$destination_user"
     }
 
-dump_source_db() {
-    # We are gonna dump the database into a local temporal file
+set_dump_names() {
     current_date_time=$(date -u --rfc-3339=seconds)
     current_date_time="${current_date_time//[" "":""-"]/"_"}"
     current_date_time="${current_date_time:0:-9}"
 
+    DB_COPY="copy_"$SOURCE_DB"_"$current_date_time""
+    if [ "$DUMP_FORMAT" == "directory" ]; then
+        DUMP_FILE=""$TEMP_FOLDER"/backup_"$SOURCE_DB"_"$current_date_time""
+    else
+        DUMP_FILE=""$TEMP_FOLDER"/backup_"$SOURCE_DB"_"$current_date_time".sql"
+    fi
+    }
+
+check_free_disk_space() {
+    # The dump must fit in the temporal folder. The database size is an upper
+    # bound of the dump size (indexes are not dumped, and the data may be compressed)
+    set_connection_password $source_password
+    database_size=$($source_command -At -c "SELECT pg_database_size(current_database());")
+    free_space=$(df --output=avail -B1 "$TEMP_FOLDER" | tail -n 1)
+    echo "The database size is $database_size bytes." \
+     "There are $free_space bytes available in $TEMP_FOLDER"
+    if [ "$database_size" -gt "$free_space" ]; then
+        echo "There is not enough free space in $TEMP_FOLDER. Aborting..."
+        exit 3
+    fi
+    }
+
+dump_source_db() {
+    # We are gonna dump the database into a local temporal file (or directory)
     set_connection_password $source_password
-    DUMP_FILE=""$TEMP_FOLDER"/backup_"$SOURCE_DB"_"$current_date_time".sql"
 
-    echo "dumping the database into the "$DUMP_FILE" file"
-    pg_dump -d $SOURCE_DB -h $SOURCE_HOST -p $SOURCE_PORT -U $source_user -f "$DUMP_FILE" -O -x
+    echo "dumping the database into the "$DUMP_FILE" "$DUMP_FORMAT""
+    dump_start=$(date +%s)
+    if [ "$DUMP_FORMAT" == "directory" ]; then
+        pg_dump -d $SOURCE_DB -h $SOURCE_HOST -p $SOURCE_PORT -U $source_user \
+         -Fd -j $JOBS -Z $COMPRESSION_LEVEL -f "$DUMP_FILE" -O -x || exit 1
+    else
+        pg_dump -d $SOURCE_DB -h $SOURCE_HOST -p $SOURCE_PORT -U $source_user \
+         -f "$DUMP_FILE" -O -x || exit 1
+    fi
+    DUMP_SECONDS=$(( $(date +%s) - dump_start ))
+    DUMP_BYTES=$(du -sb "$DUMP_FILE" | cut -f 1)
     }
 
 create_copy_db() {
     set_connection_password $destination_password
-    # First we create the new database
-    DB_COPY="copy_"$SOURCE_DB"_"$current_date_time""
-
-    $destination_command -c "CREATE DATABASE \""$DB_COPY"\";" &&
-
-    # Then, create the schema from the dump file
+    $destination_command -c "CREATE DATABASE \""$DB_COPY"\";"
+    }
 
+restore_copy_db() {
+    # Create the schema and the data from the dump file
+    set_connection_password $destination_password
     echo "replicating the database with the name "$DB_COPY""
 
-    psql -d $DB_COPY -h $DESTINATION_HOST -p $DESTINATION_PORT -U $destination_user -f "$DUMP_FILE"
+    restore_start=$(date +%s)
+    if [ "$DUMP_FORMAT" == "directory" ]; then
+        pg_restore -d $DB_COPY -h $DESTINATION_HOST -p $DESTINATION_PORT \
+         -U $destination_user -j $JOBS -O -x "$DUMP_FILE"
+    else
+        psql -d $DB_COPY -h $DESTINATION_HOST -p $DESTINATION_PORT \
+         -U $destination_user -v ON_ERROR_STOP=1 -f "$DUMP_FILE"
+    fi
+    restore_status=$?
+    RESTORE_SECONDS=$(( $(date +%s) - restore_start ))
+    if [ "$restore_status" != 0 ]; then
+        # Keep the dump, so the restore can be retried (or inspected)
+        echo "The restore failed (exit status $restore_status)." \
+         "The dump is kept in "$DUMP_FILE""
+        exit 4
+    fi
+    if [ "$DUMP_FORMAT" == "directory" ]; then
+        # The dump is no longer needed
+        rm -rf "$DUMP_FILE"
+    fi
+    }
+
+report() {
+    echo "Dump: $DUMP_SECONDS seconds. Restore: $RESTORE_SECONDS seconds." \
+     "$DUMP_BYTES bytes transferred ("$DUMP_FORMAT" format, $JOBS jobs)"
     }
 
 
@@ -263,8 +333,18 @@ main() {
     # Before starting the dump and the copy, all the server credentials
     # will be prompted, and the connection with each one will be tested
     request_connection_credentials
+    set_dump_names
+    check_free_disk_space
+    # A directory dump cannot be streamed into pg_restore (its table of contents is
+    # written at the end), so just the creation of the new database runs along with
+    # the dump. For a fully streamed copy use the dbal.scripts.replicate_database
+    # python script
+    create_copy_db &
+    create_copy_pid=$!
     dump_source_db
-    create_copy_db
+    wait $create_copy_pid || exit 1
+    restore_copy_db
+    report
 
 #   Uncomment below if you want to create the default roles for the destination db
 #    create_roles_if_they_do_not_exist
@@ -0,0 +1,54 @@
+"""
+The test cases that need a postgres server. It is configured as the Database class
+is (the environment variables or the config file), and the tests are skipped when
+there is none.
+"""
+import unittest
+import uuid
+
+
+class DatabaseTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            # Imported here, so the modules mixing unit and database tests can be
+            # run without the database drivers
+            from dbal.database import Database
+            cls.db = Database()
+            cls.db.engine.connect().close()
+        except Exception as e:
+            raise unittest.SkipTest('There is no test database: {}'.format(e))
+
+    def setUp(self):
+        self.tables = []
+
+    def tearDown(self):
+        self.db.rollback()
+        for table in self.tables:
+            self.run_sql('DROP TABLE IF EXISTS {} CASCADE'.format(table))
+
+    def run_sql(self, sql, params=None):
+        """
+        Run a statement in its own committed transaction
+        :return: <list>.<tuple>. The rows, if any
+        """
+        conn = self.db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall() if cursor.description else None
+            conn.commit()
+        finally:
+            conn.close()
+        return rows
+
+    def create_table(self, columns):
+        """
+        :param columns: <str>. The columns definition
+        :return: <str>. A new table, dropped after the test
+        """
+        table = 'dbal_test_{}'.format(uuid.uuid4().hex[:12])
+        self.run_sql('CREATE TABLE {} ({})'.format(table, columns))
+        self.tables.append(table)
+        return table
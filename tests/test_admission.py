@@ -0,0 +1,156 @@
+import threading
+import time
+import unittest
+
+from sqlalchemy.exc import DBAPIError
+
+from dbal.admission import AdmissionController, AdmissionTimeout, Lane
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.database import Database
+
+from tests.database_case import DatabaseTestCase
+
+
+def _in_thread(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def test_acquire_and_release(self):
+        controller = AdmissionController([Lane('web', 2)])
+        self.assertTrue(controller.acquire('web'))
+        metrics = controller.metrics()['web']
+        self.assertEqual(metrics['running'], 1)
+        self.assertEqual(metrics['admitted'], 1)
+        controller.release('web')
+        self.assertEqual(controller.metrics()['web']['running'], 0)
+
+    def test_nested_acquire(self):
+        controller = AdmissionController([Lane('web', 1)])
+        self.assertTrue(controller.acquire('web'))
+        self.assertFalse(controller.acquire('web'))
+        controller.release('web')
+
+    def test_queue_timeout(self):
+        controller = AdmissionController([Lane('batch', 1, queue_timeout=0.05)])
+        controller.acquire('batch')
+        errors = []
+
+        def wait():
+            try:
+                controller.acquire('batch')
+            except AdmissionTimeout as e:
+                errors.append(e)
+
+        _in_thread(wait).join(5)
+        controller.release('batch')
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(controller.metrics()['batch']['timeouts'], 1)
+        self.assertEqual(controller.metrics()['batch']['queue_depth'], 0)
+
+    def test_lane_limit(self):
+        controller = AdmissionController([Lane('batch', 1), Lane('web', 1)],
+                                         capacity=2)
+        controller.acquire('batch')
+        admitted = threading.Event()
+
+        def run_web():
+            controller.acquire('web')
+            admitted.set()
+            controller.release('web')
+
+        # The batch lane is full, but the web one still has room
+        _in_thread(run_web).join(5)
+        self.assertTrue(admitted.is_set())
+        controller.release('batch')
+
+    def test_priority(self):
+        controller = AdmissionController([Lane('batch', 2, priority=0),
+                                          Lane('web', 2, priority=10)],
+                                         capacity=1)
+        controller.acquire('batch')
+        order = []
+
+        def run(name):
+            controller.acquire(name)
+            order.append(name)
+            controller.release(name)
+
+        # The batch query waits first, but the web one has a higher priority
+        threads = [_in_thread(lambda: run('batch'))]
+        self._wait_queued(controller, 'batch')
+        threads.append(_in_thread(lambda: run('web')))
+        self._wait_queued(controller, 'web')
+        controller.release('batch')
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ['web', 'batch'])
+
+    def _wait_queued(self, controller, name):
+        deadline = time.time() + 5
+        while controller.metrics()[name]['queue_depth'] == 0:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+
+class TestLanes(DatabaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        lanes = [Lane('batch', 1, statement_timeout=100), Lane('web', 2)]
+        # Other config objects, so the Singleton registry builds new Database ones
+        cls.lanes_db = Database(db_config=DatabaseConfig(dict(cls.db.db_config.config)),
+                                multithreading=True, lanes=lanes)
+        cls.autocommit_db = Database(
+            db_config=DatabaseConfig(dict(cls.db.db_config.config)),
+            multithreading=True, autocommit=True, lanes=lanes
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        for db in (cls.lanes_db, cls.autocommit_db):
+            db.close_session()
+            db.engine.dispose()
+
+    def timeout(self, db):
+        return db.execute('SHOW statement_timeout').scalar()
+
+    def test_lanes_need_multithreading(self):
+        with self.assertRaises(ValueError):
+            Database(db_config=DatabaseConfig(dict(self.db.db_config.config)),
+                     lanes=[Lane('web', 1)])
+
+    def test_statement_timeout(self):
+        db = self.lanes_db
+        before = self.timeout(db)
+        with db.lane('batch'):
+            self.assertEqual(self.timeout(db), '100ms')
+            with self.assertRaises(DBAPIError):
+                db.execute('SELECT pg_sleep(1)')
+        db.rollback()
+        self.assertEqual(self.timeout(db), before)
+        with db.lane('batch'):
+            self.assertEqual(self.timeout(db), '100ms')
+        # Restored in the same transaction
+        self.assertEqual(self.timeout(db), before)
+        db.rollback()
+        self.assertEqual(db.lane_metrics()['batch']['admitted'], 2)
+
+    def test_autocommit_statement_timeout(self):
+        db = self.autocommit_db
+        before = self.timeout(db)
+        with db.lane('batch'):
+            self.assertEqual(self.timeout(db), '100ms')
+            self.assertEqual(self.timeout(db), '100ms')
+        for _ in range(3):
+            # Every pooled connection was reset
+            self.assertEqual(self.timeout(db), before)
+
+    def test_unknown_lane(self):
+        with self.assertRaises(KeyError):
+            with self.lanes_db.lane('nothing'):
+                pass
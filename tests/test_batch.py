@@ -0,0 +1,78 @@
+from concurrent.futures import CancelledError
+
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from tests.database_case import DatabaseTestCase
+
+TestBase = declarative_base()
+
+
+class Run(TestBase):
+    __tablename__ = 'dbal_test_batch'
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String)
+
+
+class TestBatch(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        TestBase.metadata.create_all(self.db.engine)
+
+    def tearDown(self):
+        self.db.rollback()
+        TestBase.metadata.drop_all(self.db.engine)
+
+    def statuses(self):
+        return self.run_sql('SELECT id, status FROM dbal_test_batch ORDER BY id')
+
+    def test_statements_and_writes(self):
+        with self.db.batch(page_size=2) as batch:
+            inserted = batch.execute_many(
+                'INSERT INTO dbal_test_batch (id, status) VALUES (%s, %s)',
+                [(1, 'new'), (2, 'new'), (3, 'new')])
+            written = batch.write(Run(id=4, status='new'))
+            batch.execute('UPDATE dbal_test_batch SET status = %s WHERE id = %s',
+                          ('done', 4))
+            count = batch.execute('SELECT count(*) FROM dbal_test_batch',
+                                  fetch=True)
+            last = batch.execute('SELECT max(id) FROM dbal_test_batch', fetch=True)
+        self.assertEqual([future.result() for future in inserted], [None] * 3)
+        self.assertEqual(written.result().id, 4)
+        self.assertEqual(count.result(), [(4,)])
+        self.assertEqual(last.result(), [(4,)])
+        self.assertEqual(self.statuses(), [(1, 'new'), (2, 'new'), (3, 'new'),
+                                           (4, 'done')])
+
+    def test_update(self):
+        self.run_sql("INSERT INTO dbal_test_batch VALUES (1, 'new')")
+        run = self.db.read_one(Run, Run.id == 1)
+        with self.db.batch() as batch:
+            run.status = 'done'
+            updated = batch.update(run)
+        self.assertIs(updated.result(), run)
+        self.assertEqual(self.statuses(), [(1, 'done')])
+
+    def test_failure(self):
+        with self.assertRaises(Exception):
+            with self.db.batch() as batch:
+                first = batch.execute('INSERT INTO dbal_test_batch VALUES (1, %s)',
+                                      ('new',))
+                batch.execute('INSERT INTO dbal_test_batch VALUES (1, %s)',
+                              ('duplicated',))
+        # The whole batch was rolled back, so every future fails
+        with self.assertRaises(Exception):
+            first.result()
+        self.assertEqual(self.statuses(), [])
+
+    def test_block_error(self):
+        with self.assertRaises(KeyError):
+            with self.db.batch() as batch:
+                queued = batch.execute('INSERT INTO dbal_test_batch VALUES (1, %s)',
+                                       ('new',))
+                raise KeyError('before sending')
+        with self.assertRaises(CancelledError):
+            queued.result()
+        self.assertEqual(self.statuses(), [])
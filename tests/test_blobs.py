@@ -0,0 +1,83 @@
+import io
+import os
+import shutil
+import unittest
+
+from dbal import blobs
+from dbal.blobs import _ChunksReader
+
+from tests.database_case import DatabaseTestCase
+
+
+def _bytea_reader(data, chunk_size, released):
+    # psycopg2 returns the bytea values as memoryviews with the 'c' format
+    chunks = [memoryview(data[start:start + chunk_size]).cast('c')
+              for start in range(0, len(data), chunk_size)]
+
+    def fetch(position):
+        return chunks[position] if position < len(chunks) else None
+
+    return io.BufferedReader(_ChunksReader(fetch, lambda: released.append(True)),
+                             buffer_size=chunk_size)
+
+
+class TestChunksReader(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(10000)
+        self.released = []
+
+    def test_copyfileobj(self):
+        target = io.BytesIO()
+        shutil.copyfileobj(_bytea_reader(self.data, 3000, self.released), target,
+                           1000)
+        self.assertEqual(target.getvalue(), self.data)
+        self.assertEqual(self.released, [True])
+
+    def test_read_in_pieces(self):
+        stream = _bytea_reader(self.data, 3000, self.released)
+        pieces = list(iter(lambda: stream.read(777), b''))
+        self.assertEqual(b''.join(pieces), self.data)
+
+    def test_close_releases_once(self):
+        stream = _bytea_reader(self.data, 3000, self.released)
+        self.assertEqual(stream.read(10), self.data[:10])
+        stream.close()
+        stream.close()
+        self.assertEqual(self.released, [True])
+
+    def test_chunks_of_bytes_like(self):
+        self.assertEqual([bytes(chunk) for chunk in blobs._chunks(b'abcde', 2)],
+                         [b'ab', b'cd', b'e'])
+
+    def test_chunks_of_files(self):
+        self.assertEqual([bytes(chunk) for chunk in
+                          blobs._chunks(io.BytesIO(b'abcde'), 2)],
+                         [b'ab', b'cd', b'e'])
+
+
+class TestBlobs(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(50000)
+
+    def test_chunks_blob(self):
+        key = 'dbal_test_blob_{}'.format(id(self))
+        self.db.write_blob(io.BytesIO(self.data), key=key, chunk_size=4096)
+        try:
+            target = io.BytesIO()
+            with self.db.read_blob(key) as stream:
+                shutil.copyfileobj(stream, target, 1000)
+            self.assertEqual(target.getvalue(), self.data)
+        finally:
+            self.db.delete_blob(key)
+
+    def test_large_object(self):
+        oid = self.db.write_blob(self.data, chunk_size=4096)
+        try:
+            target = io.BytesIO()
+            shutil.copyfileobj(self.db.read_blob(oid, chunk_size=4096), target, 1000)
+            self.assertEqual(target.getvalue(), self.data)
+        finally:
+            self.db.delete_blob(oid)
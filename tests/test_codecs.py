@@ -0,0 +1,90 @@
+import json
+import unittest
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from dbal import codecs
+from dbal.codecs import (NonCasteableType, get_codec, register_codec,
+                         row_converter, serialize, set_json_encoder)
+
+
+class TestCodecs(unittest.TestCase):
+
+    def test_scalar_codecs(self):
+        self.assertEqual(get_codec('integer')('5'), 5)
+        self.assertEqual(get_codec('numeric(10, 2)')(1.1), Decimal('1.1'))
+        self.assertEqual(get_codec('varchar(20)')(5), '5')
+        self.assertIs(get_codec('boolean')(' Yes '), True)
+        self.assertIs(get_codec('bool')('off'), False)
+        self.assertEqual(get_codec('bytea')('a'), b'a')
+
+    def test_invalid_boolean(self):
+        with self.assertRaises(ValueError):
+            get_codec('bool')('maybe')
+
+    def test_timestamps(self):
+        naive = datetime(2020, 1, 1, 12)
+        self.assertEqual(get_codec('timestamp with time zone')(naive),
+                         naive.replace(tzinfo=timezone.utc))
+        self.assertEqual(get_codec('timestamp')('2020-01-01T12:00:00'), naive)
+        self.assertEqual(get_codec('date')(naive), naive.date())
+
+    def test_non_casteable_type(self):
+        with self.assertRaises(NonCasteableType):
+            get_codec('tsvector')
+
+    def test_serialize_null(self):
+        self.assertIsNone(serialize(None, 'int'))
+
+    def test_arrays(self):
+        self.assertEqual(get_codec('int[]')(['1', None, ('2', '3')]),
+                         [1, None, [2, 3]])
+
+    def test_json_arrays_are_cast(self):
+        elements = get_codec('jsonb[]')([{'a': 1}, None])
+        self.assertIsNone(elements[1])
+        self.assertEqual(elements[0].getquoted(), b'\'{"a": 1}\'::jsonb')
+        self.assertTrue(get_codec('json[]')([1])[0].getquoted().endswith(b'::json'))
+
+    def test_register_codec(self):
+        try:
+            register_codec('INET', lambda value: 'inet ' + value)
+            self.assertEqual(get_codec('inet')('10.0.0.1'), 'inet 10.0.0.1')
+        finally:
+            del codecs._CODECS['inet']
+            get_codec.cache_clear()
+        with self.assertRaises(NonCasteableType):
+            get_codec('inet')
+
+    def test_set_json_encoder(self):
+        try:
+            set_json_encoder(lambda value: json.dumps(value).encode('utf-8'))
+            self.assertEqual(serialize({'a': 1}, 'jsonb'), '{"a": 1}')
+        finally:
+            set_json_encoder(json.dumps)
+
+
+class TestRowConverter(unittest.TestCase):
+
+    def test_convert(self):
+        passed = object()
+        convert = row_converter(('int', None, 'jsonb'))
+        self.assertEqual(convert(('1', passed, {'a': 1})), (1, passed, '{"a": 1}'))
+        self.assertEqual(convert((None, None, None)), (None, None, None))
+
+    def test_single_column(self):
+        self.assertEqual(row_converter(('int',))(('7',)), (7,))
+
+    def test_no_columns(self):
+        self.assertEqual(row_converter(())(()), ())
+
+    def test_built_once(self):
+        self.assertIs(row_converter(('int', 'text')), row_converter(('int', 'text')))
+
+    def test_wrong_length(self):
+        with self.assertRaises(ValueError):
+            row_converter(('int', 'text'))(('1',))
+
+    def test_convert_rows(self):
+        self.assertEqual(list(codecs.convert_rows(['int'], [('1',), ('2',)])),
+                         [(1,), (2,)])
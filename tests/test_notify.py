@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from dbal.notify import Notification, _Listener, _decode, channel_for
+
+from tests.database_case import DatabaseTestCase
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out waiting')
+        time.sleep(0.05)
+
+
+class TestListener(unittest.TestCase):
+
+    def test_channel_for(self):
+        self.assertEqual(channel_for('pipe_runs'), 'dbal_pipe_runs')
+        self.assertEqual(channel_for('public.pipe-runs'), 'dbal_public_pipe_runs')
+
+    def test_decode(self):
+        self.assertEqual(_decode(Notification('jobs', '{"key": 3}', 10)),
+                         Notification('jobs', {'key': 3}, 10))
+        self.assertEqual(_decode(Notification('jobs', 'plain', 10)).payload, 'plain')
+
+    def test_batches_track_the_last_key(self):
+        listener = _Listener(None, 'jobs', None, table='jobs', key='id', max_batch=2)
+        notifications = [Notification('jobs', {'op': op, 'key': key}, None)
+                         for op, key in (('INSERT', 4), ('DELETE', 9), ('INSERT', 2),
+                                         ('CATCH_UP', 7), ('UPDATE', 8))]
+        batches = list(listener._batches(notifications))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(listener.last_key, 7)
+
+    def test_callback_failed(self):
+        def on_error(error, batch):
+            raise RuntimeError('The error handler fails as well')
+
+        listener = _Listener(None, 'jobs', None, on_error=on_error)
+        error = ValueError()
+        listener._callback_failed(error, ['batch'])
+        self.assertEqual(list(listener.errors), [(error, ['batch'])])
+
+
+class TestSubscription(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.table = self.create_table('id SERIAL PRIMARY KEY, name TEXT')
+        self.received = []
+        self.lock = threading.Lock()
+
+    def collect(self, batch):
+        with self.lock:
+            self.received.extend(batch)
+
+    def keys(self):
+        with self.lock:
+            return [notification.payload['key'] for notification in self.received]
+
+    def insert(self, count):
+        self.run_sql('INSERT INTO {} (name) SELECT n::text '
+                     'FROM generate_series(1, %s) n'.format(self.table), (count,))
+
+    def test_channel(self):
+        channel = 'dbal_test_channel'
+        with self.db.subscribe(channel, self.collect):
+            self.run_sql("SELECT pg_notify(%s, 'plain'), pg_notify(%s, '{\"a\": 1}')",
+                         (channel, channel))
+            wait_for(lambda: len(self.received) == 2)
+        self.assertEqual([notification.payload for notification in self.received],
+                         ['plain', {'a': 1}])
+
+    def test_trigger(self):
+        with self.db.subscribe(self.table, self.collect, key='id', trigger=True):
+            self.insert(3)
+            self.run_sql('DELETE FROM {} WHERE id = 2'.format(self.table))
+            wait_for(lambda: len(self.received) == 4)
+        self.assertEqual([(n.payload['op'], n.payload['key']) for n in self.received],
+                         [('INSERT', 1), ('INSERT', 2), ('INSERT', 3), ('DELETE', 2)])
+
+    def test_burst(self):
+        calls = []
+
+        def callback(batch):
+            calls.append(len(batch))
+            self.collect(batch)
+
+        with self.db.subscribe(self.table, callback, key='id', trigger=True,
+                               batch_window=0.5, max_batch=400):
+            self.insert(1000)
+            wait_for(lambda: len(self.received) == 1000)
+        self.assertLessEqual(max(calls), 400)
+        self.assertLess(len(calls), 1000)
+
+    def test_callback_error(self):
+        errors = []
+
+        def callback(batch):
+            if batch[0].payload['key'] == 1:
+                raise ValueError('The first batch fails')
+            self.collect(batch)
+
+        subscription = self.db.subscribe(self.table, callback, key='id', trigger=True,
+                                         on_error=lambda e, batch: errors.append(e))
+        with subscription:
+            self.insert(1)
+            wait_for(lambda: errors)
+            self.insert(1)
+            wait_for(lambda: self.keys() == [2])
+        self.assertIsInstance(subscription.errors[0][0], ValueError)
+
+    def test_catch_up(self):
+        subscription = self.db.subscribe(self.table, self.collect, key='id',
+                                         trigger=True)
+        subscription.reconnect_delay = 0.1
+        with subscription:
+            self.insert(2)
+            wait_for(lambda: self.keys() == [1, 2])
+            pid = subscription._pg_conn.get_backend_pid()
+            self.run_sql('SELECT pg_terminate_backend(%s)', (pid,))
+            self.insert(2)
+            # The rows inserted while disconnected are re-read by key
+            wait_for(lambda: sorted(set(self.keys())) == [1, 2, 3, 4])
+            self.assertGreaterEqual(subscription.reconnections, 1)
+
+    def test_async(self):
+        async def callback(batch):
+            self.collect(batch)
+
+        async def run():
+            subscription = await self.db.subscribe_async(self.table, callback,
+                                                         key='id', trigger=True)
+            async with subscription:
+                await loop.run_in_executor(None, self.insert, 3)
+                for _ in range(200):
+                    if len(self.received) == 3:
+                        break
+                    await asyncio.sleep(0.05)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+        self.assertEqual(self.keys(), [1, 2, 3])
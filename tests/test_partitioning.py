@@ -0,0 +1,106 @@
+import unittest
+from datetime import date
+
+from dbal.partitioning import PartitionedTable
+
+from tests.database_case import DatabaseTestCase
+
+
+class TestRangePartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.table = PartitionedTable('events', 'range', 'created_at', 'date')
+        self.table.add_range('events_p2020_02', date(2020, 2, 1), date(2020, 3, 1))
+        self.table.add_range('events_p2020_01', date(2020, 1, 1), date(2020, 2, 1))
+        # A gap in April
+        self.table.add_range('events_p2020_05', date(2020, 5, 1), None)
+        self.table.add_range('events_old', None, date(2020, 1, 1))
+
+    def test_partition_for(self):
+        self.assertEqual(self.table.partition_for(date(2019, 6, 1)), 'events_old')
+        self.assertEqual(self.table.partition_for(date(2020, 1, 1)),
+                         'events_p2020_01')
+        self.assertEqual(self.table.partition_for(date(2020, 2, 29)),
+                         'events_p2020_02')
+        self.assertEqual(self.table.partition_for(date(2030, 1, 1)),
+                         'events_p2020_05')
+
+    def test_upper_bound_is_exclusive(self):
+        self.assertEqual(self.table.partition_for(date(2020, 2, 1)),
+                         'events_p2020_02')
+
+    def test_no_partition(self):
+        self.assertIsNone(self.table.partition_for(date(2020, 4, 1)))
+        self.assertIsNone(self.table.partition_for(None))
+
+    def test_default_partition(self):
+        self.table.default = 'events_default'
+        self.assertEqual(self.table.partition_for(date(2020, 4, 1)),
+                         'events_default')
+        self.assertEqual(self.table.partition_for(None), 'events_default')
+
+    def test_remove_ranges(self):
+        self.table.remove_ranges(['events_p2020_01'])
+        self.assertIsNone(self.table.partition_for(date(2020, 1, 15)))
+        self.assertEqual(self.table.partition_for(date(2020, 2, 15)),
+                         'events_p2020_02')
+
+    def test_route(self):
+        rows = [(1, date(2020, 1, 5)), (2, date(2020, 4, 5)), (3, date(2020, 1, 9))]
+        self.assertEqual(self.table.route(('id', 'created_at'), rows), {
+            'events_p2020_01': [0, 2],
+            None: [1],
+        })
+
+    def test_route_unroutable(self):
+        self.assertIsNone(self.table.route(('id',), [(1,)]))
+        self.assertIsNone(self.table.route(('created_at',), [('2020-01-05',)]))
+
+
+class TestListPartitions(unittest.TestCase):
+
+    def test_partition_for(self):
+        table = PartitionedTable('customers', 'list', 'country', 'text')
+        table.add_list('customers_eu', ['ES', 'FR'])
+        table.add_list('customers_us', ['US'])
+        self.assertEqual(table.partition_for('FR'), 'customers_eu')
+        self.assertEqual(table.partition_for('US'), 'customers_us')
+        self.assertIsNone(table.partition_for('JP'))
+        table.default = 'customers_other'
+        self.assertEqual(table.partition_for('JP'), 'customers_other')
+
+
+class TestPartitionedInserts(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        if int(self.run_sql('SHOW server_version_num')[0][0]) < 110000:
+            self.skipTest('The default partitions need postgres 11')
+        self.table = 'dbal_test_customers'
+        self.tables.append(self.table)
+        self.run_sql('CREATE TABLE dbal_test_customers (id INTEGER, country TEXT) '
+                     'PARTITION BY LIST (country)')
+        for suffix, values in (('eu', "'ES', 'FR'"), ('us', "'US'")):
+            self.run_sql('CREATE TABLE dbal_test_customers_{} PARTITION OF '
+                         'dbal_test_customers FOR VALUES IN ({})'
+                         .format(suffix, values))
+        self.run_sql('CREATE TABLE dbal_test_customers_other PARTITION OF '
+                     'dbal_test_customers DEFAULT')
+        self.db.partitioned_tables(refresh=True)
+
+    def test_returned_in_input_order(self):
+        values = [(1, 'US'), (2, 'ES'), (3, 'JP'), (4, 'US'), (5, 'FR')]
+        returned = self.db.insert_many(self.table, ('id', 'country'), values,
+                                       to_return=('id',))
+        self.db.commit()
+        self.assertEqual(returned, [(1,), (2,), (3,), (4,), (5,)])
+        self.assertEqual(self.run_sql('SELECT id FROM dbal_test_customers_eu '
+                                      'ORDER BY id'), [(2,), (5,)])
+
+    def test_discovery_out_of_the_session_transaction(self):
+        self.db.insert_many(self.table, ('id', 'country'), [(1, 'US')])
+        self.db.partitioned_tables(refresh=True)
+        # The discovery does not end (nor block) the session transaction
+        self.db.rollback()
+        self.assertEqual(self.run_sql('SELECT count(*) FROM dbal_test_customers'),
+                         [(0,)])
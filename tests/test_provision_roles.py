@@ -0,0 +1,40 @@
+import unittest
+
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.scripts.Roles.provision_roles import (compile_plan, config_for,
+                                                provision_database)
+
+from tests.database_case import DatabaseTestCase
+
+
+class TestPlan(unittest.TestCase):
+
+    def test_compile_plan(self):
+        plan = compile_plan('dev', 'dev:pass', 'viewer', 'viewer_pass')
+        self.assertIn('dev:pass', plan)
+        self.assertTrue(plan.endswith(';'))
+        self.assertEqual(compile_plan('dev', 'a', 'viewer', 'b',
+                                      update_passwords=True).count('PASSWORD'), 4)
+
+    def test_config_for(self):
+        config = DatabaseConfig({'DB_HOST': 'host', 'DB_NAME': 'first',
+                                 'User': 'user', 'Pass': 'pass'})
+        other = config_for(config, 'second')
+        self.assertEqual((other.DB_HOST, other.DB_NAME), ('host', 'second'))
+        self.assertEqual(config.DB_NAME, 'first')
+
+
+class TestProvisionDatabase(DatabaseTestCase):
+
+    def test_plan_sent_as_it_is(self):
+        # Neither the :word nor the % are taken as bind parameters
+        error, _ = provision_database(
+            self.db.db_config,
+            "CREATE TEMP TABLE dbal_test_plan (note TEXT);\n"
+            "INSERT INTO dbal_test_plan VALUES ('a :password with 100%');"
+        )
+        self.assertIsNone(error)
+
+    def test_error(self):
+        error, _ = provision_database(self.db.db_config, 'SELECT * FROM dbal_nothing;')
+        self.assertIn('dbal_nothing', error)
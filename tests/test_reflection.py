@@ -0,0 +1,29 @@
+from tests.database_case import DatabaseTestCase
+
+
+class TestReflect(DatabaseTestCase):
+
+    def columns(self, table):
+        return [column.name for column in
+                self.db.reflect(tables=[table]).tables[table].columns]
+
+    def test_reflect(self):
+        table = self.create_table('id INTEGER PRIMARY KEY, name TEXT')
+        self.assertEqual(self.columns(table), ['id', 'name'])
+        # From the memory, the same object
+        self.assertIs(self.db.reflect(tables=[table]), self.db.reflect(tables=[table]))
+
+    def test_schema_change(self):
+        table = self.create_table('id INTEGER PRIMARY KEY')
+        self.assertEqual(self.columns(table), ['id'])
+        self.run_sql('ALTER TABLE {} ADD COLUMN created DATE'.format(table))
+        self.assertEqual(self.columns(table), ['id', 'created'])
+
+    def test_given_fingerprint(self):
+        table = self.create_table('id INTEGER PRIMARY KEY')
+        metadata = self.db.reflect(tables=[table], fingerprint='v1')
+        self.run_sql('ALTER TABLE {} ADD COLUMN created DATE'.format(table))
+        # The schema version did not change, so the reflection is not repeated
+        self.assertIs(self.db.reflect(tables=[table], fingerprint='v1'), metadata)
+        self.assertIn('created', self.db.reflect(tables=[table], fingerprint='v2')
+                      .tables[table].columns)
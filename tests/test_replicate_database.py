@@ -0,0 +1,107 @@
+import unittest
+
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.scripts.replicate_database import (libpq_args, materialized_views_refreshes,
+                                             pipe_copy, qualified_name)
+
+from tests.database_case import DatabaseTestCase
+
+
+class _Source(object):
+    """
+    Writes the data as COPY TO STDOUT does, in pieces
+    """
+
+    def __init__(self, data, error=None):
+        self.data = data
+        self.error = error
+
+    def copy_expert(self, sql, file, size=8192):
+        for start in range(0, len(self.data), 1000):
+            file.write(self.data[start:start + 1000])
+        if self.error:
+            raise self.error
+
+
+class _Destination(object):
+    """
+    Reads the data as COPY FROM STDIN does
+    """
+
+    def __init__(self, fail_after=None):
+        self.received = b''
+        self.fail_after = fail_after
+
+    def copy_expert(self, sql, file, size=8192):
+        while True:
+            data = file.read(size)
+            if not data:
+                return
+            self.received += data
+            if self.fail_after is not None and len(self.received) >= self.fail_after:
+                raise ValueError('The destination failed')
+
+
+class TestHelpers(unittest.TestCase):
+
+    def test_qualified_name(self):
+        self.assertEqual(qualified_name('public', 'my "table"'),
+                         '"public"."my ""table"""')
+
+    def test_libpq_args(self):
+        config = DatabaseConfig({'DB_HOST': 'host:5433', 'DB_NAME': 'db',
+                                 'User': 'user', 'Pass': 'pass'})
+        self.assertEqual(libpq_args(config),
+                         ['-h', 'host', '-U', 'user', '-d', 'db', '-p', '5433'])
+
+
+class TestPipeCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.data = bytes(range(256)) * 4000
+
+    def test_transfer(self):
+        destination = _Destination()
+        transferred = pipe_copy(_Source(self.data), destination, 'COPY TO',
+                                'COPY FROM', buffer_size=4096)
+        self.assertEqual(transferred, len(self.data))
+        self.assertEqual(destination.received, self.data)
+
+    def test_source_error(self):
+        with self.assertRaises(KeyError):
+            pipe_copy(_Source(self.data, error=KeyError('source')), _Destination(),
+                      'COPY TO', 'COPY FROM')
+
+    def test_destination_error(self):
+        # The source is unblocked when the destination fails
+        with self.assertRaises(ValueError):
+            pipe_copy(_Source(self.data), _Destination(fail_after=10000), 'COPY TO',
+                      'COPY FROM', buffer_size=4096)
+
+
+class TestMaterializedViews(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.table = self.create_table('id INTEGER')
+        self.views = ['{}_{}'.format(self.table, name) for name in ('a', 'b', 'c')]
+        a, b, c = self.views
+        self.run_sql('CREATE MATERIALIZED VIEW {} AS SELECT id FROM {}'
+                     .format(a, self.table))
+        self.run_sql('CREATE MATERIALIZED VIEW {} AS SELECT id FROM {}'.format(b, a))
+        self.run_sql('CREATE MATERIALIZED VIEW {} AS SELECT id FROM {} WITH NO DATA'
+                     .format(c, a))
+
+    def test_levels(self):
+        conn = self.db.engine.raw_connection()
+        try:
+            levels = materialized_views_refreshes(conn.cursor())
+            conn.rollback()
+        finally:
+            conn.close()
+        position = {statement.rpartition('.')[2]: number
+                    for number, level in enumerate(levels) for statement in level}
+        a, b, c = self.views
+        # The unpopulated views are not refreshed
+        self.assertNotIn(c, position)
+        self.assertLess(position[a], position[b])
@@ -0,0 +1,104 @@
+import threading
+import unittest
+import uuid
+
+from psycopg2 import InterfaceError, OperationalError
+
+from dbal.resumable import (CHECKPOINTS_TABLE, _chunked, _ensure_checkpoints_table,
+                            is_transient)
+
+from tests.database_case import DatabaseTestCase
+
+
+class _Error(Exception):
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+class TestResumableHelpers(unittest.TestCase):
+
+    def test_is_transient(self):
+        self.assertTrue(is_transient(_Error('40001')))
+        self.assertTrue(is_transient(_Error('40P01')))
+        self.assertFalse(is_transient(_Error('23505')))
+        self.assertTrue(is_transient(InterfaceError()))
+        self.assertTrue(is_transient(OperationalError()))
+        self.assertFalse(is_transient(ValueError()))
+
+    def test_chunked(self):
+        self.assertEqual(list(_chunked(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
+
+
+class TestResumableBulk(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.table = self.create_table('id INTEGER')
+        self.job_id = 'dbal_test_{}'.format(uuid.uuid4().hex)
+        # Created once, since two runs creating it at the same time may conflict
+        conn = self.db.engine.raw_connection()
+        try:
+            _ensure_checkpoints_table(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    def tearDown(self):
+        self.run_sql('DELETE FROM {} WHERE job_id = %s'.format(CHECKPOINTS_TABLE),
+                     (self.job_id,))
+        super().tearDown()
+
+    def insert(self, values, **kwargs):
+        return self.db.insert_many_resumable(self.job_id, self.table, ('id',), values,
+                                             chunk_size=10, **kwargs)
+
+    def count(self):
+        return self.run_sql('SELECT count(*) FROM {}'.format(self.table))[0][0]
+
+    def test_finished_job(self):
+        values = [(n,) for n in range(25)]
+        stats = self.insert(values)
+        self.assertEqual((stats['chunks'], stats['rows']), (3, 25))
+        stats = self.insert(values)
+        self.assertEqual((stats['chunks'], stats['skipped_chunks']), (0, 0))
+        self.assertEqual(self.count(), 25)
+
+    def test_resume(self):
+        def failing():
+            for n in range(25):
+                if n == 22:
+                    raise ValueError('The source failed')
+                yield (n,)
+
+        with self.assertRaises(ValueError):
+            self.insert(failing())
+        self.assertEqual(self.count(), 20)
+        stats = self.insert([(n,) for n in range(25)])
+        self.assertEqual((stats['chunks'], stats['skipped_chunks']), (1, 2))
+        self.assertEqual(self.count(), 25)
+
+    def test_restart(self):
+        values = [(n,) for n in range(5)]
+        self.insert(values)
+        self.insert(values, restart=True)
+        self.assertEqual(self.count(), 10)
+
+    def test_concurrent_runs_of_a_new_job(self):
+        values = [(n,) for n in range(200)]
+        errors = []
+
+        def run():
+            try:
+                self.insert(values)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual(errors, [])
+        # Every chunk is written by one of the runs
+        self.assertEqual(self.count(), 200)
@@ -0,0 +1,90 @@
+import threading
+
+from dbal.scan import integer_primary_key, parallel_scan, scan_ranges
+
+from tests.database_case import DatabaseTestCase
+
+
+class TestParallelScan(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.table = self.create_table('id INTEGER PRIMARY KEY, name TEXT')
+        self.run_sql("INSERT INTO {} SELECT n, 'name ' || n "
+                     "FROM generate_series(1, 5000) n".format(self.table))
+
+    def cursor(self):
+        conn = self.db.engine.raw_connection()
+        self.addCleanup(conn.close)
+        return conn.cursor()
+
+    def test_integer_primary_key(self):
+        cursor = self.cursor()
+        self.assertEqual(integer_primary_key(cursor, self.table), 'id')
+        text_table = self.create_table('code TEXT PRIMARY KEY')
+        self.assertIsNone(integer_primary_key(cursor, text_table))
+
+    def test_key_ranges(self):
+        ranges = scan_ranges(self.cursor(), self.table, 'id', 8)
+        self.assertEqual(len(ranges), 8)
+        counts = [self.run_sql('SELECT count(*) FROM {} WHERE {}'.format(
+            self.table, condition))[0][0] for condition in ranges]
+        self.assertEqual(sum(counts), 5000)
+
+    def test_empty_table(self):
+        table = self.create_table('id INTEGER PRIMARY KEY')
+        self.assertEqual(scan_ranges(self.cursor(), table, 'id', 4), [])
+        self.assertEqual(list(self.db.parallel_scan(table)), [])
+
+    def test_page_ranges(self):
+        cursor = self.cursor()
+        ranges = scan_ranges(cursor, self.table, None, 4)
+        if cursor.connection.server_version < 140000:
+            self.assertEqual(ranges, ['TRUE'])
+        counts = [self.run_sql('SELECT count(*) FROM {} WHERE {}'.format(
+            self.table, condition))[0][0] for condition in ranges]
+        self.assertEqual(sum(counts), 5000)
+
+    def test_rows(self):
+        rows = list(self.db.parallel_scan(self.table, workers=4, batch_size=300))
+        self.assertEqual(sorted(rows), [(n, 'name {}'.format(n))
+                                        for n in range(1, 5001)])
+
+    def test_columns_and_batches(self):
+        batches = list(self.db.parallel_scan(self.table, columns=('id',), workers=3,
+                                             batch_size=250, batches=True))
+        self.assertTrue(all(len(batch) <= 250 for batch in batches))
+        ids = sorted(row[0] for batch in batches for row in batch)
+        self.assertEqual(ids, list(range(1, 5001)))
+
+    def test_callback(self):
+        lock = threading.Lock()
+        ids = []
+
+        def collect(rows):
+            with lock:
+                ids.extend(row[0] for row in rows)
+
+        self.assertIsNone(self.db.parallel_scan(self.table, columns=('id',),
+                                                callback=collect))
+        self.assertEqual(sorted(ids), list(range(1, 5001)))
+
+    def test_snapshot(self):
+        # The rows committed after the scan started are not read
+        scan = parallel_scan(self.db.engine, self.table, columns=('id',), workers=2,
+                             batch_size=100)
+        first = next(scan)
+        self.run_sql('INSERT INTO {} VALUES (5001, NULL)'.format(self.table))
+        ids = [first[0]] + [row[0] for row in scan]
+        self.assertEqual(sorted(ids), list(range(1, 5001)))
+
+    def test_error(self):
+        with self.assertRaises(Exception):
+            list(self.db.parallel_scan(self.table, columns=('missing',)))
+
+    def test_abandoned_scan(self):
+        # Closing the generator stops the workers and releases the connections
+        scan = self.db.parallel_scan(self.table, workers=2, batch_size=10)
+        next(scan)
+        scan.close()
+        self.assertEqual(len(list(self.db.parallel_scan(self.table))), 5000)
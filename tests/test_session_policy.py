@@ -0,0 +1,75 @@
+import time
+import unittest
+import warnings
+
+from sqlalchemy import Column, Integer
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+
+from dbal.database import LongTransactionWarning, SessionPolicy
+
+from tests.database_case import DatabaseTestCase
+
+TestBase = declarative_base()
+
+
+class Item(TestBase):
+    __tablename__ = 'dbal_test_session_policy'
+
+    id = Column(Integer, primary_key=True)
+
+
+class TestSessionPolicy(unittest.TestCase):
+
+    def test_no_limits(self):
+        self.assertFalse(SessionPolicy().must_recycle(Session()))
+
+    def test_max_age(self):
+        session = Session()
+        session.info['dbal_session_start'] = time.time() - 10
+        self.assertTrue(SessionPolicy(max_age=5).must_recycle(session))
+        self.assertFalse(SessionPolicy(max_age=60).must_recycle(session))
+
+
+class TestSessionRecycling(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        TestBase.metadata.create_all(self.db.engine)
+        self.run_sql('INSERT INTO dbal_test_session_policy '
+                     'SELECT generate_series(1, 10)')
+        self.policy = self.db.session_policy
+
+    def tearDown(self):
+        self.db.session_policy = self.policy
+        self.db.recycle_session()
+        self.db.rollback()
+        TestBase.metadata.drop_all(self.db.engine)
+
+    def test_max_objects(self):
+        self.db.session_policy = SessionPolicy(max_objects=5)
+        self.assertEqual(len(self.db.read(Item, limit=None)), 10)
+        self.assertEqual(self.db.session_metrics()['identity_map_size'], 10)
+        self.db.commit()
+        self.assertEqual(self.db.session_metrics()['identity_map_size'], 0)
+
+    def test_pending_changes_are_kept(self):
+        self.db.session_policy = SessionPolicy(max_objects=5)
+        self.db.read(Item, limit=None)
+        item = Item(id=11)
+        self.db.session.add(item)
+        # Not recycled before the read, since the new item was not flushed
+        self.db.read(Item, Item.id == 1)
+        self.assertIn(item, self.db.session)
+        self.assertEqual(self.db.session_metrics()['identity_map_size'], 11)
+
+    def test_long_transaction_warning(self):
+        self.db.session_policy = SessionPolicy(warn_transaction_age=0.01)
+        self.db.read(Item, Item.id == 1)
+        time.sleep(0.05)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.db.read(Item, Item.id == 2)
+            self.db.read(Item, Item.id == 3)
+        self.assertEqual([warning.category for warning in caught],
+                         [LongTransactionWarning])
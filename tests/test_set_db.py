@@ -0,0 +1,90 @@
+import unittest
+
+from sqlalchemy import (Column, ForeignKey, Index, Integer, MetaData, Sequence, Table,
+                        inspect)
+from sqlalchemy.dialects.postgresql import ENUM
+
+from dbal.Config.Set_db import (_disjoint_waves, _sequences, parallel_create,
+                                parallel_drop)
+
+from tests.database_case import DatabaseTestCase
+
+
+def _schema():
+    metadata = MetaData()
+    Sequence('dbal_test_standalone', metadata=metadata)
+    parents = Table('dbal_test_parents', metadata,
+                    Column('id', Integer, Sequence('dbal_test_parents_id'),
+                           primary_key=True),
+                    Column('status', ENUM('new', 'done', name='dbal_test_status')))
+    children = Table('dbal_test_children', metadata,
+                     Column('id', Integer, primary_key=True),
+                     Column('parent_id', Integer,
+                            ForeignKey('dbal_test_parents.id')),
+                     Column('other_id', Integer,
+                            ForeignKey('dbal_test_children.id')))
+    Index('dbal_test_children_parent', children.c.parent_id)
+    return metadata, [parents, children]
+
+
+class TestDisjointWaves(unittest.TestCase):
+
+    def test_waves(self):
+        foreign_keys = [('fk1', ('a', 'b')), ('fk2', ('c', 'd')),
+                        ('fk3', ('b', 'c')), ('fk4', ('a', 'a')),
+                        ('fk5', ('a', 'c'))]
+        self.assertEqual(_disjoint_waves(foreign_keys),
+                         [['fk1', 'fk2'], ['fk3', 'fk4'], ['fk5']])
+
+    def test_no_table_twice_in_a_wave(self):
+        foreign_keys = [('fk{}'.format(i), ('t{}'.format(i % 4), 't{}'.format(i % 3)))
+                        for i in range(12)]
+        tables = dict(foreign_keys)
+        waves = _disjoint_waves(foreign_keys)
+        self.assertEqual(sorted(fk for wave in waves for fk in wave),
+                         sorted(tables))
+        for wave in waves:
+            touched = [table for fk in wave for table in set(tables[fk])]
+            self.assertEqual(len(touched), len(set(touched)))
+
+    def test_empty(self):
+        self.assertEqual(_disjoint_waves([]), [])
+
+
+class TestSequences(unittest.TestCase):
+
+    def test_sequences(self):
+        metadata, tables = _schema()
+        self.assertEqual([sequence.name for sequence in _sequences(tables)],
+                         ['dbal_test_parents_id'])
+        self.assertEqual(sorted(sequence.name
+                                for sequence in _sequences(tables, metadata)),
+                         ['dbal_test_parents_id', 'dbal_test_standalone'])
+
+
+class TestParallelSchema(DatabaseTestCase):
+
+    def test_create_and_drop(self):
+        metadata, tables = _schema()
+        engine = self.db.engine
+        parallel_create(engine, tables, 2, metadata=metadata)
+        try:
+            inspector = inspect(engine)
+            self.assertEqual(
+                sorted(fk['referred_table'] for fk in
+                       inspector.get_foreign_keys('dbal_test_children')),
+                ['dbal_test_children', 'dbal_test_parents'])
+            self.assertEqual([index['name'] for index in
+                              inspector.get_indexes('dbal_test_children')],
+                             ['dbal_test_children_parent'])
+            self.assertEqual(self.run_sql("SELECT nextval('dbal_test_standalone')"),
+                             [(1,)])
+        finally:
+            parallel_drop(engine, tables, 2, metadata=metadata)
+        self.assertEqual(self.run_sql(
+            "SELECT count(*) FROM pg_class WHERE relname IN ('dbal_test_parents', "
+            "'dbal_test_children', 'dbal_test_parents_id', 'dbal_test_standalone')"),
+            [(0,)])
+        self.assertEqual(self.run_sql(
+            "SELECT count(*) FROM pg_type WHERE typname = 'dbal_test_status'"),
+            [(0,)])
@@ -0,0 +1,97 @@
+import unittest
+
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.sharding import HashShardMap, RangeShardMap, ShardedDatabase
+
+from tests.database_case import DatabaseTestCase
+
+TestBase = declarative_base()
+
+
+class Event(TestBase):
+    __tablename__ = 'dbal_test_sharding'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String)
+
+
+class TestRangeShardMap(unittest.TestCase):
+
+    def test_config_for(self):
+        shard_map = RangeShardMap([(20, 'second'), (None, 'last'), (10, 'first')])
+        self.assertEqual(shard_map.db_configs, ['first', 'second', 'last'])
+        self.assertEqual(shard_map.config_for(-5), 'first')
+        # The upper bound is inclusive
+        self.assertEqual(shard_map.config_for(10), 'first')
+        self.assertEqual(shard_map.config_for(11), 'second')
+        self.assertEqual(shard_map.config_for(20), 'second')
+        self.assertEqual(shard_map.config_for(10 ** 9), 'last')
+
+    def test_out_of_range(self):
+        shard_map = RangeShardMap([(10, 'first'), (20, 'second')])
+        self.assertEqual(shard_map.config_for(20), 'second')
+        with self.assertRaises(KeyError):
+            shard_map.config_for(21)
+
+
+class TestHashShardMap(unittest.TestCase):
+
+    def test_stable(self):
+        shard_map = HashShardMap(['a', 'b', 'c'])
+        self.assertEqual([shard_map.config_for(key) for key in range(100)],
+                         [HashShardMap(['a', 'b', 'c']).config_for(key)
+                          for key in range(100)])
+        self.assertEqual({shard_map.config_for(key) for key in range(100)},
+                         {'a', 'b', 'c'})
+
+
+class TestShardedDatabase(DatabaseTestCase):
+    """
+    Both shards are the test database, so they share the server as the shards of
+    a small cluster would
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        config = cls.db.db_config.config
+        cls.shard_map = RangeShardMap([(100, DatabaseConfig(dict(config))),
+                                       (None, DatabaseConfig(dict(config)))])
+
+    def setUp(self):
+        super().setUp()
+        TestBase.metadata.create_all(self.db.engine)
+        self.sharded = ShardedDatabase(self.shard_map)
+
+    def tearDown(self):
+        self.sharded.rollback()
+        self.sharded.close()
+        TestBase.metadata.drop_all(self.db.engine)
+        super().tearDown()
+
+    def names(self):
+        return self.run_sql('SELECT id, name FROM dbal_test_sharding ORDER BY id')
+
+    def test_insert_many(self):
+        self.sharded.insert_many('dbal_test_sharding', ('id', 'name'),
+                                 [(1, 'a'), (500, 'b'), (2, 'c')])
+        self.sharded.commit()
+        self.assertEqual(self.names(), [(1, 'a'), (2, 'c'), (500, 'b')])
+
+    def test_two_phase_write_many(self):
+        if int(self.run_sql('SHOW max_prepared_transactions')[0][0]) < 2:
+            self.skipTest('The server does not allow prepared transactions')
+        events = [Event(id=1, name='a'), Event(id=500, name='b')]
+        self.sharded.write_many(events, key=lambda event: event.id, two_phase=True)
+        self.assertEqual(self.names(), [(1, 'a'), (500, 'b')])
+        self.assertEqual(self.run_sql("SELECT count(*) FROM pg_prepared_xacts "
+                                      "WHERE gid LIKE 'dbal_%'")[0][0], 0)
+
+    def test_close(self):
+        with ShardedDatabase(self.shard_map) as sharded:
+            self.assertEqual(len(sharded.execute_all('SELECT 1')), 2)
+        with self.assertRaises(RuntimeError):
+            sharded.execute_all('SELECT 1')
@@ -0,0 +1,99 @@
+import unittest
+import uuid
+
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.database import Database
+from dbal.scan import export_snapshot
+from dbal.scripts.sync_database import range_condition, sync_table
+
+from tests.database_case import DatabaseTestCase
+
+
+class TestRangeCondition(unittest.TestCase):
+
+    def test_bounds(self):
+        self.assertEqual(range_condition(['id'], (10,), (20,)),
+                         ('("id") > (%s) AND ("id") <= (%s)', [10, 20]))
+        self.assertEqual(range_condition(['a', 'b'], None, (1, 2)),
+                         ('("a", "b") <= (%s, %s)', [1, 2]))
+        self.assertEqual(range_condition(['id'], None, None), ('TRUE', []))
+
+    def test_no_primary_key(self):
+        self.assertEqual(range_condition([], (1,), (2,)), ('TRUE', []))
+
+
+class TestSyncTable(DatabaseTestCase):
+    """
+    The destination is a second database of the test server
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.copy_name = 'dbal_test_sync_{}'.format(uuid.uuid4().hex[:12])
+        try:
+            cls.run_autocommit('CREATE DATABASE {}'.format(cls.copy_name))
+        except Exception as e:
+            raise unittest.SkipTest('The test database cannot be copied: {}'
+                                    .format(e))
+        config = dict(cls.db.db_config.config, DB_NAME=cls.copy_name)
+        cls.copy = Database(db_config=DatabaseConfig(config))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.copy.close_session()
+        cls.copy.engine.dispose()
+        cls.run_autocommit('DROP DATABASE {}'.format(cls.copy_name))
+
+    @classmethod
+    def run_autocommit(cls, sql):
+        conn = cls.db.engine.raw_connection()
+        try:
+            conn.connection.autocommit = True
+            conn.cursor().execute(sql)
+        finally:
+            conn.connection.autocommit = False
+            conn.close()
+
+    def run_copy(self, sql):
+        conn = self.copy.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            rows = cursor.fetchall() if cursor.description else None
+            conn.commit()
+        finally:
+            conn.close()
+        return rows
+
+    def sync(self, table):
+        coordinator = self.db.engine.raw_connection()
+        try:
+            snapshot, _ = export_snapshot(coordinator)
+            return sync_table(self.db, self.copy, snapshot, 'public', table,
+                              chunk_size=10)
+        finally:
+            coordinator.rollback()
+            coordinator.close()
+
+    def test_sync(self):
+        table = self.create_table('id INTEGER PRIMARY KEY, name TEXT')
+        self.run_copy('CREATE TABLE {} (id INTEGER PRIMARY KEY, name TEXT)'
+                      .format(table))
+        try:
+            self.run_sql("INSERT INTO {} SELECT n, 'row ' || n "
+                         "FROM generate_series(1, 50) n".format(table))
+            # Missing (1-10), updated (25) and deleted (100) rows in the copy
+            self.run_copy("INSERT INTO {} SELECT n, 'row ' || n "
+                          "FROM generate_series(11, 50) n".format(table))
+            self.run_copy("UPDATE {} SET name = 'changed' WHERE id = 25"
+                          .format(table))
+            self.run_copy("INSERT INTO {} VALUES (100, 'deleted')".format(table))
+
+            differing, ranges, _ = self.sync(table)
+            self.assertEqual((differing, ranges), (3, 6))
+            select = 'SELECT id, name FROM {} ORDER BY id'.format(table)
+            self.assertEqual(self.run_copy(select), self.run_sql(select))
+            self.assertEqual(self.sync(table)[0], 0)
+        finally:
+            self.run_copy('DROP TABLE {}'.format(table))
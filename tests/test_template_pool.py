@@ -0,0 +1,73 @@
+import unittest
+import uuid
+
+from dbal.Config.Config_db import DatabaseConfig
+from dbal.database import Database
+from dbal.scripts.template_pool import PoolTimeout, TemplatePool
+
+from tests.database_case import DatabaseTestCase
+
+
+class TestTemplatePool(DatabaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Another config object, since the test one is not in autocommit mode
+        cls.admin = Database(autocommit=True,
+                             db_config=DatabaseConfig(dict(cls.db.db_config.config)))
+        cls.template = 'dbal_test_template_{}'.format(uuid.uuid4().hex[:12])
+        try:
+            cls.admin.engine.execute('CREATE DATABASE {}'.format(cls.template))
+        except Exception as e:
+            raise unittest.SkipTest('The test user cannot create databases: {}'
+                                    .format(e))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.admin.engine.execute('DROP DATABASE IF EXISTS {}'.format(cls.template))
+        cls.admin.engine.dispose()
+
+    def setUp(self):
+        super().setUp()
+        self.pool = TemplatePool(self.admin, self.template, size=2,
+                                 refill_interval=0.1)
+
+    def tearDown(self):
+        self.pool.stop()
+        self.pool.drain()
+        super().tearDown()
+
+    def exists(self, name):
+        return bool(self.run_sql('SELECT 1 FROM pg_database WHERE datname = %s',
+                                 (name,)))
+
+    def test_not_autocommit(self):
+        with self.assertRaises(ValueError):
+            TemplatePool(self.db, self.template)
+
+    def test_acquire_from_the_pool(self):
+        self.assertEqual(self.pool.fill(), 2)
+        self.assertEqual(self.pool.fill(), 0)
+        name = self.pool.acquire()
+        try:
+            self.assertTrue(self.exists(name))
+            self.assertEqual(len(self.pool.ready_databases()), 1)
+            metrics = self.pool.metrics()
+            self.assertEqual((metrics['acquired'], metrics['misses']), (1, 0))
+        finally:
+            self.pool.release(name)
+        self.assertFalse(self.exists(name))
+
+    def test_acquire_from_an_empty_pool(self):
+        name = self.pool.acquire()
+        try:
+            self.assertEqual(self.pool.metrics()['misses'], 1)
+        finally:
+            self.pool.release(name, recycle=True)
+        self.assertFalse(self.exists(name))
+        self.assertEqual(len(self.pool.ready_databases()), 1)
+
+    def test_timeout(self):
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire(timeout=0.2)
@@ -0,0 +1,171 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dbal.transfer import CopyFormatError, TooManyRejectedRows, _SplitWriter, \
+    _chunks, export
+
+from tests.database_case import DatabaseTestCase
+
+
+class TestChunks(unittest.TestCase):
+
+    def test_split_at_lines(self):
+        data = b''.join(b'%d,row\n' % number for number in range(100))
+        chunks = _chunks(data, 0, len(data), 4)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(b''.join(data[start:end] for start, end in chunks), data)
+        for start, end in chunks:
+            self.assertTrue(data[start:end].endswith(b'\n'))
+
+    def test_more_workers_than_lines(self):
+        data = b'1\n2\n'
+        self.assertEqual(_chunks(data, 0, len(data), 8), [(0, 2), (2, 4)])
+
+
+class TestSplitWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'report.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_split_at_rows(self):
+        writer = _SplitWriter(self.path, split_size=10, header=True)
+        for data in (b'id\n', b'1111\n', b'2222\n', b'3333\n'):
+            writer.write(data)
+        writer.close()
+        self.assertEqual([os.path.basename(path) for path in writer.paths],
+                         ['report_0000.csv', 'report_0001.csv'])
+        contents = []
+        for path in writer.paths:
+            with open(path, 'rb') as file:
+                contents.append(file.read())
+        # The header is repeated in every file
+        self.assertEqual(contents, [b'id\n1111\n2222\n', b'id\n3333\n'])
+        self.assertEqual(writer.rows, 3)
+        self.assertEqual(writer.bytes, 18)
+
+    def test_compression(self):
+        writer = _SplitWriter(self.path + '.gz', compression='gzip')
+        writer.write(b'1\n')
+        writer.write(b'2\n')
+        writer.close()
+        with gzip.open(self.path + '.gz') as file:
+            self.assertEqual(file.read(), b'1\n2\n')
+
+    def test_unsupported(self):
+        with self.assertRaises(CopyFormatError):
+            _SplitWriter(self.path, compression='zip')
+        with self.assertRaises(CopyFormatError):
+            export(None, 'SELECT 1', self.path, file_format='binary', split_size=10)
+
+
+class TestExport(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.query = ("SELECT n AS id, 'name ' || n AS name "
+                      "FROM generate_series(1, 1000) n")
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_csv(self):
+        path = os.path.join(self.directory, 'rows.csv')
+        result = self.db.export(self.query, path)
+        self.assertEqual(result['files'], [path])
+        self.assertEqual(result['rows'], 1000)
+        with open(path) as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines[:2], ['id,name', '1,name 1'])
+        self.assertEqual(len(lines), 1001)
+        self.assertEqual(result['bytes'], os.path.getsize(path))
+
+    def test_jsonl(self):
+        path = os.path.join(self.directory, 'rows.jsonl')
+        self.db.export('''SELECT 1 AS id, 'a "quoted", text' AS name''', path,
+                       format='jsonl')
+        with open(path) as file:
+            self.assertEqual([json.loads(line) for line in file],
+                             [{'id': 1, 'name': 'a "quoted", text'}])
+
+    def test_split_gzip(self):
+        path = os.path.join(self.directory, 'rows.csv.gz')
+        result = self.db.export(self.query, path, compression='gzip', split_size=4000)
+        self.assertGreater(len(result['files']), 1)
+        ids = []
+        for part in result['files']:
+            with gzip.open(part, 'rt') as file:
+                lines = file.read().splitlines()
+            self.assertEqual(lines[0], 'id,name')
+            ids.extend(int(line.split(',')[0]) for line in lines[1:])
+        self.assertEqual(ids, list(range(1, 1001)))
+        self.assertEqual(result['rows'], 1000)
+
+
+class TestLoadFile(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.table = self.create_table('id INTEGER PRIMARY KEY, name TEXT')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def write_file(self, lines):
+        path = os.path.join(self.directory, 'rows.csv')
+        with open(path, 'w') as file:
+            file.write('id,name\n')
+            file.writelines(line + '\n' for line in lines)
+        return path
+
+    def count(self):
+        return self.run_sql('SELECT count(*) FROM {}'.format(self.table))[0][0]
+
+    def test_rows(self):
+        path = self.write_file('{},name {}'.format(n, n) for n in range(2000))
+        result = self.db.load_file(self.table, path, workers=4, commit='chunk')
+        self.assertEqual(result['rows'], 2000)
+        self.assertEqual(result['rejected'], 0)
+        self.assertGreater(result['rows_per_second'], 0)
+        self.assertEqual(self.count(), 2000)
+
+    def test_two_phase_commit(self):
+        if int(self.run_sql('SHOW max_prepared_transactions')[0][0]) < 4:
+            self.skipTest('The server does not allow prepared transactions')
+        path = self.write_file('{},name'.format(n) for n in range(1000))
+        result = self.db.load_file(self.table, path, workers=4, commit='all')
+        self.assertEqual(result['rows'], 1000)
+        self.assertEqual(self.count(), 1000)
+
+    def test_rejects(self):
+        lines = ['{},name'.format(n) for n in range(500)]
+        lines[17] = 'not a number,name'
+        lines[400] = '1,duplicated'
+        path = self.write_file(lines)
+        # One worker, so the first of the duplicated ids is the one loaded
+        result = self.db.load_file(self.table, path, workers=1, commit='chunk',
+                                   max_rejects=5)
+        self.assertEqual(result['rows'], 498)
+        self.assertEqual(result['rejected'], 2)
+        with open(path + '.rejects') as rejects:
+            self.assertEqual(sorted(rejects.read().splitlines()),
+                             ['1,duplicated', 'not a number,name'])
+        self.assertEqual(self.count(), 498)
+
+    def test_too_many_rejects(self):
+        path = self.write_file(['a,name', 'b,name', '3,name'])
+        with self.assertRaises(TooManyRejectedRows):
+            self.db.load_file(self.table, path, workers=1, commit='chunk',
+                              max_rejects=1)
+        self.assertEqual(self.count(), 0)
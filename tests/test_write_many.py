@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, Sequence, String
+from sqlalchemy.ext.declarative import declarative_base
+
+from tests.database_case import DatabaseTestCase
+
+TestBase = declarative_base()
+
+
+class Note(TestBase):
+    __tablename__ = 'dbal_test_write_many'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    note = Column(String)
+    status = Column(String, server_default='new')
+    created = Column(DateTime, default=datetime.utcnow, nullable=False)
+    number = Column(Integer, Sequence('dbal_test_write_many_number'))
+
+    def __init__(self, title):
+        # The constructor takes other arguments than the columns
+        self.name = title.lower()
+
+
+class TestWriteMany(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        TestBase.metadata.create_all(self.db.engine)
+
+    def tearDown(self):
+        self.db.rollback()
+        TestBase.metadata.drop_all(self.db.engine)
+
+    def test_python_defaults(self):
+        written = self.db.write_many(Note, [{'name': 'a'}, {'name': 'b'}])
+        self.assertTrue(all(isinstance(note.created, datetime) for note in written))
+        self.assertEqual(written[1].number, written[0].number + 1)
+
+    def test_attributes_set_by_some_rows(self):
+        written = self.db.write_many(Note, [{'name': 'x'},
+                                            {'name': 'y', 'note': 'kept'},
+                                            {'name': 'z', 'status': 'done'}])
+        self.assertEqual([note.name for note in written], ['x', 'y', 'z'])
+        self.assertEqual([note.note for note in written], [None, 'kept', None])
+        self.assertEqual([note.status for note in written], ['new', 'new', 'done'])
+        stored = self.run_sql('SELECT name, note, status FROM dbal_test_write_many '
+                              'ORDER BY id')
+        self.assertEqual(stored, [('x', None, 'new'), ('y', 'kept', 'new'),
+                                  ('z', None, 'done')])
+
+    def test_custom_constructor(self):
+        written = self.db.write_many(Note, [{'name': 'a'}])
+        self.assertIsInstance(written[0], Note)
+        self.assertIsNotNone(written[0].id)
+
+    def test_instances(self):
+        notes = [Note('First'), Note('Second')]
+        written = self.db.write_many(Note, notes)
+        self.assertEqual([id(note) for note in written], [id(note) for note in notes])
+        self.assertEqual(len({note.id for note in notes}), 2)
+        self.assertEqual(self.db.read_one(Note, Note.id == notes[1].id).name,
+                         'second')
+
+    def test_unknown_attributes(self):
+        with self.assertRaises(ValueError):
+            self.db.write_many(Note, [{'name': 'a', 'title': 'b'}])